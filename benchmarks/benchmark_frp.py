@@ -0,0 +1,322 @@
+"""
+benchmark_frp - Throughput and peak memory of the FRP inversion hot path
+
+Times `dualband_process.compute_FRP`, `gbu.GB_ratio_BP`, `gbu.detector_temperature_lookup` and
+`gbu.fit_received_bandpass_energy` on synthetic dualband traces from `simulation_utils`, a vectorized version of the
+blackbody signal simulation in scripts/simulate_blackbody_signal.py. Results are compared to a stored baseline, and the
+script exits with status 1 if any benchmark is slower, uses more memory, or recovers the simulated target temperature
+less accurately than the baseline allows.
+
+It also times the bulk DATLOG parser `dualband_clean.extract_dualband_datasets_from_raw_file` against the row by row
+reference reader `dualband_clean.read_dualband_dataset` on a synthetic file of about 10 MB, and exits with status 1 if
+the bulk parser is less than `--min-speedup` (10) times faster. The 10x target needs pyarrow, without it the speedup is
+reported but not checked.
+
+Usage:
+    python benchmarks/benchmark_frp.py                      # compare to benchmarks/baseline.json
+    python benchmarks/benchmark_frp.py --update-baseline    # record a new baseline on this machine
+    python benchmarks/benchmark_frp.py --sizes 1000 100000 --full --output results.json
+    python benchmarks/benchmark_frp.py --benchmarks compute_FRP --skip-datlog
+"""
+
+import io
+import csv
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from pathlib import Path
+
+import kremboxer.dualband.dualband_clean as dc
+import kremboxer.dualband.dualband_process as dp
+import kremboxer.utils.greybody_utils as gbu
+import kremboxer.utils.simulation_utils as su
+import kremboxer.utils.thermistor_utils as tu
+
+repo_dir = Path(__file__).resolve().parents[1]
+default_calibration = repo_dir.joinpath("calibration_data", "calibration_output", "FortStewart2024",
+                                        "FortStewart2024_Dualband_2024-09-18T15-52-17.839307.json")
+default_baseline = Path(__file__).resolve().parent.joinpath("baseline.json")
+
+DEFAULT_SIZES = [10**3, 10**4, 10**5, 10**6, 10**7]
+
+# Largest trace of the benchmarks that integrate the bandpasses for every sample, unless --full is given. At 10^7
+# samples each of them takes minutes.
+BANDPASS_MAX_SAMPLES = 10**5
+
+
+def setup_calibration(calibration_path: Path):
+    """
+    Load the dualband calibration and the ratio table used by the default "table" temperature solver
+    """
+    model_params, detect_temp_cal_data, F_MW, F_LW = dp.load_dualband_calibration_data(calibration_path)
+    ratio_table = gbu.build_ratio_table(F_MW, F_LW)
+    return {
+        "model_params": model_params,
+        "detect_temp_cal_data": detect_temp_cal_data,
+        "F_MW": F_MW,
+        "F_LW": F_LW,
+        "ratio_table": ratio_table,
+    }
+
+
+def bench_compute_FRP(cal: dict, n: int):
+    rad_data = su.simulate_dualband_trace(n, cal["F_MW"], cal["F_LW"], cal["model_params"],
+                                          cal["detect_temp_cal_data"], noise=0.05)
+
+    def run():
+        return dp.compute_FRP(rad_data, cal["F_MW"], cal["F_LW"], cal["model_params"], cal["detect_temp_cal_data"],
+                              cal["ratio_table"])
+
+    def check(rad_data_proc):
+        detected = rad_data_proc["T"].to_numpy() > 0
+        error = np.abs(rad_data_proc["T"].to_numpy() - rad_data["T_TRUE"].to_numpy())[detected]
+        return float(error.max()) if len(error) > 0 else 0.0
+    return run, check
+
+
+def bench_GB_ratio_BP(cal: dict, n: int):
+    T, _, _ = su.simulate_fire_trace(n, noise=0.05)
+
+    def run():
+        return gbu.GB_ratio_BP(T, cal["F_MW"], cal["F_LW"])
+    return run, None
+
+
+def bench_detector_temperature_lookup(cal: dict, n: int):
+    _, _, TD = su.simulate_fire_trace(n)
+    thermistor = tu.thermistor_from_cal_data(cal["detect_temp_cal_data"])
+    mV = su.thermistor_reading(thermistor, TD)
+    R = mV * thermistor.r_top / (thermistor.v_top - mV)
+    lookup = cal["detect_temp_cal_data"]["lookup"]
+
+    def run():
+        return gbu.detector_temperature_lookup(R, lookup)
+
+    def check(TDs):
+        return float(np.max(np.abs(TDs - TD)))
+    return run, check
+
+
+def bench_fit_received_bandpass_energy(cal: dict, n: int):
+    T = np.linspace(300., 2000., n)
+
+    def run():
+        return gbu.fit_received_bandpass_energy(cal["F_LW"], T)
+    return run, None
+
+
+# name: (setup function, largest number of samples by default)
+BENCHMARKS = {
+    "compute_FRP": (bench_compute_FRP, None),
+    "GB_ratio_BP": (bench_GB_ratio_BP, BANDPASS_MAX_SAMPLES),
+    "detector_temperature_lookup": (bench_detector_temperature_lookup, None),
+    "fit_received_bandpass_energy": (bench_fit_received_bandpass_energy, BANDPASS_MAX_SAMPLES),
+}
+
+
+def run_benchmark(run, check, n: int, repeats: int, min_seconds: float = 0.2):
+    """
+    Time `run` as the best of `repeats` rounds, each round calling it enough times to last `min_seconds` so that short
+    traces are not dominated by timer noise, then call it once more under tracemalloc to measure its peak memory
+    """
+    t0 = time.perf_counter()
+    result = run()
+    calls = max(1, int(np.ceil(min_seconds / max(time.perf_counter() - t0, 1e-9))))
+    del result
+
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for _ in range(calls):
+            run()
+        times.append((time.perf_counter() - t0) / calls)
+
+    tracemalloc.start()
+    result = run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(times)
+    record = {
+        "n_samples": n,
+        "seconds": best,
+        "samples_per_second": n / best,
+        "peak_memory_mb": peak / 2**20,
+    }
+    if check is not None:
+        record["max_error"] = check(result)
+    return record
+
+
+def write_datlog(path: Path, n_rows: int, n_datasets: int = 3):
+    """
+    Write a raw dualband file of `n_datasets` datasets of `n_rows` samples each, about 3 MB per 10^5 samples
+    """
+    rng = np.random.default_rng(0)
+    with open(path, "w", newline="") as fp:
+        fp.write("preamble\n")
+        for d in range(n_datasets):
+            fp.write("DAY,MONTH,YEAR,HOURS(UTC),MINUTES,SECONDS,SAMPLE-RATE(Hz),LATITUDE,LONGITUDE,GPS-TYPE\n")
+            fp.write(f"{27 + d},2,2024,23,59,55,1,31123456,-81654321,G\n")
+            fp.write("TH,LW-A,MW-B,\n")
+            buffer = io.StringIO()
+            np.savetxt(buffer, np.column_stack([rng.uniform(1000, 2000, n_rows), rng.normal(0, 50, n_rows),
+                                                rng.normal(0, 5, n_rows)]), fmt="%.6f", delimiter=",", newline=",\n")
+            fp.write(buffer.getvalue())
+
+
+def read_datlog_reference(path: Path):
+    with open(path, "r") as csvfile:
+        csvreader = csv.reader(csvfile)
+        row = next(csvreader, None)
+        while not row[0] == "DAY":
+            row = next(csvreader, None)
+        while row is not None:
+            row, _, _ = dc.read_dualband_dataset(path, csvreader, row)
+
+
+def benchmark_datlog_parse(n_rows: int, repeats: int):
+    """
+    Time the row by row reference reader once and the bulk parser as the best of `repeats` runs on the same file
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir).joinpath("DATLOG_07.CSV")
+        write_datlog(path, n_rows)
+        t0 = time.perf_counter()
+        read_datlog_reference(path)
+        reference_seconds = time.perf_counter() - t0
+        bulk_times = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            dc.extract_dualband_datasets_from_raw_file(path)
+            bulk_times.append(time.perf_counter() - t0)
+        file_mb = path.stat().st_size / 2**20
+    return {
+        "file_mb": file_mb,
+        "pyarrow": dc.pa is not None,
+        "reference_seconds": reference_seconds,
+        "seconds": min(bulk_times),
+        "speedup": reference_seconds / min(bulk_times),
+    }
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float):
+    """
+    List the regressions of `results` against `baseline`. Throughput may drop and peak memory may grow by the fraction
+    `tolerance`, the errors of the recovered temperatures may grow by 1e-3 K.
+    """
+    regressions = []
+    for name, records in results.items():
+        for key, record in records.items():
+            base = baseline.get(name, {}).get(key)
+            if base is None:
+                continue
+            if record["samples_per_second"] < base["samples_per_second"] * (1 - tolerance):
+                regressions.append(f"{name} n={key}: throughput {record['samples_per_second']:.3g} samples/s, "
+                                   f"baseline {base['samples_per_second']:.3g}")
+            if record["peak_memory_mb"] > base["peak_memory_mb"] * (1 + tolerance) + 1:
+                regressions.append(f"{name} n={key}: peak memory {record['peak_memory_mb']:.1f} MB, "
+                                   f"baseline {base['peak_memory_mb']:.1f}")
+            if "max_error" in base and record.get("max_error", np.inf) > base["max_error"] + 1e-3:
+                regressions.append(f"{name} n={key}: max error {record.get('max_error')} K, "
+                                   f"baseline {base['max_error']}")
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the FRP inversion hot path on synthetic traces")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="trace lengths in samples")
+    parser.add_argument("--benchmarks", nargs="+", default=list(BENCHMARKS.keys()), choices=list(BENCHMARKS.keys()))
+    parser.add_argument("--full", action="store_true",
+                        help=f"run the bandpass integration benchmarks beyond {BANDPASS_MAX_SAMPLES} samples")
+    parser.add_argument("--repeats", type=int, default=3, help="number of timed rounds, the fastest is reported")
+    parser.add_argument("--calibration", type=Path, default=default_calibration, help="dualband calibration json")
+    parser.add_argument("--baseline", type=Path, default=default_baseline, help="baseline results json")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed fractional loss of throughput and growth of peak memory")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--output", type=Path, default=None, help="also write the results to this json file")
+    parser.add_argument("--datlog-rows", type=int, default=10**5,
+                        help="samples in each of the 3 datasets of the DATLOG parse benchmark")
+    parser.add_argument("--min-speedup", type=float, default=10.,
+                        help="smallest allowed speedup of the bulk DATLOG parser, checked only with pyarrow")
+    parser.add_argument("--skip-datlog", action="store_true", help="skip the DATLOG parse benchmark")
+    args = parser.parse_args(argv)
+
+    cal = setup_calibration(args.calibration)
+    results = {}
+    for name in args.benchmarks:
+        setup, max_samples = BENCHMARKS[name]
+        results[name] = {}
+        for n in sorted(args.sizes):
+            if max_samples is not None and n > max_samples and not args.full:
+                continue
+            run, check = setup(cal, n)
+            record = run_benchmark(run, check, n, args.repeats)
+            results[name][str(n)] = record
+            error = f", max error {record['max_error']:.2e} K" if "max_error" in record else ""
+            print(f"{name:30s} n={n:<10d} {record['samples_per_second']:12.4g} samples/s "
+                  f"{record['peak_memory_mb']:10.1f} MB peak{error}")
+
+    datlog = None
+    if not args.skip_datlog:
+        datlog = benchmark_datlog_parse(args.datlog_rows, args.repeats)
+        print(f"{'datlog_parse':30s} {datlog['file_mb']:.1f} MB {datlog['seconds']:8.3f} s, reference "
+              f"{datlog['reference_seconds']:.3f} s, speedup {datlog['speedup']:.1f}x "
+              f"({'pyarrow' if datlog['pyarrow'] else 'loadtxt, install pyarrow for the 10x target'})")
+
+    output = {
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+        },
+        "results": results,
+    }
+    if datlog is not None:
+        output["datlog_parse"] = datlog
+    if args.output is not None:
+        with open(args.output, "w") as fp:
+            json.dump(output, fp, indent=4)
+
+    speedup_failed = datlog is not None and datlog["pyarrow"] and datlog["speedup"] < args.min_speedup
+    if speedup_failed:
+        print(f"REGRESSION: datlog_parse: speedup {datlog['speedup']:.1f}x, required {args.min_speedup:g}x")
+
+    if args.update_baseline:
+        baseline = {"machine": output["machine"], "results": {}}
+        if args.baseline.exists():
+            with open(args.baseline) as fp:
+                baseline = json.load(fp)
+        baseline["machine"] = output["machine"]
+        for name, records in results.items():
+            baseline["results"].setdefault(name, {}).update(records)
+        with open(args.baseline, "w") as fp:
+            json.dump(baseline, fp, indent=4)
+        print(f"Updated baseline {args.baseline}")
+        return 1 if speedup_failed else 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+        return 1 if speedup_failed else 0
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)
+    if baseline["machine"] != output["machine"]:
+        print(f"Warning! Baseline was recorded on a different machine: {baseline['machine']}")
+    regressions = compare_to_baseline(results, baseline["results"], args.tolerance)
+    for regression in regressions:
+        print("REGRESSION:", regression)
+    if len(regressions) > 0 or speedup_failed:
+        return 1
+    print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
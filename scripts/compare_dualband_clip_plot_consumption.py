@@ -1,8 +1,8 @@
 import numpy as np
 import pandas as pd
-import geopandas as gpd
 import matplotlib.pyplot as plt
 from pathlib import Path
+import kremboxer.utils.catalog_utils as catalog_utils
 
 #plt.rcParams['text.usetex'] = True
 pd.set_option('display.max_columns', None)
@@ -12,7 +12,8 @@ rad_file = Path("/home/jepaki/Projects/Objects/Eglin_2023/FireBehaviorDatasets/D
 biomass_file = Path("/ws3/gis_lab/project/SERDP_Objects-IRProcessing/FuelsData/Eglin_2023/EAB2023BiomassData_kg_1m2_energy.csv")
 output_dir = Path("/ws3/gis_lab/project/SERDP_Objects-IRProcessing/FuelsData/Eglin_2023")
 
-rad_df = gpd.read_file(rad_file)
+catalog = catalog_utils.DatasetCatalog(rad_file.parent, rad_file)
+rad_df = catalog.records
 biomass_df = pd.read_csv(biomass_file)
 
 print(rad_df.columns)
@@ -170,13 +171,12 @@ for i, rad_row in rad_filt_gdf.iterrows():
     clip_plot = rad_row["ClipPlot"]
     if clip_plot in rad_plots_to_vis:
         axs[0].text(x=rad_row["Consumption_AllFuels"], y=rad_row["Consumption_Radiometer"], s=clip_plot)
-        frp_file = rad_file.parent / rad_row["PROCESSING_LEVEL"] / rad_row["SENSOR"] / rad_row["DATAFILE"]
-        print(clip_plot, frp_file)
+        print(clip_plot, catalog.path(rad_row))
         print(rad_row["MW_FRE"], rad_row["Consumption_Radiometer"])
-        frp_df = pd.read_csv(frp_file)
+        frp_df = catalog.trace(rad_row, ["DATETIME", "LW_FRP"])
         pstart_ind = rad_row["pstart_ind"]
         pend_ind = rad_row["pend_ind"]
-        dts = np.array(pd.to_datetime(frp_df["DATETIME"]))[pstart_ind:pend_ind]
+        dts = np.array(frp_df["DATETIME"])[pstart_ind:pend_ind]
         frps = np.array(frp_df["LW_FRP"])[pstart_ind:pend_ind]
         axs[1].plot(frps, label=f'{clip_plot}, {rad_row["UNIT"]}')
 
@@ -1,17 +1,18 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
-import geopandas as gpd
 import plotly.graph_objects as go
 from fsspec.implementations.local import trailing_sep
 from plotly.subplots import make_subplots
 from pathlib import Path
+import kremboxer.utils.catalog_utils as catalog_utils
 
 rad_data_dir = Path.home() / "Projects" / "Objects" / "FortStewart_2022-03" / "FireBehaviorDatasets"
 plot_dir = rad_data_dir / "plot"
 plot_dir.mkdir(parents=True, exist_ok=True)
 db_meta_file = rad_data_dir / "Dualband_processed_metadata.geojson"
-db_gdf = gpd.read_file(db_meta_file)
+catalog = catalog_utils.DatasetCatalog(rad_data_dir, db_meta_file)
+db_gdf = catalog.records
 db_gdf["fire_start"] = pd.to_datetime(db_gdf["fire_start"])
 db_gdf["fire_end"] = pd.to_datetime(db_gdf["fire_end"])
 db_gdf["max_FRP_datetime"] = pd.to_datetime(db_gdf["max_FRP_datetime"])
@@ -20,12 +21,7 @@ print(db_gdf.describe())
 print(f"Number dualband datasets: {len(db_gdf)}")
 
 row = db_gdf.loc[4]
-db_datafile = rad_data_dir / row["PROCESSING_LEVEL"] / row["SENSOR"] / row["DATAFILE"]
-db_df = gpd.read_file(db_datafile)
-db_df["DATETIME"] = pd.to_datetime(db_df["DATETIME"])
-
-db_df = db_df[db_df["DATETIME"] >= row["fire_start"]]
-db_df = db_df[db_df["DATETIME"] <= row["fire_end"]]
+db_df = catalog.trace(row, ["DATETIME", "MW_FRP"], row["fire_start"], row["fire_end"])
 frp = db_df["MW_FRP"].astype("float")
 
 max_frp_datetime = row["max_FRP_datetime"]
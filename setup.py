@@ -119,8 +119,8 @@ setup(
         "fiona",
         "scipy",
         "pytest",
-        "pandas",
-        "geopandas",
+        "pandas>=2.0",
+        "geopandas>=1.0",
         "celluloid",
         "fsspec",
         "openpyxl",
@@ -141,5 +141,11 @@ setup(
             "sphinx-rtd-theme",
             "myst_parser"
         ],
+        "columnar": [
+            "pyarrow"
+        ],
+        "hdf5": [
+            "h5py"
+        ],
     },
 )
\ No newline at end of file
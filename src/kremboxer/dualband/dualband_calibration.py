@@ -3,9 +3,11 @@ import matplotlib.pyplot as plt
 from pathlib import Path
 import json
 import shutil
-import scipy.optimize as so
 import scipy.constants as sc
 import kremboxer.utils.greybody_utils as gbu
+import kremboxer.utils.quadrature_utils as qu
+import kremboxer.utils.thermistor_utils as tu
+import kremboxer.utils.common_utils as kcu
 import datetime
 
 
@@ -55,6 +57,8 @@ def compute_dualband_calibration(cal_params: dict):
         "v_top": voltage applied across the internal temperature sensor voltage divider
         "r_top": resistance of resistor in internal temperature sensor voltage divider
         "calibration_outputs_folder": folder to store the calibration results
+        "bandpass_quadrature": optional quadrature rule for the bandpass integrals, "rectangle" (default), "trapezoid"
+            or "simpson"
 
     Returns
     -------
@@ -90,15 +94,20 @@ def compute_dualband_calibration(cal_params: dict):
     # Load the bandpass functions for the two sensors
     f_mw = np.loadtxt(MW_bandpass_path, delimiter=',', skiprows=1, usecols=[0, 1])
     f_lw = np.loadtxt(LW_bandpass_path, delimiter=',', skiprows=1, usecols=[0, 1])
+    quadrature = cal_params.get("bandpass_quadrature", "rectangle")
+    for band, f in [("MW", f_mw), ("LW", f_lw)]:
+        print(f"{band} bandpass {quadrature} quadrature relative error estimate: {qu.quadrature_error_estimate(f, quadrature):.2e}")
+    if quadrature != "rectangle":
+        f_mw = qu.attach_quadrature_weights(f_mw, quadrature)
+        f_lw = qu.attach_quadrature_weights(f_lw, quadrature)
 
     # Load the blackbody calibration data
     blackbody_cal_data = np.loadtxt(cal_input_path, delimiter=",", skiprows=1)
 
-    # Convert the temperature sensor mV data into resistance, using known voltage divider characteristics
+    # Temperature sensor mV data, converted into resistance using known voltage divider characteristics
     t_mV = blackbody_cal_data[:, 1]
     v_top = cal_params["v_top"]  # voltage at the top of divider in mV
     r_top = cal_params["r_top"]  # 100kOhm resistor in voltage divider
-    t_resist = t_mV * r_top / (v_top - t_mV)  # Convert mV reading into resistance of temperature sensor
 
     # Load actual temperatures and detector signals from calibration data
     t_actual = blackbody_cal_data[:, 0]
@@ -106,9 +115,8 @@ def compute_dualband_calibration(cal_params: dict):
     v_mw = blackbody_cal_data[:, 3]
 
     # Compute the temperature of the detector from its resistance
-    t_cal_data = np.loadtxt(temp_cal_input_path, skiprows=1, delimiter=",", usecols=[0, 1, 2])
-    t_cal_data = np.flip(t_cal_data, 0)
-    t_temp = gbu.detector_temperature_lookup(R=t_resist, temp_cal_data=t_cal_data)
+    thermistor = tu.ThermistorModel.from_csv(temp_cal_input_path, v_top, r_top)
+    t_temp = thermistor.temperature(t_mV)
 
     # Fit a polynomial for the blackbody energy received by each sensor, W~A*T**N
     # LW
@@ -117,11 +125,9 @@ def compute_dualband_calibration(cal_params: dict):
 
     # Now fit the detector model with the calibration data to get G and AL
     # Note that since the detector temp barely changes during calibration, we set it to a constant 300 K during this fit
-    (G_LW, AL_LW), pcov_LW = so.curve_fit(lambda T, G, AL: gbu.detector_model(T, G, AL, 300, A_LW, N_LW),
-                                          t_actual, v_lw)
+    G_LW, AL_LW, pcov_LW = kcu.fit_detector_model(t_actual, 300, v_lw, A_LW, N_LW)
     # TODO: Left out the 0 at the beginning of MW data, caused optimizer to crash, handle better
-    (G_MW, AL_MW), pcov_MW = so.curve_fit(lambda T, G, AL: gbu.detector_model(T, G, AL, 300, A_MW, N_MW),
-                                          t_actual[1:], v_mw[1:], maxfev=1000)
+    G_MW, AL_MW, pcov_MW = kcu.fit_detector_model(t_actual[1:], 300, v_mw[1:], A_MW, N_MW)
     print("Dualband Calibration Values:")
     print("LW: N_LW=", N_LW, ", A_LW=", A_LW, ", G_LW=", G_LW, ", AL_LW=", AL_LW)
     print("MW: N_MW=", N_MW, ", A_MW=", A_MW, ", G_MW=", G_MW, ", AL_MW=", AL_MW)
@@ -137,9 +143,10 @@ def compute_dualband_calibration(cal_params: dict):
     W_GB_MW = v_mw / G_MW + AL_MW * t_temp ** N_MW
     ratios = W_GB_MW / W_GB_LW
     t_predict = np.zeros_like(t_actual)
-    for i in range(0, len(t_actual)):
-        if v_lw[i] > 0 and v_mw[i] > 0:
-            t_predict[i] = so.brentq(lambda Ts: gbu.GB_ratio_BP(Ts, f_mw, f_lw) - ratios[i], 200, 2000)
+    detected = (v_lw > 0) & (v_mw > 0)
+    t_predict[detected], converged, iterations = gbu.solve_ratio_temperature(ratios[detected], f_mw, f_lw, 200, 2000)
+    if not converged.all():
+        print("Unable to predict temperature for calibration temperatures ", t_actual[detected][~converged])
 
     # Compute eA from actual and predicted blackbody power
     eA_LW = W_GB_LW / gbu.planck_model(t_predict, A_LW, N_LW)  # WD_LW
@@ -162,6 +169,7 @@ def compute_dualband_calibration(cal_params: dict):
         "temp_cal_input": str(temp_cal_input_path.name),
         "LW_bandpass": str(LW_bandpass_path.name),
         "MW_bandpass": str(MW_bandpass_path.name),
+        "bandpass_quadrature": quadrature,
         "r_top": r_top,
         "v_top": v_top,
         "LW": {
@@ -247,9 +255,7 @@ def compute_dualband_calibration(cal_params: dict):
 
     # Compare predicted and measured ratios (computed Ratios Theory in two slightly different ways as sanity check)
     axs[2, 1].plot(t_actual, wd_mw / wd_lw, '--', label="Ratios Theory")
-    ratio_predicted = []
-    for T in t_actual:
-        ratio_predicted.append(gbu.GB_ratio_BP(T, f_mw, f_lw))
+    ratio_predicted = gbu.GB_ratio_BP(t_actual, f_mw, f_lw)
     axs[2, 1].plot(t_actual, ratio_predicted, '-*', label="Ratios Theory")
     axs[2, 1].plot(t_actual, W_GB_MW / W_GB_LW, label="Ratios Actual")
     axs[2, 1].legend()
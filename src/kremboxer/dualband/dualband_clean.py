@@ -1,12 +1,23 @@
+import io
 import csv
 from pathlib import Path
 import numpy as np
 import pandas as pd
 import datetime
 import kremboxer.dualband.dualband_utils as kddu
+import kremboxer.utils.common_utils as kucu
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
 
 
 def read_dualband_dataset(file: Path, csvreader, first_row):
+    """
+    Row by row reader of one dataset, kept as the reference implementation of `parse_dualband_block`
+    """
     header_titles = first_row
     header_values = next(csvreader, None)
     header_dict = kddu.construct_dualband_header_dict(header_titles, header_values)
@@ -42,28 +53,95 @@ def read_dualband_dataset(file: Path, csvreader, first_row):
     return return_row, header_dict, data_df
 
 
-def extract_dualband_datasets_from_raw_file(file: Path):
+def dualband_unit_from_file(file: Path) -> str:
+    """
+    Unit ID of a raw dualband file, from its name like "DATLOG_<unit>.CSV"
+
+    :group: dualband_clean
+    """
+    unit = Path(file).stem.split("_")[1]
+    return unit.lstrip("0")   # Strip leading 0 from unit ID string extracted from file name, i.e. '07' -> '7'
+
+
+def parse_sample_rows(data_bytes: bytes, n_columns: int) -> np.ndarray:
+    """
+    Parse comma separated sample rows into a float64 array of their first `n_columns` fields, with the multithreaded
+    CSV reader of pyarrow if it is installed and a single `np.loadtxt` call otherwise, or when the rows have differing
+    numbers of fields. Both round each field to the nearest float64, as `float` does.
+
+    :param data_bytes: sample rows
+    :param n_columns: number of leading fields of each row to parse
+    :return: array of shape (rows, n_columns)
+    :group: dualband_clean
+    """
+    if data_bytes == b"" or data_bytes.isspace():
+        return np.zeros((0, n_columns))
+    if pa is not None:
+        columns = [f"f{i}" for i in range(n_columns)]
+        try:
+            table = pa_csv.read_csv(pa.py_buffer(data_bytes),
+                                    read_options=pa_csv.ReadOptions(autogenerate_column_names=True),
+                                    parse_options=pa_csv.ParseOptions(newlines_in_values=False),
+                                    convert_options=pa_csv.ConvertOptions(
+                                        include_columns=columns, column_types={c: pa.float64() for c in columns}))
+            return np.column_stack([table.column(c).to_numpy() for c in columns])
+        except pa.ArrowInvalid:
+            pass  # Rows with differing numbers of fields, which only loadtxt accepts
+    return np.loadtxt(io.BytesIO(data_bytes), delimiter=",", usecols=range(n_columns), dtype=np.float64, ndmin=2,
+                      comments=None)
+
+
+def parse_dualband_block(block: bytes, epoch_column=False):
+    """
+    Parse one dataset of a DATLOG file, the header rows with `csv` and the samples with `parse_sample_rows` into
+    float64 columns. Sample times are computed as an int64 epoch array, one second apart as in `read_dualband_dataset`,
+    and cast into a datetime64 "DATETIME" column.
+
+    :param block: contents of the dataset, starting at its "DAY" header row, see `common_utils.find_dataset_blocks`
+    :param epoch_column: also return the sample times as an int64 "EPOCH" column of seconds since 1970
+    :return: (header_dict, data_df)
+    :group: dualband_clean
+    """
+    lines = block.split(b"\n", 3)
+    header_rows = list(csv.reader(line.decode().rstrip("\r") for line in lines[:3]))
+    header_titles, header_values = header_rows[0], header_rows[1]
+    header_dict = kddu.construct_dualband_header_dict(header_titles, header_values)
+    data_columns = [x for x in header_rows[2] if not x == '']
+
+    values = parse_sample_rows(lines[3] if len(lines) > 3 else b"", len(data_columns))
+
+    start = header_dict["DATETIME_START"]
+    epoch = kucu.datetime_to_epoch(start) + np.arange(len(values), dtype=np.int64)
+
+    data_dict = {data_column: values[:, i] for i, data_column in enumerate(data_columns)}
+    data_dict["DATETIME"] = kucu.epoch_to_datetime64(epoch, utc=start.tzinfo is not None)
+    if epoch_column:
+        data_dict["EPOCH"] = epoch
+    data_df = pd.DataFrame(data_dict)
+    return header_dict, data_df
+
+
+def extract_dualband_datasets_from_raw_file(file: Path, epoch_column=False):
+    """
+    Parse every dataset in a raw dualband DATLOG file. The file is read at once, the dataset boundaries are located
+    from the "DAY" header rows, and each dataset is parsed with `parse_dualband_block`.
+
+    :param file: raw DATLOG csv file, named like "DATLOG_<unit>.CSV"
+    :param epoch_column: also return the sample times as an int64 "EPOCH" column of seconds since 1970
+    :return: (header_dicts, data_dfs), lists with one entry per dataset
+    :group: dualband_clean
+    """
     header_dicts = []
     data_dfs = []
-    unit = file.stem.split("_")[1]
-    unit = unit.lstrip("0")   # Strip leading 0 from unit ID string extracted from file name, i.e. '07' -> '7'
-    with open(file, 'r') as csvfile:
-        csvreader = csv.reader(csvfile)
-
-        # Find first dataset header
-        row = next(csvreader, None)
-        while not row[0] == 'DAY':
-            row = next(csvreader, None)
+    unit = dualband_unit_from_file(file)
+    with open(file, 'rb') as csvfile:
+        data = csvfile.read()
 
-        row, header_dict, data_df = read_dualband_dataset(file, csvreader, row)
+    for start, end in kucu.find_dataset_blocks(data, b"DAY"):
+        header_dict, data_df = parse_dualband_block(data[start:end], epoch_column)
         header_dict['UNIT'] = unit
         header_dicts.append(header_dict)
         data_dfs.append(data_df)
-        while not row is None:
-            row, header_dict, data_df = read_dualband_dataset(file, csvreader, row)
-            header_dict['UNIT'] = unit
-            header_dicts.append(header_dict)
-            data_dfs.append(data_df)
 
-        print("Finished processing file: ", file)
+    print("Finished processing file: ", file)
     return header_dicts, data_dfs
@@ -1,7 +1,6 @@
 from pathlib import Path
 import datetime
 import numpy as np
-import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
@@ -12,9 +11,11 @@ from shapely.geometry import Point
 from tqdm import tqdm
 import kremboxer.utils.greybody_utils as gbu
 import kremboxer.utils.common_utils as cu
+import kremboxer.utils.catalog_utils as catalog_utils
 
 
 def animate_burn_units(db_gdf: gpd.GeoDataFrame, bu_gdf: gpd.GeoDataFrame, archive_dir: Path, vis_dir: Path, burn_name: str):
+    catalog = catalog_utils.DatasetCatalog(archive_dir, db_gdf)
     db_burn_units = db_gdf.burn_unit.unique()
 
     for bu in db_burn_units:
@@ -31,11 +32,9 @@ def animate_burn_units(db_gdf: gpd.GeoDataFrame, bu_gdf: gpd.GeoDataFrame, archi
         # Collect data from dualband datasets to create animation
         rad_data = {}
         for i, row in db_in_bu_gdf.iterrows():
-            # Load each dataset into a pandas dataframe
-            proc_data_filepath = archive_dir / row["PROCESSING_LEVEL"] / row["SENSOR"] / row["DATAFILE"]
+            # Load each dataset into a pandas dataframe, shared with the other plots through the catalog's trace cache
             rad_id = row["UNIT"]
-            rad_df = pd.read_csv(proc_data_filepath)
-            rad_df['DATETIME'] = pd.to_datetime(rad_df['DATETIME'])
+            rad_df = catalog.trace(row, ["DATETIME", "LW_FRP"])
 
             # Figure out where the max FRP occurs and only plot data in a time window around it (reduces time to render plot)
             max_frp_datetime = row['max_FRP_datetime']
@@ -138,6 +137,7 @@ def plot_dualband_burn_unit_maps(db_gdf: gpd.GeoDataFrame, bu_gdf: gpd.GeoDataFr
 
 
 def plot_dualband_frp(db_gdf: gpd.GeoDataFrame, archive_dir: Path, vis_dir:Path, burn_name: str):
+    catalog = catalog_utils.DatasetCatalog(archive_dir, db_gdf)
     db_burn_units = db_gdf.burn_unit.unique()
     for bu in db_burn_units:
         db_in_bu_gdf = db_gdf[db_gdf.burn_unit == bu]
@@ -147,11 +147,9 @@ def plot_dualband_frp(db_gdf: gpd.GeoDataFrame, archive_dir: Path, vis_dir:Path,
         fig_combine, axs_combine = plt.subplots(1, figsize=(8,8))
 
         for i, row in db_in_bu_gdf.iterrows():
-            # Load each dataset into a pandas dataframe
-            proc_data_filepath = archive_dir / row["PROCESSING_LEVEL"] / row["SENSOR"] / row["DATAFILE"]
+            # Load each dataset into a pandas dataframe, shared with the other plots through the catalog's trace cache
             rad_id = row["UNIT"]
-            rad_df = pd.read_csv(proc_data_filepath)
-            rad_df['DATETIME'] = pd.to_datetime(rad_df['DATETIME'])
+            rad_df = catalog.trace(row, ["DATETIME", "LW_FRP"])
 
             # Figure out where the max FRP occurs and only plot data in a time window around it (reduces time to render plot)
             max_frp_datetime = row['max_FRP_datetime']
@@ -183,7 +181,7 @@ def vis_dualband_datasets(dualband_processed_metadata: Path, data_vis_params: di
     vis_dir = archive_dir.joinpath('Visualisation').joinpath('dualband')
     vis_dir.mkdir(parents=True, exist_ok=True)
 
-    db_gdf = gpd.read_file(dualband_processed_metadata)
+    db_gdf = catalog_utils.read_metadata(dualband_processed_metadata)
     db_gdf.to_crs(data_vis_params['projection'], inplace=True)
     bu_gdf = gpd.read_file(data_vis_params['burn_units'])
     bu_gdf.to_crs(data_vis_params['projection'], inplace=True)
@@ -1,5 +1,6 @@
+import io
 import re
-import csv
+import mmap
 from pathlib import Path
 import datetime
 from PIL import Image
@@ -9,6 +10,7 @@ import geopandas as gpd
 import datetime
 import scipy
 import matplotlib.pyplot as plt
+import kremboxer.utils.common_utils as kucu
 import kremboxer.fiveband.fiveband_utils as fb_utils
 
 
@@ -24,7 +26,31 @@ def construct_datetime(year, month, day, hours_utc, minutes, seconds):
                            tzinfo=datetime.timezone.utc)
     return dt
 
-def construct_fiveband_header_dict(data_file_path: Path, fb_df: pd.DataFrame):
+# Columns of the raw fiveband files and their types, the GPS fields are empty until the GPS gets a fix
+FIVEBAND_COLUMNS = {
+    'TIME': float,
+    'STATUS': str,
+    'LAT': float,
+    'N|S': str,
+    'LONG': float,
+    'E|W': str,
+    'SPEED': float,
+    'COURSE': float,
+    'DATE': float,
+    'TH1': float,
+    '3.95': float,
+    '10.95': float,
+    'TH2': float,
+    'MW': float,
+    'LW': float,
+    'WIDE': float
+}
+
+# Sample period assumed when a dataset has fewer than two GPS fixes, fiveband units log once per second
+DEFAULT_SAMPLE_PERIOD_US = 1000000
+
+
+def construct_fiveband_header_dict(data_file_path: Path, fb_df: pd.DataFrame, sample_rate: float = 1.0):
     datalog_file = data_file_path.stem
     datalog_parent_folder = data_file_path.parent.stem
 
@@ -48,109 +74,146 @@ def construct_fiveband_header_dict(data_file_path: Path, fb_df: pd.DataFrame):
     header_dict['HOURS(UTC)'] = start_dt.hour
     header_dict['MINUTES'] = start_dt.minute
     header_dict['SECONDS'] = start_dt.second
-    header_dict['SAMPLE-RATE(Hz)'] = 1.0
-    ave_lat = fb_df['LAT'].mean() / 100
-    ave_lon = -fb_df['LONG'].mean() / 100
-    header_dict['LATITUDE'] = ave_lat
-    header_dict['LONGITUDE'] = ave_lon
+    header_dict['SAMPLE-RATE(Hz)'] = sample_rate
+    header_dict['LATITUDE'] = fb_df['LATITUDE'].mean()
+    header_dict['LONGITUDE'] = fb_df['LONGITUDE'].mean()
     header_dict["DATETIME_START"] = start_dt
     return header_dict
 
 
-def extract_fiveband_datasets_from_raw_file(file: Path):
-
-    fb_data_cols = {
-        'TIME': float,
-        'STATUS': str,
-        'LAT': float,
-        'N|S': str,
-        'LONG': float,
-        'E|W': str,
-        'SPEED': float,
-        'COURSE': float,
-        'DATE': float,
-        'TH1': float,
-        '3.95': float,
-        '10.95': float,
-        'TH2': float,
-        'MW': float,
-        'LW': float,
-        'WIDE': float
-    }
-
-    csvreader = csv.reader(open(file, 'r'))
+def decode_gps_epoch(time: np.ndarray, date: np.ndarray):
+    """
+    Decode the GPS time (hhmmss.sss) and date (ddmmyy) fields of every row into microseconds since 1970
+
+    :param time: float array of GPS times, NaN without a fix
+    :param date: float array of GPS dates, NaN without a fix
+    :return: (epoch, valid), int64 array of the times and bool array of the rows with a valid time and date
+    :group: fiveband_clean
+    """
+    time = np.asarray(time, dtype=np.float64)
+    date = np.asarray(date, dtype=np.float64)
+    valid = np.isfinite(time) & np.isfinite(date) & (time >= 0) & (time < 240000)
+    date = np.where(valid, date, 10100).astype(np.int64)
+    day, month, year = date // 10000, date // 100 % 100, 2000 + date % 100
+    valid &= (day >= 1) & (day <= 31) & (month >= 1) & (month <= 12)
+    day, month = np.where(valid, day, 1), np.where(valid, month, 1)
+
+    months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    dates = months.astype("datetime64[D]") + (day - 1)
+    # Days past the end of their month, e.g. 31 February, roll over into the next month
+    valid &= dates.astype("datetime64[M]") == months
+    days = (dates - np.datetime64(0, "D")).astype(np.int64)
+    time_us = np.round(np.where(valid, time, 0) * 1000000).astype(np.int64)
+    hours, minutes, micros = time_us // 10000000000, time_us // 100000000 % 100, time_us % 100000000
+    valid &= (minutes < 60) & (micros < 60000000)
+    epoch = ((days * 24 + hours) * 60 + minutes) * 60000000 + micros
+    return epoch, valid
+
+
+def decode_gps_coordinate(value: np.ndarray, hemisphere: np.ndarray, negative: str) -> np.ndarray:
+    """
+    Decode GPS coordinates of every row from (d)ddmm.mmmm to signed decimal degrees
+
+    :param value: float array of the coordinates, NaN without a fix
+    :param hemisphere: array of the hemisphere letters
+    :param negative: hemisphere of negative coordinates, "S" or "W"
+    :return: float array of decimal degrees, NaN without a fix
+    :group: fiveband_clean
+    """
+    value = np.asarray(value, dtype=np.float64)
+    degrees = np.floor(value / 100) + np.mod(value, 100) / 60
+    return np.where(np.asarray(hemisphere == negative, dtype=bool), -degrees, degrees)
+
+
+def reconstruct_sample_times(epoch: np.ndarray, valid: np.ndarray):
+    """
+    Time of every sample of a dataset from the rows with a GPS fix. Samples with a fix keep their GPS time, samples
+    between two fixes are interpolated, and samples before the first or after the last fix are extrapolated with the
+    median sample period of the fixes, so gaps and drifts of the logger clock are followed instead of assuming one
+    sample per second.
+
+    :param epoch: int64 array of the GPS times in microseconds since 1970, see `decode_gps_epoch`
+    :param valid: bool array of the rows with a GPS fix
+    :return: (epoch, period), int64 array of the sample times and the median sample period in microseconds, None if
+        no row has a fix
+    :group: fiveband_clean
+    """
+    fixes = np.flatnonzero(valid)
+    if len(fixes) == 0:
+        return None, DEFAULT_SAMPLE_PERIOD_US
+    fix_epoch = epoch[fixes]
+    period = DEFAULT_SAMPLE_PERIOD_US
+    if len(fixes) > 1:
+        periods = np.diff(fix_epoch) / np.diff(fixes)
+        if np.median(periods) > 0:
+            period = np.median(periods)
+
+    rows = np.arange(len(epoch))
+    times = np.interp(rows, fixes, fix_epoch - fix_epoch[0]) + fix_epoch[0]
+    times = np.where(rows < fixes[0], fix_epoch[0] - (fixes[0] - rows) * period, times)
+    times = np.where(rows > fixes[-1], fix_epoch[-1] + (rows - fixes[-1]) * period, times)
+    times = np.round(times).astype(np.int64)
+    times[fixes] = fix_epoch
+    return times, period
+
+
+def parse_fiveband_block(block, file: Path = None) -> pd.DataFrame:
+    """
+    Parse one dataset of a raw fiveband file straight into typed columns with a single `pd.read_csv` call, decode the
+    GPS time, date and coordinates of every row, and add the time of every sample as a UTC "DATETIME" column, see
+    `reconstruct_sample_times`, and the coordinates in decimal degrees as "LATITUDE" and "LONGITUDE" columns.
+
+    :param block: bytes or memoryview of the dataset, starting at its "TIME" header row, see
+        `common_utils.find_dataset_blocks`
+    :param file: raw file of the dataset, for log messages
+    :return: (fb_df, sample_rate), the dataset and its sample rate in Hz estimated from the GPS fixes
+    :group: fiveband_clean
+    """
+    fb_df = pd.read_csv(io.BytesIO(block), dtype=FIVEBAND_COLUMNS, index_col=False, skip_blank_lines=True)
+
+    epoch, valid = decode_gps_epoch(fb_df['TIME'].to_numpy(), fb_df['DATE'].to_numpy())
+    sample_epoch, period = reconstruct_sample_times(epoch, valid)
+    if sample_epoch is None:
+        print(f"Unknown datetime for dataset in {file}, using 2000-01-01T00:00:00")
+        start = kucu.datetime_to_epoch(datetime.datetime(2000, 1, 1), unit="us")
+        sample_epoch = start + period * np.arange(len(fb_df), dtype=np.int64)
+    fb_df['DATETIME'] = kucu.epoch_to_datetime64(sample_epoch, unit="us")
+    fb_df['LATITUDE'] = decode_gps_coordinate(fb_df['LAT'].to_numpy(), fb_df['N|S'].to_numpy(), "S")
+    fb_df['LONGITUDE'] = decode_gps_coordinate(fb_df['LONG'].to_numpy(), fb_df['E|W'].to_numpy(), "W")
+    return fb_df, 1000000 / period
+
+
+def extract_fiveband_datasets_from_raw_file(file: Path, plot_dir: Path = None):
+    """
+    Parse every dataset with samples in a raw fiveband file, see `parse_fiveband_block`. The file is memory mapped and
+    the datasets are located from their "TIME" header rows, so multi day logs are parsed one dataset at a time.
+
+    :param file: raw fiveband csv file
+    :param plot_dir: optional directory to save a plot of the raw data of each dataset to
+    :return: (header_dicts, data_dfs, optical_image_cubes, ir_image_cubes), lists with one entry per dataset, the
+        image cubes are empty as fiveband units do not record images
+    :group: fiveband_clean
+    """
+    file = Path(file)
     header_dicts = []
     data_dfs = []
     optical_image_cubes = []
     ir_image_cubes = []
-
-    # Read until beginning of first dataset, look for column titles
-    row = next(csvreader, None)
-    while not row is None and not row[0] == 'TIME':
-        row = next(csvreader, None)
-
-    # This would mean there is no header line in the datafile
-    if row is None:
+    if file.stat().st_size == 0:
         return header_dicts, data_dfs, optical_image_cubes, ir_image_cubes
 
-    while not row is None:
-        col_labels = row
-        data_dict = {}
-        for col_label in col_labels:
-            data_dict[col_label] = []
-        row = next(csvreader, None)
-        while not row is None and not row[0] == 'TIME':
-            for i, col_label in enumerate(col_labels):
-                if row[i]=='':
-                    data_dict[col_label].append(None)
-                else:
-                    data_dict[col_label].append(row[i])
-            row = next(csvreader, None)
-        fb_df = pd.DataFrame.from_dict(data_dict, orient='columns')
-        for col_label, col_type in fb_data_cols.items():
-            fb_df[col_label] = fb_df[col_label].astype(col_type)
-
-        # Figure out when the onboard GPS gets a lock and starts
-        # reporting the time (HHMMSS) and date (DDMMYY)
-        # Construct the datetime for that index, and then compute the
-        # datetime series for the whole dataset by assuming all rows
-        # are offset by 1 second
-        mask = fb_df['TIME'].notna() & fb_df['DATE'].notna()
-        if mask.max() == True:
-            first_datetime_index = mask.idxmax()
-            dt_row = fb_df.iloc[first_datetime_index]
-            date_str = str(int(dt_row['DATE']))
-            time_str = str(int(dt_row['TIME']))
-            # Pad strings with leading 0 if less than 6 characters long
-            # Makes it simpler to uniformly parse into 2 digit month, day, year, time
-            date_str = '0' * (6 - len(date_str)) + date_str
-            time_str = '0' * (6 - len(time_str)) + time_str
-            day = int(date_str[0:2])
-            month = int(date_str[2:4])
-            year = int(date_str[4:6])
-            hour = int(time_str[0:2])
-            minute = int(time_str[2:4])
-            second = int(time_str[4:6])
-            dt_str = f'20{year}-{month}-{day}T{hour:02}:{minute:02}:{second:02}'
-        else:
-            print(f"Unknown datetime for dataset in {file}, using 2000-01-01T00:00:00")
-            first_datetime_index = 0
-            dt_str = f'2000-01-01T00:00:00'
-
-        dt = pd.to_datetime(dt_str, utc=True)
-        start_data_time = dt - pd.to_timedelta(first_datetime_index, unit='s')
-        end_data_time = dt + pd.to_timedelta(len(fb_df)-first_datetime_index-1, unit='s')
-        #print(first_datetime_index, dt, start_data_time, end_data_time)
-        dt_range = pd.date_range(start=start_data_time, end=end_data_time, freq='s')
-        #print(dt_range, len(dt_range), len(fb_df))
-        fb_df['DATETIME'] = dt_range
-
-        output_dir = Path("/home/oryx/Projects/Objects/RadiometerTesting/")
-        fb_utils.plot_fb_df(fb_df, file.stem, output_dir)
-        header_dict = construct_fiveband_header_dict(file, fb_df)
-        header_dicts.append(header_dict)
-        data_dfs.append(fb_df)
-
+    with open(file, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for start, end in kucu.find_dataset_blocks(data, b"TIME"):
+            fb_df, sample_rate = parse_fiveband_block(data[start:end], file)
+            if len(fb_df) == 0:
+                continue
+            if plot_dir is not None:
+                fb_utils.plot_fb_df(fb_df, file.stem, Path(plot_dir))
+            header_dict = construct_fiveband_header_dict(file, fb_df, sample_rate)
+            header_dicts.append(header_dict)
+            data_dfs.append(fb_df)
+
+    print("Finished processing file: ", file)
     return header_dicts, data_dfs, optical_image_cubes, ir_image_cubes
 
 
@@ -159,7 +222,8 @@ if __name__ == "__main__":
     test_path = Path("/home/oryx/Projects/Objects/UNR_BurnTable/LowLoading/DATALOG_LowLoading_Unit3.CSV")
     output_dir = Path("/home/oryx/Projects/Objects/RadiometerTesting/")
     output_dir.mkdir(parents=True, exist_ok=True)
-    header_dicts, data_dfs, optical_image_cubes, ir_image_cubes = extract_fiveband_datasets_from_raw_file(test_path)
+    header_dicts, data_dfs, optical_image_cubes, ir_image_cubes = extract_fiveband_datasets_from_raw_file(
+        test_path, output_dir)
     #print(header_dicts)
     #print(data_dfs)
     #print(len(ir_image_cubes), ir_image_cubes[0].shape)
@@ -3,18 +3,20 @@ import numpy as np
 import json
 import pandas as pd
 import geopandas as gpd
-import scipy.optimize as so
-import scipy.constants as sc
-import kremboxer.greybody_utils as gbu
-import krembox_utils as kbu
+import kremboxer.utils.greybody_utils as gbu
+import kremboxer.utils.frp_utils as fu
+import kremboxer.utils.thermistor_utils as tu
+import kremboxer.krembox_utils as kbu
 
 
-def load_calibration_data(cal_params):
+def load_calibration_data(cal_params, thermistor_params: dict = None):
     """
     Loads the calibration data needed to process the raw KremBox data, including bandpasses, detector model parameters,
     and temperature sensor look up table
 
     :param cal_params: dictionary of calibration parameters
+    :param thermistor_params: optional "method", "out_of_range" and "dtype" options of the detector temperature sensor
+        model, see `thermistor_utils.ThermistorModel`
     :return: model_params, detect_temp_cal_data, F_MW, F_LW
     :group: krembox_dualband_frp
     """
@@ -23,7 +25,9 @@ def load_calibration_data(cal_params):
     detect_temp_cal_data = {
         'r_top': cal_params['r_top'],
         'v_top': cal_params['v_top'],
-        'lookup': np.flip(np.loadtxt(detect_temp_cal_file, skiprows=1, delimiter=',', usecols=[0, 1, 2]), 0)
+        'lookup': np.flip(np.loadtxt(detect_temp_cal_file, skiprows=1, delimiter=',', usecols=[0, 1, 2]), 0),
+        'thermistor': tu.get_thermistor(detect_temp_cal_file, cal_params['v_top'], cal_params['r_top'],
+                                        **(thermistor_params or {}))
     }
 
     bp_lw_file = cal_params["LW_bandpass"]
@@ -38,7 +42,8 @@ def load_calibration_data(cal_params):
     return model_params, detect_temp_cal_data, F_MW, F_LW
 
 
-def compute_FRP(rad_data: pd.DataFrame, F_MW, F_LW, model_params: dict, detect_temp_cal_data: dict):
+def compute_FRP(rad_data: pd.DataFrame, F_MW, F_LW, model_params: dict, detect_temp_cal_data: dict,
+                ratio_table: dict = None):
     """
     Use the dualband data to compute the target temperature, emissivity Area product, and FRP of the fire
     passing under the krembox
@@ -47,58 +52,13 @@ def compute_FRP(rad_data: pd.DataFrame, F_MW, F_LW, model_params: dict, detect_t
     :param F_LW:
     :param model_params:
     :param detect_temp_cal_data:
+    :param ratio_table: MW/LW ratio to temperature table from `gbu.build_ratio_table`, solved exactly for each sample if None
     :return:
     :group: krembox_dualband_frp
     """
 
-    # Load raw temperature sensor data and convert it into actual temperature readings
-    THs = rad_data['TH']
-    vtop = detect_temp_cal_data['v_top']  # voltage at top of divided in mV
-    rtop = detect_temp_cal_data['r_top']  # 100K Ohm resistor in voltage divider
-    TRs = THs * rtop / (vtop - THs)  # Convert mV reading of temperature sensor into resistance
-    TDs = gbu.detector_temperature_lookup(R=TRs, temp_cal_data=detect_temp_cal_data['lookup'])
-
-    # Load the raw mV data from the dualband sensors
-    V_LW = rad_data['LW-A']
-    V_MW = rad_data['MW-B']
-
-    # Invert the detector model to get the incident flux
-    W_GB_LW = V_LW / model_params["LW"]["G"] + model_params["LW"]["AL"] * TDs ** model_params["LW"]["N"]
-    W_GB_MW = V_MW / model_params["MW"]["G"] + model_params["MW"]["AL"] * TDs ** model_params["MW"]["N"]
-
-    # Compute the target temperature from the ratio of the fluxes from the two bands
-    ratios = W_GB_MW / W_GB_LW
-    T_predict = np.zeros_like(W_GB_MW)
-    for i in range(0, len(T_predict)):
-        if V_LW[i] > 0 and V_MW[i] > 0:
-            T_predict[i] = so.brentq(lambda Ts: gbu.GB_ratio_BP(Ts, F_MW, F_LW) - ratios[i], 200, 2000)
-
-    # Compute emissivity * Area fraction product, fill in zero where the sensors did not detect radiation
-    eA_LW = W_GB_LW / gbu.planck_model(T_predict, model_params["LW"]["A"], model_params["LW"]["N"])  # WD_LW
-    eA_MW = W_GB_MW / gbu.planck_model(T_predict, model_params["MW"]["A"], model_params["MW"]["N"])  # WD_MW
-    eA_LW[eA_LW == np.inf] = 0
-    eA_MW[eA_MW == np.inf] = 0
-
-    # Compute fire radiative power, two bands should agree
-    FRP_LW = eA_LW * sc.Stefan_Boltzmann * T_predict ** 4
-    FRP_MW = eA_MW * sc.Stefan_Boltzmann * T_predict ** 4
-
-    # Create a copy of the radiometer dataframe and add the new data products
-    rad_data_proc = rad_data.copy(deep=True)
-    rad_data_proc["T"] = T_predict
-    rad_data_proc["TD"] = TDs
-
-    rad_data_proc["MW_eA"] = eA_MW
-    rad_data_proc["MW_FRP"] = FRP_MW
-    rad_data_proc["MW_W"] = W_GB_MW
-    rad_data_proc["MW_V"] = V_MW
-
-    rad_data_proc["LW_eA"] = eA_LW
-    rad_data_proc["LW_FRP"] = FRP_LW
-    rad_data_proc["LW_W"] = W_GB_LW
-    rad_data_proc["LW_V"] = V_LW
-
-    return rad_data_proc
+    return fu.compute_frp_products(rad_data, model_params, {"MW": F_MW, "LW": F_LW}, detect_temp_cal_data, "Dualband",
+                                   None if ratio_table is None else {("MW", "LW"): ratio_table})
 
 
 def run_krembox_dualband_frp(params: dict):
@@ -119,8 +79,9 @@ def run_krembox_dualband_frp(params: dict):
     print("Loading calibration data...")
     with open(params["cal_input"], "r") as fp:
         cal_params = json.load(fp)
-    (model_params, detect_temp_cal_data, F_MW, F_LW) = load_calibration_data(cal_params)
+    (model_params, detect_temp_cal_data, F_MW, F_LW) = load_calibration_data(cal_params, params.get("thermistor"))
     print(model_params)
+    ratio_table = gbu.build_ratio_table(F_MW, F_LW)
 
     # Load clean dataframe that tells us where the data is and some metadata
     print("Reading clean dataframe")
@@ -146,7 +107,7 @@ def run_krembox_dualband_frp(params: dict):
         clean_file_path = Path(row["data_directory"]).joinpath(row["clean_file"])
         print(i, clean_file_path)
         rad_data = pd.read_csv(clean_file_path, skiprows=2, index_col=False, usecols=[0, 1, 2, 3])
-        rad_data_proc = compute_FRP(rad_data, F_MW, F_LW, model_params, detect_temp_cal_data)
+        rad_data_proc = compute_FRP(rad_data, F_MW, F_LW, model_params, detect_temp_cal_data, ratio_table)
         rad_data_proc['datetime'] = pd.to_datetime(rad_data_proc['datetime'])
 
         # Compute when the max FRP occurs
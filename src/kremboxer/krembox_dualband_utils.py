@@ -4,6 +4,7 @@ import geopandas as gpd
 from pathlib import Path
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+import kremboxer.utils.common_utils as cu
 
 
 def parse_header(fields, header):
@@ -28,29 +29,21 @@ def parse_header(fields, header):
     return dt, lat, lon, sample_freq
 
 
-def associate_data2burnplot(rad_data_gdf: gpd.GeoDataFrame, burn_plot_gdf: gpd.GeoDataFrame):
+def associate_data2burnplot(rad_data_gdf: gpd.GeoDataFrame, burn_plot_gdf: gpd.GeoDataFrame,
+                            max_distance: float = 0., overlap: str = "first"):
     """
+    Add the burn unit of each dataset, see `common_utils.match_burn_units`
 
-    :param rad_data_gdf:
-    :param burn_plot_gdf:
-    :return:
+    :param rad_data_gdf: datasets with their "dataset" name and location
+    :param burn_plot_gdf: burn unit polygons with an "Id" column
+    :param max_distance: distance in meters up to which datasets outside of every unit are given the nearest one
+    :param overlap: "first" or "smallest", how to pick among overlapping units
+    :return: `rad_data_gdf` with a "burn_unit" column, "unknown" for the datasets without one
     :group: krembox_dualband_utils
     """
-    burn_plot_ids = []
-    for i, rad_data_row in rad_data_gdf.iterrows():
-        found = False
-        for j, burn_plot_row in burn_plot_gdf.iterrows():
-            if burn_plot_row.geometry.contains(rad_data_row.geometry):
-                burn_plot_ids.append(burn_plot_row.Id)
-                found = True
-                break
-        if not found:
-            print("Warning! Dataset ", rad_data_row["dataset"], " not contained in any burn plot!!")
-            print("\t(lat,lon)=(", rad_data_row["lat"], ", ", rad_data_row["lon"], ")")
-            print("\tSetting burn plot to unknown")
-            burn_plot_ids.append("unknown")
-
-    rad_data_gdf["burn_unit"] = burn_plot_ids
+    matches = cu.match_burn_units(rad_data_gdf.geometry, burn_plot_gdf, max_distance, overlap)
+    print(cu.burn_unit_report(matches, rad_data_gdf["dataset"]))
+    rad_data_gdf["burn_unit"] = matches["burn_unit"]
 
     print(rad_data_gdf.head())
     return rad_data_gdf
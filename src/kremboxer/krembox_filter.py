@@ -4,9 +4,9 @@ import sys
 import json
 import shutil
 from pathlib import Path
-import pandas as pd
 import geopandas as gpd
 import kremboxer.krembox_dualband_utils as kdu
+import kremboxer.utils.catalog_utils as catalog_utils
 
 
 def main(argv):
@@ -60,32 +60,23 @@ def main(argv):
     shutil.copy(paramfile, output_root.joinpath("filter_params.json"))
 
     # Read in dataframe to be filtered
-    frp_df = gpd.read_file(params["input_frp_dataframe"])
+    frp_df = catalog_utils.read_metadata(params["input_frp_dataframe"])
     print(frp_df.head())
 
-    # Filter dataframe by burn unit and date
+    # Filter dataframe by burn unit and date, and by polygon if requested, "feature_name" is the name of the polygon
+    # to filter by from the input vector layer "polygon_layer"
     filter_criteria = params["filter_criteria"]
     print(filter_criteria)
-    filter_df = frp_df[frp_df["burn_unit"] == filter_criteria["burn_unit"]]
-    filter_date = datetime.datetime.fromisoformat(filter_criteria["date"]).date()
-    filter_df = filter_df[filter_df['dt'].apply(lambda x: x.date() == filter_date)]
-    print(filter_df)
-
-    # Filter dataframe by polygon if requested, "feature_name" is the name of the polygon to filter by
-    # from the input vector layer "polygon_layer"
+    polygon = None
     if "polygon_layer" in filter_criteria.keys():
         shutil.copy(filter_criteria["polygon_layer"], output_root)
         poly_gdf = gpd.read_file(filter_criteria["polygon_layer"])
-        poly_gdf.to_crs(filter_df.crs, inplace=True)
-        feature_name = filter_criteria["feature_name"]
-        poly_gdf = poly_gdf[poly_gdf["name"] == feature_name]
-        poly_geom = poly_gdf["geometry"].iloc[0]
-
-        # Figure out which dataframe records are within the polygon
-        pip = filter_df.within(poly_gdf.loc[0, 'geometry'])
-
-        # Create a new geoDataFrame with only the radiometers within the polygon
-        filter_df = filter_df.loc[pip].copy()
+        polygon = poly_gdf[poly_gdf["name"] == filter_criteria["feature_name"]].geometry
+    filter_df, selection_report = catalog_utils.select_datasets(frp_df, dates=[filter_criteria["date"]],
+                                                                burn_units=[filter_criteria["burn_unit"]],
+                                                                polygon=polygon, datetime_column="dt")
+    print(catalog_utils.selection_summary(selection_report))
+    print(filter_df)
 
     # Create folders to save data and plots
     data_dir = output_root.joinpath("data")
@@ -116,12 +107,12 @@ def main(argv):
         filter_data_files.append(str(dest_file))
 
         # Create plots of each radiometer dataset
-        rad_df = pd.read_csv(dest_path)
+        rad_df = catalog_utils.read_trace(frp_datafile)
         plot_name = row["dataset"] + ".png"
         sup_title = row["dataset"]
-        min_datetime = datetime.datetime.fromisoformat(rad_df['datetime'].iloc[row['pstart_ind']]) - datetime.timedelta(
+        min_datetime = datetime.datetime.fromisoformat(str(rad_df['datetime'].iloc[row['pstart_ind']])) - datetime.timedelta(
             minutes=10)
-        max_datetime = datetime.datetime.fromisoformat(rad_df['datetime'].iloc[row['pend_ind']]) + datetime.timedelta(
+        max_datetime = datetime.datetime.fromisoformat(str(rad_df['datetime'].iloc[row['pend_ind']])) + datetime.timedelta(
             minutes=10)
 
         plot_path = plot_dir.joinpath(plot_name)
@@ -3,9 +3,10 @@ import matplotlib.pyplot as plt
 from pathlib import Path
 import json
 import shutil
-import scipy.optimize as so
 import scipy.constants as sc
 import kremboxer.utils.greybody_utils as gbu
+import kremboxer.utils.quadrature_utils as qu
+import kremboxer.utils.thermistor_utils as tu
 import kremboxer.utils.common_utils as kcu
 import datetime
 import pandas as pd
@@ -28,6 +29,8 @@ def compute_ufm_calibration(cal_params: dict):
         "v_top": voltage applied across the internal temperature sensor voltage divider
         "r_top": resistance of resistor in internal temperature sensor voltage divider
         "calibration_outputs_folder": folder to store the calibration results
+        "bandpass_quadrature": optional quadrature rule for the bandpass integrals, "rectangle" (default), "trapezoid"
+            or "simpson"
 
     Returns
     -------
@@ -58,40 +61,45 @@ def compute_ufm_calibration(cal_params: dict):
     # Load parameters needed to convert temperature sensor mV readings into resistance, using known voltage divider characteristics
     v_top = cal_params["v_top"]  # voltage at the top of divider in mV
     r_top = cal_params["r_top"]  # 100kOhm resistor in voltage divider
-    t_cal_data = np.loadtxt(temp_cal_input_path, skiprows=1, delimiter=",", usecols=[0, 1, 2])
-    t_cal_data = np.flip(t_cal_data, 0)
+    thermistor = tu.ThermistorModel.from_csv(temp_cal_input_path, v_top, r_top)
 
     # Load the blackbody calibration data and the target temperatures
     blackbody_cal_data_df = pd.read_csv(cal_input_path)
     t_actual = blackbody_cal_data_df["Target T [K]"].to_numpy()
 
     # Also copy and load bandpass into numpy arrays stored in the band dictionary
+    quadrature = cal_params.get("bandpass_quadrature", "rectangle")
     for band, band_data in bands_dict.items():
         bandpass_path = Path(band_data["bandpass"])
         bandpass_copy_path = cal_output_dir.joinpath(bandpass_path.name)
         shutil.copy(bandpass_path, bandpass_copy_path)
         bands_dict[band]["bandpass"] = bandpass_copy_path
         f = np.loadtxt(bands_dict[band]["bandpass"], delimiter=',', skiprows=1, usecols=[0, 1])
+        print(f"{band} bandpass {quadrature} quadrature relative error estimate: {qu.quadrature_error_estimate(f, quadrature):.2e}")
+        if quadrature != "rectangle":
+            f = qu.attach_quadrature_weights(f, quadrature)
 
         # Load temperature sensor data
         t_sensor_mV = blackbody_cal_data_df[band_data["sensor_temp"]].to_numpy()
-        t_sensor_resist = t_sensor_mV * r_top / (
-                    v_top - t_sensor_mV)  # Convert mV reading into resistance of temperature sensor
-        t_sensor_temp = gbu.detector_temperature_lookup(R=t_sensor_resist, temp_cal_data=t_cal_data)
+        t_sensor_temp = thermistor.temperature(t_sensor_mV)
 
         # Load the detector signal from the calibration data
         v = blackbody_cal_data_df[band_data["datalog_col"]].to_numpy()
 
-        # Fit a polynomial for the blackbody energy received by each sensor, W~A*T**N
-        (A, N, wd) = gbu.fit_received_bandpass_energy(f, t_actual)
-
-        # Now fit the detector model with the calibration data to get G and AL
-        G, AL, pcov = kcu.fit_detector_model(t_actual, t_sensor_temp, v, A, N, p0=[band_data["G0"], band_data["AL0"]])
-
-        # Save the fit parameters and sensor data in the band dictionary
+        # Save the sensor data in the band dictionary
         bands_dict[band]["f"] = f
         bands_dict[band]["t_sensor_temp"] = t_sensor_temp
         bands_dict[band]["v"] = v
+
+    # Fit a polynomial for the blackbody energy received by each sensor, W~A*T**N, then fit the detector model with the
+    # calibration data to get G and AL, for all bands at once
+    bands = list(bands_dict.keys())
+    As, Ns, wds = gbu.fit_received_bandpass_energies([bands_dict[band]["f"] for band in bands], t_actual)
+    Gs, ALs, pcovs = kcu.fit_detector_model(t_actual, np.stack([bands_dict[band]["t_sensor_temp"] for band in bands]),
+                                            np.stack([bands_dict[band]["v"] for band in bands]), As, Ns)
+
+    for band, A, N, wd, G, AL in zip(bands, As, Ns, wds, Gs, ALs):
+        # Save the fit parameters in the band dictionary
         bands_dict[band]["A"] = A
         bands_dict[band]["N"] = N
         bands_dict[band]["G"] = G
@@ -134,11 +142,10 @@ def compute_ufm_calibration(cal_params: dict):
 
     # Try to predict target known temperatures, eA, FRP
     ratio_mw_lw = bands_dict["MW"]["W_GB"] / bands_dict["LW"]["W_GB"]
-    t_predict_mw_lw = np.zeros_like(t_actual)
-    for i in range(0, len(t_actual)):
-        t_predict_mw_lw[i] = so.brentq(
-            lambda Ts: gbu.GB_ratio_BP(Ts, bands_dict["MW"]["f"], bands_dict["LW"]["f"]) - ratio_mw_lw[i], 300,
-            2000)
+    t_predict_mw_lw, converged, iterations = gbu.solve_ratio_temperature(ratio_mw_lw, bands_dict["MW"]["f"],
+                                                                          bands_dict["LW"]["f"], 300, 2000)
+    if not converged.all():
+        print("Unable to predict temperature with MW and LW bands for calibration temperatures ", t_actual[~converged])
 
     axs[2, 1].plot(t_actual, t_predict_mw_lw - t_actual, label="MW/LW")
     axs[2, 2].plot(t_actual, t_predict_mw_lw, label="MW/LW")
@@ -219,6 +226,7 @@ def compute_ufm_calibration(cal_params: dict):
         "temp_cal_input": str(temp_cal_input_path.name),
         "r_top": r_top,
         "v_top": v_top,
+        "bandpass_quadrature": quadrature,
         "bands": {}
     }
 
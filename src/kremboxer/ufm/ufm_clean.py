@@ -1,4 +1,7 @@
+import io
 import csv
+import mmap
+import contextlib
 from pathlib import Path
 import datetime
 from PIL import Image
@@ -7,6 +10,16 @@ import pandas as pd
 import geopandas as gpd
 import datetime
 import scipy
+import kremboxer.utils.common_utils as kucu
+import kremboxer.utils.cube_io as cube_io
+
+# Shape of the IR images, and number of lines per sample: the image rows, the radiometer / flow row, and a blank line
+NUM_IR_ROWS = 24
+NUM_IR_COLS = 32
+FRAME_LINES = NUM_IR_ROWS + 2
+
+# Number of samples parsed per np.loadtxt call, bounds the memory used for the text of the images
+FRAME_CHUNK = 4096
 
 
 def construct_datetime(year, month, day, hours_utc, minutes, seconds):
@@ -45,6 +58,9 @@ def construct_ufm_header_dict(header_titles, header_values):
 
 
 def read_ufm_dataset(file: Path, csvreader: csv.reader, first_row: list):
+    """
+    Row by row reader of one dataset, kept as the reference implementation of `parse_ufm_block`
+    """
     header_titles = first_row
     header_values = next(csvreader, None)
     header_dict = construct_ufm_header_dict(header_titles, header_values)
@@ -140,27 +156,138 @@ def read_ufm_dataset(file: Path, csvreader: csv.reader, first_row: list):
     return return_row, header_dict, data_df, image_data_cube
 
 
-def extract_ufm_datasets_from_raw_file(file: Path):
-    csvreader = csv.reader(open(file, 'r'))
+def count_ufm_frames(n_lines):
+    """
+    Number of samples in a UFM dataset with `n_lines` lines below its header rows, the blank line after the last sample
+    may be missing at the end of the file
+
+    :group: ufm_clean
+    """
+    return (n_lines + 1) // FRAME_LINES
+
+
+def cube_file_name(header_dict: dict, fmt: str = "npy") -> str:
+    """
+    Name of the file of the IR image cube of a dataset in the archive, "UFM_<unit>_<start time>_ir_images.npy" with
+    the : of the start time replaced by - for windows, or .h5 for HDF5 cubes, see `cube_io`
+
+    :group: ufm_clean
+    """
+    dt = header_dict['DATETIME_START'].isoformat().replace(":", "-")
+    return cube_io.cube_path(f"UFM_{header_dict['UNIT']}_{dt}_ir_images", fmt).name
+
+
+def parse_ufm_block(block, cube_path: Path = None, epoch_column=False, chunk_frames=FRAME_CHUNK):
+    """
+    Parse one dataset of a raw UFM file. Every sample spans `FRAME_LINES` lines, so the line offsets found in one scan
+    of the block locate every IR image and radiometer / flow row. Images are parsed `chunk_frames` samples at a time
+    with one `np.loadtxt` call straight into a preallocated uint16 cube, or into a cube file at `cube_path` so that the
+    cube never has to fit in memory, and the radiometer / flow rows of the same chunk are parsed into float64 columns.
+
+    :param block: bytes or memoryview of the dataset, starting at its "UNIT" header row, see
+        `common_utils.find_dataset_blocks`
+    :param cube_path: optional .npy or .h5 file to write the image cube to, HDF5 cubes also store the frame times, see
+        `cube_io.create_cube`
+    :param epoch_column: also return the sample times as an int64 "EPOCH" column of microseconds since 1970
+    :param chunk_frames: number of samples parsed per `np.loadtxt` call
+    :return: (header_dict, data_df, image_data_cube), the cube is None if the dataset has no samples, and is opened
+        for lazy reads with `cube_io.open_cube` if written to `cube_path`
+    :group: ufm_clean
+    """
+    buf, line_starts, line_ends = kucu.find_line_offsets(block)
+
+    header_rows = list(csv.reader(bytes(block[line_starts[i]:line_ends[i]]).decode().rstrip("\r") for i in range(3)))
+    header_dict = construct_ufm_header_dict(header_rows[0], header_rows[1])
+    data_columns = [x for x in header_rows[2] if not x == '']
+
+    # The blank line after the last sample may be missing at the end of the file
+    n_lines = len(line_starts) - 3
+    n_frames = count_ufm_frames(n_lines)
+    if n_lines % FRAME_LINES not in (0, FRAME_LINES - 1):
+        raise ValueError(f"IR image data incomplete at sample {n_frames}")
+    frame_starts = 3 + FRAME_LINES * np.arange(n_frames)
+
+    # Blank lines between samples are empty, or only contain empty fields
+    blank = frame_starts[:-1] + FRAME_LINES - 1 if n_lines % FRAME_LINES else frame_starts + FRAME_LINES - 1
+    blank_first = buf[np.minimum(line_starts[blank], len(buf) - 1)]
+    blank_empty = (line_ends[blank] - line_starts[blank] == 0) | np.isin(blank_first, [ord(","), ord("\r")])
+    if not blank_empty.all():
+        raise ValueError(f"Blank break line between samples not present at sample {np.argmin(blank_empty)}")
+
+    # Sample times advance by the sample period rounded to microseconds, like repeatedly adding a timedelta
+    sample_period = datetime.timedelta(seconds=1. / header_dict['SAMPLE-RATE(Hz)'])
+    epoch, datetimes = kucu.sample_datetimes(header_dict["DATETIME_START"], n_frames, sample_period)
+
+    if n_frames == 0:
+        # Datasets may not contain any data, e.x. someone turns the device on and off quickly
+        image_data_cube = None
+        values = np.zeros((0, len(data_columns)))
+    else:
+        shape = (n_frames, NUM_IR_ROWS, NUM_IR_COLS)
+        if cube_path is None:
+            cube_context = contextlib.nullcontext(np.empty(shape, dtype=np.uint16))
+        else:
+            cube_context = cube_io.create_cube(cube_path, shape, timestamps=epoch)
+        values = np.empty((n_frames, len(data_columns)))
+
+        image_begin = line_starts[frame_starts]
+        image_end = line_ends[frame_starts + NUM_IR_ROWS - 1]
+        data_begin = line_starts[frame_starts + NUM_IR_ROWS]
+        data_end = line_ends[frame_starts + NUM_IR_ROWS]
+        with cube_context as image_data_cube:
+            for k0 in range(0, n_frames, chunk_frames):
+                k1 = min(k0 + chunk_frames, n_frames)
+                image_bytes = b"\n".join([block[b:e] for b, e in zip(image_begin[k0:k1], image_end[k0:k1])])
+                image_data_cube[k0:k1] = np.loadtxt(io.BytesIO(image_bytes), delimiter=",", usecols=range(NUM_IR_COLS),
+                                                    dtype=np.uint16, ndmin=2,
+                                                    comments=None).reshape(k1 - k0, NUM_IR_ROWS, NUM_IR_COLS)
+                data_bytes = b"\n".join([block[b:e] for b, e in zip(data_begin[k0:k1], data_end[k0:k1])])
+                values[k0:k1] = np.loadtxt(io.BytesIO(data_bytes), delimiter=",", usecols=range(len(data_columns)),
+                                           dtype=np.float64, ndmin=2, comments=None)
+        if cube_path is not None:
+            image_data_cube = cube_io.open_cube(cube_path)
+
+    data_dict = {data_column: values[:, i] for i, data_column in enumerate(data_columns)}
+    data_dict["DATETIME"] = datetimes
+    if epoch_column:
+        data_dict["EPOCH"] = epoch
+    data_df = pd.DataFrame(data_dict)
+    for key, item in header_dict.items():
+        data_df.attrs[key] = item
+    return header_dict, data_df, image_data_cube
+
+
+def extract_ufm_datasets_from_raw_file(file: Path, cube_dir: Path = None, epoch_column=False, cube_format="npy"):
+    """
+    Parse every dataset with samples in a raw UFM file, see `parse_ufm_block`
+
+    :param file: raw UFM csv file
+    :param cube_dir: optional directory to write the IR image cubes to, as "UFM_<unit>_<start time>_ir_images.npy"
+    :param cube_format: format of the cubes written to `cube_dir`, "npy" or "hdf5", see `cube_io`
+    :param epoch_column: also return the sample times as an int64 "EPOCH" column of microseconds since 1970
+    :return: (header_dicts, data_dfs, ir_image_cubes), lists with one entry per dataset
+    :group: ufm_clean
+    """
     header_dicts = []
     data_dfs = []
     ir_image_cubes = []
+    if Path(file).stat().st_size == 0:
+        return header_dicts, data_dfs, ir_image_cubes
 
-    row = next(csvreader, None)
-    while not row[0] == 'UNIT':
-        row = next(csvreader, None)
-
-    row, header_dict, data_df, ir_image_cube = read_ufm_dataset(file, csvreader, row)
-    if ir_image_cube is not None:
-        header_dicts.append(header_dict)
-        data_dfs.append(data_df)
-        ir_image_cubes.append(ir_image_cube)
-    while row is not None:
-        row, header_dict, data_df, ir_image_cube = read_ufm_dataset(file, csvreader, row)
-        if ir_image_cube is not None:
-            header_dicts.append(header_dict)
-            data_dfs.append(data_df)
-            ir_image_cubes.append(ir_image_cube)
+    # Memory map the file, so that only the image cubes and the text of one chunk of samples are held in memory
+    with open(file, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for start, end in kucu.find_dataset_blocks(data, b"UNIT"):
+            cube_path = None
+            if cube_dir is not None:
+                header_values = data[start:start + 4096].split(b"\n", 2)[1].decode().rstrip("\r").split(",")
+                cube_path = Path(cube_dir).joinpath(cube_file_name(construct_ufm_header_dict(None, header_values),
+                                                                    cube_format))
+            with memoryview(data) as view, view[start:end] as block:
+                header_dict, data_df, ir_image_cube = parse_ufm_block(block, cube_path, epoch_column)
+            if ir_image_cube is not None:
+                header_dicts.append(header_dict)
+                data_dfs.append(data_df)
+                ir_image_cubes.append(ir_image_cube)
 
     print("Finished processing file: ", file)
     return header_dicts, data_dfs, ir_image_cubes
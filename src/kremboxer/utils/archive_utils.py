@@ -1,15 +1,35 @@
+import os
+import shutil
+import collections
+import concurrent.futures
 from pathlib import Path
 import datetime
 import pandas as pd
 import geopandas as gpd
-import numpy as np
-import scipy
 import kremboxer.dualband.dualband_utils as db_utils
 import kremboxer.dualband.dualband_clean as db_clean
 import kremboxer.ufm.ufm_utils as ufm_utils
 import kremboxer.ufm.ufm_clean as ufm_clean
 import kremboxer.fiveband.fiveband_utils as fb_utils
 import kremboxer.fiveband.fiveband_clean as fb_clean
+import kremboxer.utils.index_utils as index_utils
+import kremboxer.utils.dataset_io as dio
+import kremboxer.utils.cube_io as cube_io
+import kremboxer.utils.manifest_utils as mu
+
+# Manifest of the raw files in the archive, see `update_archive`
+ARCHIVE_MANIFEST = "archive_manifest.json"
+
+# Archive parameters that change the contents of the archived datasets, changing any of them rebuilds the archive
+ARCHIVE_SETTINGS = ("dataset_format", "dataset_compression", "dataset_float_dtype", "burn_dates", "duration_cutoff",
+                    "ir_cube_format", "ir_cube_exports")
+
+# Metadata key of the IR image cube files of a UFM dataset, by cube or export format
+IR_IMAGE_KEYS = {
+    "npy": "IR_IMAGE_NUMPY",
+    "hdf5": "IR_IMAGE_HDF5",
+    "mat": "IR_IMAGE_MATLAB",
+}
 
 
 def id_sensor_from_raw_file(file: Path) -> str:
@@ -23,7 +43,7 @@ def id_sensor_from_raw_file(file: Path) -> str:
         return "UNKNOWN"
 
 
-def extract_datasets_from_raw_file(file: Path, sensor: str):
+def extract_datasets_from_raw_file(file: Path, sensor: str, cube_dir: Path = None):
     if sensor == "Dualband":
         header_dicts, data_dfs = db_clean.extract_dualband_datasets_from_raw_file(file)
         return header_dicts, data_dfs
@@ -31,18 +51,300 @@ def extract_datasets_from_raw_file(file: Path, sensor: str):
         header_dicts, data_dfs, optical_image_cubes, ir_image_cubes = fb_clean.extract_fiveband_datasets_from_raw_file(file)
         return header_dicts, data_dfs, optical_image_cubes, ir_image_cubes
     elif sensor == "UFM":
-        header_dicts, data_dfs, ir_image_cubes = ufm_clean.extract_ufm_datasets_from_raw_file(file)
+        header_dicts, data_dfs, ir_image_cubes = ufm_clean.extract_ufm_datasets_from_raw_file(file, cube_dir)
         return header_dicts, data_dfs, ir_image_cubes
     else:
         print("Unknown sensor: ", sensor)
         exit(1)
 
 
+def extract_indexed_datasets(file: Path, sensor: str, params: dict, cube_dir: Path = None):
+    """
+    Extract the datasets of a dualband or UFM file through its sidecar index, see `index_utils`. Datasets outside of the
+    optional "burn_dates" or shorter than the optional "duration_cutoff" of `params` are skipped without being parsed,
+    as are datasets without samples.
+
+    :param file: raw instrument file
+    :param sensor: "Dualband" or "UFM"
+    :param params: archive parameters, optionally with "index_dir", "burn_dates", "duration_cutoff" and
+        "ir_cube_format"
+    :param cube_dir: directory to write the UFM IR image cubes to
+    :return: lists like `extract_datasets_from_raw_file`
+    :group: archive_utils
+    """
+    index = index_utils.load_dataset_index(file, sensor, params.get("index_dir"))
+    entries = index_utils.select_datasets(index, params.get("burn_dates"), params.get("duration_cutoff"))
+    print(f"Reading {len(entries)} out of {len(index['datasets'])} datasets of {file}")
+    cube_format = params.get("ir_cube_format", "npy")
+    datasets = [index_utils.read_indexed_dataset(file, sensor, entry, cube_dir, cube_format=cube_format)
+                for entry in entries]
+    num_outputs = 2 if sensor == "Dualband" else 3
+    return [[dataset[i] for dataset in datasets] for i in range(num_outputs)]
+
+
+def write_archive_dataset(data_df: pd.DataFrame, output_file: Path, params: dict) -> Path:
+    """
+    Write one dataset of the archive in the optional "dataset_format" of `params`, CSV by default, see `dataset_io`
+
+    :param data_df: dataset
+    :param output_file: dataset file without extension
+    :param params: archive parameters, optionally with "dataset_format", "dataset_compression" and
+        "dataset_float_dtype"
+    :return: path of the written file
+    :group: archive_utils
+    """
+    output_file = dio.dataset_path(output_file, params.get("dataset_format", "csv"))
+    dio.write_dataset(data_df, output_file, compression=params.get("dataset_compression", dio.DEFAULT_COMPRESSION),
+                      float_dtype=params.get("dataset_float_dtype"))
+    return output_file
+
+
+def archive_raw_file(file: Path, params: dict, output_dir: Path):
+    """
+    Extract the datasets of one raw file and write them into the "Raw/<sensor>" folder of `output_dir`
+
+    :param file: raw instrument file
+    :param params: archive parameters
+    :param output_dir: root of the archive, or of a staging folder whose contents are moved into the archive
+    :return: (sensor, metadata), the sensor of the file and a list with the metadata dictionary of each dataset written
+    :group: archive_utils
+    """
+    processing_level = "Raw"
+    metadata = []
+    sensor = id_sensor_from_raw_file(file)
+    print(f'{file} -> {sensor}')
+    if sensor == "UNKNOWN":
+        print("Unknown sensor type for file: ", file)
+        return sensor, metadata
+    if sensor == "Dualband":
+        db_output_dir = output_dir.joinpath(processing_level).joinpath(sensor)
+        db_output_dir.mkdir(exist_ok=True, parents=True)
+        header_dicts, data_dfs = extract_indexed_datasets(file, sensor, params)
+        for i, (header_dict, data_df) in enumerate(zip(header_dicts, data_dfs)):
+            unit = header_dict['UNIT']
+            dt = header_dict['DATETIME_START'].isoformat() #.replace(":", "-")
+            output_file = db_output_dir.joinpath(f'{sensor}_{unit}_{dt.replace(":", "-")}') # Replace : with - in time string for windows
+            output_file = write_archive_dataset(data_df, output_file, params)
+            metadata.append(header_dict)
+            metadata[-1]['PROCESSING_LEVEL'] = processing_level
+            metadata[-1]['SENSOR'] = sensor
+            metadata[-1]['DATAFILE'] = output_file.name
+            metadata[-1]['DURATION'] = len(data_df) / header_dict['SAMPLE-RATE(Hz)']
+    elif sensor == "UFM":
+        ufm_output_dir = output_dir.joinpath(processing_level).joinpath(sensor)
+        ufm_output_dir.mkdir(exist_ok=True, parents=True)
+        # The IR image cubes are parsed straight into their files in the archive, .npy by default or chunked and
+        # compressed HDF5, and only exported to the optional "ir_cube_exports" formats on request
+        header_dicts, data_dfs, ir_image_cubes = extract_indexed_datasets(file, sensor, params, ufm_output_dir)
+        for i, (header_dict, data_df, ir_image_cube) in enumerate(zip(header_dicts, data_dfs, ir_image_cubes)):
+            unit = header_dict['UNIT']
+            dt = header_dict['DATETIME_START'].isoformat()#.replace(":", "-")
+            output_file = ufm_output_dir.joinpath(f'{sensor}_{unit}_{dt.replace(":", "-")}')
+            output_file = write_archive_dataset(data_df, output_file, params)
+            metadata.append(header_dict)
+            metadata[-1]['PROCESSING_LEVEL'] = "Raw"
+            metadata[-1]['SENSOR'] = sensor
+            metadata[-1]['DATAFILE'] = output_file.name
+            metadata[-1]['DURATION'] = len(data_df) / header_dict['SAMPLE-RATE(Hz)']
+
+            cube_format = params.get("ir_cube_format", "npy")
+            cube_file = ufm_output_dir.joinpath(ufm_clean.cube_file_name(header_dict, cube_format))
+            metadata[-1][IR_IMAGE_KEYS[cube_format]] = cube_file.name
+            for export_format in params.get("ir_cube_exports", []):
+                if export_format != cube_format:
+                    metadata[-1][IR_IMAGE_KEYS[export_format]] = cube_io.export_cube(cube_file, export_format).name
+    elif sensor == "Fiveband":
+        header_dicts, data_dfs, optical_image_cubes, ir_image_cubes = extract_datasets_from_raw_file(file, sensor)
+        fb_output_dir = output_dir.joinpath(processing_level).joinpath(sensor)
+        fb_output_dir.mkdir(exist_ok=True, parents=True)
+
+        for i, (header_dict, data_df) in enumerate(zip(header_dicts, data_dfs)):
+            unit = header_dict['UNIT']
+            dt = header_dict['DATETIME_START'].isoformat()
+            output_file = fb_output_dir.joinpath(f'{sensor}_{unit}_{dt.replace(":", "-")}')
+            output_file = write_archive_dataset(data_df, output_file, params)
+            metadata.append(header_dict)
+            metadata[-1]['PROCESSING_LEVEL'] = "Raw"
+            metadata[-1]['SENSOR'] = sensor
+            metadata[-1]['DATAFILE'] = output_file.name
+            metadata[-1]['DURATION'] = len(data_df) / header_dict['SAMPLE-RATE(Hz)']
+    return sensor, metadata
+
+
+def _archive_staged_raw_file(file: Path, params: dict, staging_dir: Path):
+    staging_dir.mkdir(parents=True)
+    return archive_raw_file(file, params, staging_dir)
+
+
+def _commit_staged_files(staging_dir: Path, archive_dir: Path):
+    """
+    Move the files written to a staging folder into the archive, replacing files of the same name
+    """
+    for staged_file in sorted(x for x in staging_dir.rglob('*') if x.is_file()):
+        output_file = archive_dir.joinpath(staged_file.relative_to(staging_dir))
+        output_file.parent.mkdir(exist_ok=True, parents=True)
+        os.replace(staged_file, output_file)
+    shutil.rmtree(staging_dir)
+
+
+def archive_raw_files_parallel(files: list, params: dict, archive_dir: Path, num_workers: int):
+    """
+    Archive raw files with a pool of `num_workers` processes. Each worker writes the datasets of its file to a staging
+    folder, and the staged files are moved into the archive in the order of `files`, so that datasets found in several
+    files end up with the contents of the last one exactly as in a serial run. At most `2 * num_workers` files are in
+    flight, bounding the staged data while the archive is being filled.
+
+    :param files: raw instrument files, in archive order
+    :param params: archive parameters
+    :param archive_dir: root of the archive
+    :param num_workers: number of worker processes
+    :return: list of (sensor, metadata) of each file, see `archive_raw_file`
+    :group: archive_utils
+    """
+    staging_root = archive_dir.joinpath(f".staging-{os.getpid()}")
+    results = []
+    pending = collections.deque()
+
+    def commit_next():
+        future, staging_dir = pending.popleft()
+        results.append(future.result())
+        _commit_staged_files(staging_dir, archive_dir)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        try:
+            for i, file in enumerate(files):
+                if len(pending) >= 2 * num_workers:
+                    commit_next()
+                staging_dir = staging_root.joinpath(str(i))
+                pending.append((executor.submit(_archive_staged_raw_file, file, params, staging_dir), staging_dir))
+            while len(pending) > 0:
+                commit_next()
+        finally:
+            for future, _ in pending:
+                future.cancel()
+            shutil.rmtree(staging_root, ignore_errors=True)
+    return results
+
+
+def _archive_files(files: list, params: dict, archive_dir: Path, num_workers: int):
+    if num_workers > 1 and len(files) > 1:
+        return archive_raw_files_parallel(files, params, archive_dir, num_workers)
+    return [archive_raw_file(file, params, archive_dir) for file in files]
+
+
+def _dataset_outputs(sensor: str, metadata: list) -> list:
+    """
+    Paths of the files written for the datasets of one raw file, relative to the archive root
+    """
+    outputs = []
+    for header_dict in metadata:
+        output_dir = Path(header_dict['PROCESSING_LEVEL'], sensor)
+        for key in ('DATAFILE',) + tuple(IR_IMAGE_KEYS.values()):
+            if key in header_dict:
+                outputs.append(output_dir.joinpath(header_dict[key]).as_posix())
+    return outputs
+
+
+def _last_writers(keys: list, records: dict) -> dict:
+    """
+    Raw file that writes each output last when the files are archived in the order of `keys`
+    """
+    writers = {}
+    for key in keys:
+        for output in records[key].get("outputs", []):
+            writers[output] = key
+    return writers
+
+
+def update_archive(files: list, params: dict, archive_dir: Path, num_workers: int = 1) -> dict:
+    """
+    Bring the archive up to date with the raw files, using the archive manifest to archive only the new and changed
+    files. The manifest records the size, modification time, content hash, sensor, dataset metadata and outputs of
+    every archived raw file. Files whose contents did not change are skipped, unless a dataset they share with another
+    file has to be rewritten by them to match a full rebuild, where the last file wins. Outputs that no file produces
+    anymore, e.x. because their raw file was removed, are deleted. A change to any of the `ARCHIVE_SETTINGS`, or
+    "incremental" set to false, rebuilds the whole archive.
+
+    :param files: raw instrument files, in archive order
+    :param params: archive parameters
+    :param archive_dir: root of the archive
+    :param num_workers: number of worker processes, see `archive_raw_files_parallel`
+    :return: dictionary of the manifest record of each file, keyed by path
+    :group: archive_utils
+    """
+    manifest_path = archive_dir.joinpath(ARCHIVE_MANIFEST)
+    manifest = mu.load_manifest(manifest_path)
+    settings = mu.json_safe({key: params.get(key) for key in ARCHIVE_SETTINGS})
+    old_records = {} if manifest is None else manifest["files"]
+    reuse = params.get("incremental", True) and manifest is not None and manifest["settings"] == settings
+
+    keys = [str(file) for file in files]
+    records = {}
+    to_archive = []
+    for file, key in zip(files, keys):
+        previous = old_records.get(key) if reuse else None
+        record = mu.file_record(file, previous)
+        if previous is not None and record["sha256"] == previous["sha256"]:
+            records[key] = dict(previous, **record)
+        else:
+            records[key] = record
+            to_archive.append(file)
+    print(f"Archiving {len(to_archive)} new or changed raw files out of {len(files)}")
+
+    # Raw file whose datasets are currently in the archive, for each output
+    last_write = _last_writers(list(old_records.keys()), old_records) if reuse else {}
+    while True:
+        for file, (sensor, metadata) in zip(to_archive, _archive_files(to_archive, params, archive_dir, num_workers)):
+            key = str(file)
+            records[key].update(sensor=sensor, metadata=mu.json_safe(metadata),
+                                outputs=_dataset_outputs(sensor, metadata))
+            last_write.update({output: key for output in records[key]["outputs"]})
+        rewrite = {key for output, key in _last_writers(keys, records).items() if last_write.get(output) != key}
+        to_archive = [file for file, key in zip(files, keys) if key in rewrite]
+        if len(to_archive) == 0:
+            break
+        print(f"Rewriting the datasets shared by {len(to_archive)} unchanged raw files")
+
+    current_outputs = {output for record in records.values() for output in record["outputs"]}
+    old_outputs = {output for record in old_records.values() for output in record.get("outputs", [])}
+    for output in sorted((old_outputs | set(last_write)) - current_outputs):
+        if archive_dir.joinpath(output).is_file():
+            print(f"Removing {output}, its raw file is gone or no longer contains it")
+            archive_dir.joinpath(output).unlink()
+
+    mu.save_manifest(manifest_path, {"settings": settings, "files": {key: records[key] for key in keys}})
+    return records
+
+
 def create_dataset_archive(params: dict):
+    """
+    Extract every dataset of the raw files in the "data_source_directories" into per dataset files in "archive_dir",
+    and write metadata tables of the datasets of each sensor. Dualband and UFM files are read through sidecar dataset
+    indexes, written next to the raw files or to the optional "index_dir". When "burn_dates" or "duration_cutoff" are
+    given, datasets of those files outside of the burn dates or shorter than the cutoff are left out of the archive.
+
+    Datasets are written as CSV, or in the optional "dataset_format", see `write_archive_dataset`. UFM IR image cubes
+    are written once, as .npy files or in the optional "ir_cube_format", and copies in the "ir_cube_exports" formats,
+    e.x. ["mat"], are only written when asked for, see `cube_io`. With "num_workers"
+    greater than 1 the raw files are archived in parallel, see `archive_raw_files_parallel`, and the archive is
+    identical to the one written serially. Reruns only archive new and changed raw files, see `update_archive`, and
+    regenerate the metadata tables from the archive manifest.
+
+    :param params: archive parameters
+    :group: archive_utils
+    """
     print("Creating dataset archive")
     archive_dir = Path(params["archive_dir"])
     data_source_directories = params["data_source_directories"]
-    processing_level = "Raw"
+    num_workers = params.get("num_workers", 1)
+
+    # Files are archived in a fixed order, so the metadata tables do not depend on the order of the directory listing
+    files = []
+    for data_source_directory in data_source_directories:
+        print(f"Processing directory: {data_source_directory}")
+        files.extend(sorted(Path(data_source_directory).glob('**/*.CSV')))
+
+    records = update_archive(files, params, archive_dir, num_workers)
 
     unknown_sensor_file = []
     metadatas = {
@@ -50,72 +352,12 @@ def create_dataset_archive(params: dict):
         "UFM": [],
         "Fiveband": []
     }
-    for data_source_directory in data_source_directories:
-        print(f"Processing directory: {data_source_directory}")
-        data_source_directory = Path(data_source_directory)
-        for file in data_source_directory.glob('**/*.CSV'):
-            sensor = id_sensor_from_raw_file(file)
-            print(f'{file} -> {sensor}')
-            if sensor == "UNKNOWN":
-                print("Unknown sensor type for file: ", file)
-                unknown_sensor_file.append(file)
-                continue
-            if sensor == "Dualband":
-                header_dicts, data_dfs = extract_datasets_from_raw_file(file, sensor)
-                db_output_dir = archive_dir.joinpath(processing_level).joinpath(sensor)
-                db_output_dir.mkdir(exist_ok=True, parents=True)
-                datafiles = []
-                for i, (header_dict, data_df) in enumerate(zip(header_dicts, data_dfs)):
-                    unit = header_dict['UNIT']
-                    dt = header_dict['DATETIME_START'].isoformat() #.replace(":", "-")
-                    output_file = db_output_dir.joinpath(f'{sensor}_{unit}_{dt.replace(":", "-")}.csv') # Replace : with - in time string for windows
-                    data_df.to_csv(output_file, index=False)
-                    metadatas[sensor].append(header_dict)
-                    metadatas[sensor][-1]['PROCESSING_LEVEL'] = processing_level
-                    metadatas[sensor][-1]['SENSOR'] = sensor
-                    metadatas[sensor][-1]['DATAFILE'] = output_file.name
-                    metadatas[sensor][-1]['DURATION'] = len(data_df) / header_dict['SAMPLE-RATE(Hz)']
-                #print(header_dicts)
-            elif sensor == "UFM":
-                header_dicts, data_dfs, ir_image_cubes = extract_datasets_from_raw_file(file, sensor)
-                ufm_output_dir = archive_dir.joinpath(processing_level).joinpath(sensor)
-                ufm_output_dir.mkdir(exist_ok=True, parents=True)
-                datafiles = []
-                for i, (header_dict, data_df, ir_image_cube) in enumerate(zip(header_dicts, data_dfs, ir_image_cubes)):
-                    unit = header_dict['UNIT']
-                    dt = header_dict['DATETIME_START'].isoformat()#.replace(":", "-")
-                    output_file = ufm_output_dir.joinpath(f'{sensor}_{unit}_{dt.replace(":", "-")}.csv')
-                    data_df.to_csv(output_file, index=False)
-                    metadatas[sensor].append(header_dict)
-                    metadatas[sensor][-1]['PROCESSING_LEVEL'] = "Raw"
-                    metadatas[sensor][-1]['SENSOR'] = sensor
-                    metadatas[sensor][-1]['DATAFILE'] = output_file.name
-                    metadatas[sensor][-1]['DURATION'] = len(data_df) / header_dict['SAMPLE-RATE(Hz)']
-
-                    numpy_output_file = ufm_output_dir.joinpath(f'{sensor}_{unit}_{dt.replace(":", "-")}_ir_images.npy')
-                    matlab_output_file = ufm_output_dir.joinpath(f'{sensor}_{unit}_{dt.replace(":", "-")}_ir_images.mat')
-                    np.save(numpy_output_file, ir_image_cube)
-                    scipy.io.savemat(matlab_output_file, {'ir_images': ir_image_cube})
-                    metadatas[sensor][-1]['IR_IMAGE_NUMPY'] = numpy_output_file.name
-                    metadatas[sensor][-1]['IR_IMAGE_MATLAB'] = matlab_output_file.name
-
-                #print(header_dicts)
-            elif sensor == "Fiveband":
-                header_dicts, data_dfs, optical_image_cubes, ir_image_cubes = extract_datasets_from_raw_file(file, sensor)
-                fb_output_dir = archive_dir.joinpath(processing_level).joinpath(sensor)
-                fb_output_dir.mkdir(exist_ok=True, parents=True)
-                datafiles = []
-
-                for i, (header_dict, data_df) in enumerate(zip(header_dicts, data_dfs)):
-                    unit = header_dict['UNIT']
-                    dt = header_dict['DATETIME_START'].isoformat()
-                    output_file = fb_output_dir.joinpath(f'{sensor}_{unit}_{dt.replace(":", "-")}.csv')
-                    data_df.to_csv(output_file, index=False)
-                    metadatas[sensor].append(header_dict)
-                    metadatas[sensor][-1]['PROCESSING_LEVEL'] = "Raw"
-                    metadatas[sensor][-1]['SENSOR'] = sensor
-                    metadatas[sensor][-1]['DATAFILE'] = output_file.name
-                    metadatas[sensor][-1]['DURATION'] = len(data_df) / header_dict['SAMPLE-RATE(Hz)']
+    for file in files:
+        record = records[str(file)]
+        if record["sensor"] == "UNKNOWN":
+            unknown_sensor_file.append(file)
+            continue
+        metadatas[record["sensor"]].extend(mu.from_json_safe(record["metadata"]))
 
     for key, metadata in metadatas.items():
         #print(key)
@@ -135,5 +377,8 @@ def create_dataset_archive(params: dict):
             gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df.LONGITUDE, df.LATITUDE), crs="EPSG:4326")
             gdf['DATETIME_START'] = gdf['DATETIME_START'].map(lambda x: x.isoformat(sep='T'))
             gdf.to_file(archive_dir.joinpath(f'{key}_raw_metadata.geojson'), driver='GeoJSON', index=False)
+        elif archive_dir.joinpath(f'{key}_raw_metadata.geojson').exists():
+            # The datasets of an earlier build are gone, the processing must not pick them up
+            archive_dir.joinpath(f'{key}_raw_metadata.geojson').unlink()
 
     return 0
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+from pathlib import Path
+import kremboxer.utils.greybody_utils as gbu
+
+# Bump when the layout or content of the cached artifacts changes, so stale entries are never reused
+CACHE_VERSION = 1
+
+# Age in hours after which a temporary entry directory is assumed to be left over by a process killed while saving it
+STALE_TMP_HOURS = 1.0
+
+
+def hash_files(files: list) -> str:
+    """
+    Compute a content hash of a set of files, used as the cache key of the artifacts derived from them
+
+    :param files: paths of the calibration json and every file it references
+    :return: hex digest identifying the contents of the files
+    :group: cache_utils
+    """
+    h = hashlib.sha256(f"kremboxer-cache-v{CACHE_VERSION}".encode())
+    for file in files:
+        with open(file, "rb") as fp:
+            h.update(hashlib.sha256(fp.read()).digest())
+    return h.hexdigest()
+
+
+def hash_arrays(*arrays, **params) -> str:
+    """
+    Compute a content hash of arrays and keyword parameters, used as the cache key of artifacts computed from them
+
+    :param arrays: numpy arrays the artifact is computed from
+    :param params: json serializable parameters the artifact depends on
+    :return: hex digest identifying the arrays and parameters
+    :group: cache_utils
+    """
+    h = hashlib.sha256(f"kremboxer-cache-v{CACHE_VERSION}".encode())
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(str((a.dtype.str, a.shape)).encode())
+        h.update(a.tobytes())
+    h.update(json.dumps(params, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def load_cache_entry(cache_dir: Path, key: str):
+    """
+    Load the arrays stored under `key` as read only memory maps, so that repeated runs and worker processes share the
+    pages instead of re-deriving the artifacts
+
+    :param cache_dir: root directory of the cache
+    :param key: cache key from `hash_files` or `hash_arrays`
+    :return: (arrays, meta) dictionaries, or None if there is no valid entry for `key`. Invalid entries are removed so
+        that `save_cache_entry` can replace them.
+    :group: cache_utils
+    """
+    entry_dir = Path(cache_dir).joinpath(key)
+    meta_path = entry_dir.joinpath("meta.json")
+    if not entry_dir.is_dir():
+        return None
+    try:
+        with open(meta_path) as fp:
+            meta = json.load(fp)
+        if meta.get("version") != CACHE_VERSION:
+            raise ValueError(f"cache version {meta.get('version')}")
+        arrays = {name: np.load(entry_dir.joinpath(f"{name}.npy"), mmap_mode='r') for name in meta["arrays"]}
+    except (OSError, ValueError, KeyError, AttributeError):
+        print(f"Removing unreadable calibration cache entry {entry_dir}")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+
+    # Record the access so that eviction by age removes the entries that are no longer used. A read only shared cache
+    # is still used, its entries are just evicted by the age they were created at.
+    try:
+        os.utime(meta_path)
+    except OSError:
+        pass
+    return arrays, meta
+
+
+def save_cache_entry(cache_dir: Path, key: str, arrays: dict, meta: dict = None):
+    """
+    Store arrays under `key` as one .npy file per array plus a meta.json. The entry is written to a temporary directory
+    and renamed into place, so concurrent workers never see a partially written entry.
+
+    :param cache_dir: root directory of the cache
+    :param key: cache key from `hash_files` or `hash_arrays`
+    :param arrays: dictionary of numpy arrays to store
+    :param meta: json serializable metadata stored with the arrays
+    :return: path of the cache entry
+    :group: cache_utils
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(exist_ok=True, parents=True)
+    entry_dir = cache_dir.joinpath(key)
+    tmp_dir = cache_dir.joinpath(f".{key}.{os.getpid()}.tmp")
+    tmp_dir.mkdir(exist_ok=True)
+
+    for name, a in arrays.items():
+        np.save(tmp_dir.joinpath(f"{name}.npy"), np.ascontiguousarray(a))
+    entry_meta = dict(meta or {})
+    entry_meta.update({
+        "version": CACHE_VERSION,
+        "arrays": list(arrays.keys()),
+        "created": time.time(),
+    })
+    with open(tmp_dir.joinpath("meta.json"), "w") as fp:
+        json.dump(entry_meta, fp, indent=4)
+
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process stored the same entry first, keep theirs. An unreadable entry is removed by
+        # `load_cache_entry`, replace it by ours.
+        if load_cache_entry(cache_dir, key) is None:
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                pass
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return entry_dir
+
+
+def cached_arrays(cache_dir: Path, files: list, build):
+    """
+    Return the arrays derived from `files`, from the cache if they have been derived before and by calling `build`
+    otherwise. Caching is skipped when `cache_dir` is None.
+
+    :param cache_dir: root directory of the cache, or None to disable caching
+    :param files: paths of the files the arrays are derived from
+    :param build: function without arguments returning a dictionary of arrays
+    :return: dictionary of arrays
+    :group: cache_utils
+    """
+    if cache_dir is None:
+        return build()
+    key = hash_files(files)
+    entry = load_cache_entry(cache_dir, key)
+    if entry is not None:
+        return entry[0]
+    arrays = build()
+    save_cache_entry(cache_dir, key, arrays, {"files": [str(f) for f in files]})
+    return arrays
+
+
+def cached_ratio_table(F1, F2, cache_dir: Path = None, **table_params):
+    """
+    Return the ratio table of two bandpasses, see `gbu.build_ratio_table`, from the cache if it has been built before
+
+    :param F1: bandpass of the numerator detector
+    :param F2: bandpass of the denominator detector
+    :param cache_dir: root directory of the cache, or None to disable caching
+    :param table_params: keyword arguments of `gbu.build_ratio_table`
+    :return: ratio table dictionary
+    :group: cache_utils
+    """
+    if cache_dir is None:
+        return gbu.build_ratio_table(F1, F2, **table_params)
+    key = hash_arrays(F1, F2, artifact="ratio_table", **table_params)
+    entry = load_cache_entry(cache_dir, key)
+    if entry is not None:
+        arrays, meta = entry
+        return {'T': arrays['T'], 'log_ratio': arrays['log_ratio'], 'max_error': meta['max_error']}
+    ratio_table = gbu.build_ratio_table(F1, F2, **table_params)
+    save_cache_entry(cache_dir, key, {'T': ratio_table['T'], 'log_ratio': ratio_table['log_ratio']},
+                     {"max_error": float(ratio_table['max_error']), "params": table_params})
+    return ratio_table
+
+
+def evict_cache(cache_dir: Path, max_mb: float = None, max_age_days: float = None,
+                stale_tmp_hours: float = STALE_TMP_HOURS):
+    """
+    Remove the temporary directories of entries whose save was interrupted, the cache entries that have not been used
+    for `max_age_days`, then the least recently used entries until the cache is smaller than `max_mb`
+
+    :param cache_dir: root directory of the cache
+    :param max_mb: maximum total size of the cache in megabytes, or None for no limit
+    :param max_age_days: maximum number of days since an entry was last used, or None for no limit
+    :param stale_tmp_hours: hours since a temporary entry directory or its files last changed after which it is
+        removed, younger ones may still be being written by another process
+    :return: list of the removed cache entry and temporary directories
+    :group: cache_utils
+    """
+    cache_dir = Path(cache_dir)
+    if not cache_dir.is_dir():
+        return []
+
+    now = time.time()
+    removed = []
+    entries = []
+    for entry_dir in cache_dir.iterdir():
+        meta_path = entry_dir.joinpath("meta.json")
+        if entry_dir.is_dir() and entry_dir.name.startswith(".") and entry_dir.name.endswith(".tmp"):
+            try:
+                last_changed = max([entry_dir.stat().st_mtime] + [f.stat().st_mtime for f in entry_dir.iterdir()])
+            except OSError:
+                continue  # Renamed into place or removed by its writer meanwhile
+            if now - last_changed > stale_tmp_hours * 3600:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                removed.append(entry_dir)
+        elif entry_dir.is_dir() and meta_path.is_file():
+            size = sum(f.stat().st_size for f in entry_dir.iterdir())
+            entries.append((meta_path.stat().st_mtime, size, entry_dir))
+    entries.sort(key=lambda e: e[0])
+
+    total_size = sum(e[1] for e in entries)
+    for last_used, size, entry_dir in entries:
+        too_old = max_age_days is not None and now - last_used > max_age_days * 86400
+        too_big = max_mb is not None and total_size > max_mb * 2**20
+        if not (too_old or too_big):
+            continue
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
+        removed.append(entry_dir)
+
+    if len(removed) > 0:
+        print(f"Evicted {len(removed)} calibration cache entries from {cache_dir}")
+    return removed
@@ -0,0 +1,376 @@
+"""
+catalog_utils - Lazy access to the datasets of an archive
+
+A `DatasetCatalog` opens the metadata table of one sensor of an archive and loads the traces of its datasets on
+demand, only the columns and time window asked for. The metadata tables and the columns of the traces are kept in
+memory and shared by every catalog of the process, the traces in a least recently used cache with a byte budget, so
+that plotting and analysis steps that revisit the same datasets read each file once.
+
+`select_datasets` queries a metadata table by recording date, time window, duration, unit, burn unit and location,
+each as a whole column predicate, and reports which predicates rejected each dataset.
+"""
+
+import collections
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import kremboxer.utils.dataset_io as dio
+
+# Default byte budget of the shared trace cache
+TRACE_CACHE_BYTES = 2**30
+
+# Metadata tables searched for by `DatasetCatalog`, most processed first
+METADATA_FILES = (
+    "{sensor}_processed_metadata.geojson",
+    "{sensor}_processed_metadata_raw_location.geojson",
+    "{sensor}_raw_metadata.geojson",
+)
+
+# Metadata tables read in this process, keyed by path, size and modification time
+_METADATA = {}
+
+
+def _file_key(path: Path) -> tuple:
+    stat = path.stat()
+    return str(path), stat.st_size, stat.st_mtime_ns
+
+
+class TraceCache:
+    """
+    Least recently used cache of dataset columns, evicting the columns used longest ago once the cached columns take
+    more than `max_bytes`. Columns are keyed by the path, size and modification time of their file, so a rewritten
+    dataset is read again.
+
+    :group: catalog_utils
+    """
+
+    def __init__(self, max_bytes: int = TRACE_CACHE_BYTES):
+        """
+        :param max_bytes: byte budget of the cached columns
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return a cached value and mark it as the most recently used, or None
+
+        :param key: cache key
+        :return: cached value or None
+        """
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, key, value, nbytes: int):
+        """
+        Cache a value, then evict the least recently used values until the cache is within its budget. Values larger
+        than the whole budget are not cached.
+
+        :param key: cache key
+        :param value: value to cache
+        :param nbytes: size of the value in bytes
+        """
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+        if nbytes > self.max_bytes:
+            return
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        self.resize(self.max_bytes)
+
+    def resize(self, max_bytes: int):
+        """
+        Change the byte budget, evicting the least recently used values that no longer fit
+
+        :param max_bytes: byte budget of the cached values
+        """
+        self.max_bytes = max_bytes
+        while self.nbytes > self.max_bytes:
+            key, (value, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+
+# Trace cache shared by every catalog of this process
+_TRACE_CACHE = TraceCache()
+
+
+def trace_cache() -> TraceCache:
+    """
+    Trace cache shared by the catalogs of this process, e.x. to change its budget with `TraceCache.resize`
+
+    :return: TraceCache
+    :group: catalog_utils
+    """
+    return _TRACE_CACHE
+
+
+def read_trace(path: Path, columns: list = None, start=None, end=None, cache: TraceCache = None) -> pd.DataFrame:
+    """
+    Read columns of a dataset through the trace cache, only reading the file for the columns that are not cached
+
+    :param path: dataset file
+    :param columns: optional list of the columns to read, in the order they are returned, all of them by default
+    :param start: optional first time of the samples to return, compared to the DATETIME column
+    :param end: optional last time of the samples to return
+    :param cache: trace cache, by default the one shared by the process
+    :return: dataframe, indexed by the row numbers of the samples in the dataset
+    :group: catalog_utils
+    """
+    cache = _TRACE_CACHE if cache is None else cache
+    file_key = _file_key(Path(path))
+
+    if columns is None:
+        columns = cache.get(file_key + (None,))
+        if columns is None:
+            columns = list(dio.read_dataset(path, rows=(0, 0)).columns)
+            cache.put(file_key + (None,), columns, sum(len(column) for column in columns))
+    columns = list(columns)
+    windowed = start is not None or end is not None
+    needed = columns + (["DATETIME"] if windowed and "DATETIME" not in columns else [])
+
+    values = {column: cache.get(file_key + (column,)) for column in needed}
+    missing = [column for column in needed if values[column] is None]
+    if len(missing) > 0:
+        df = dio.read_dataset(path, columns=missing)
+        for column in missing:
+            values[column] = df[column].copy()
+            cache.put(file_key + (column,), values[column],
+                      int(values[column].memory_usage(index=False, deep=True)))
+
+    trace_df = pd.DataFrame({column: values[column] for column in columns})
+    if windowed:
+        datetimes = values["DATETIME"]
+        mask = pd.Series(True, index=datetimes.index)
+        if start is not None:
+            mask &= datetimes >= _utc_timestamp(start)
+        if end is not None:
+            mask &= datetimes <= _utc_timestamp(end)
+        trace_df = trace_df[mask.to_numpy()]
+    return trace_df
+
+
+def read_metadata(path: Path) -> gpd.GeoDataFrame:
+    """
+    Read a metadata table once per process, later calls return a copy of the table read first unless the file changed
+
+    :param path: metadata GeoJSON
+    :return: GeoDataFrame of the datasets
+    :group: catalog_utils
+    """
+    key = _file_key(Path(path))
+    if key not in _METADATA:
+        _METADATA[key] = gpd.read_file(path, engine="fiona")
+    return _METADATA[key].copy()
+
+
+def start_datetimes(records: pd.DataFrame, column: str = "DATETIME_START") -> pd.Series:
+    """
+    Parse the start times of the datasets of a metadata table, ISO strings or datetimes, to UTC datetime64
+
+    :param records: metadata table
+    :param column: column of the start times
+    :return: series of UTC datetime64 indexed like `records`
+    :group: catalog_utils
+    """
+    return pd.to_datetime(records[column], utc=True, format="ISO8601")
+
+
+def _utc_timestamp(value) -> pd.Timestamp:
+    timestamp = pd.Timestamp(value)
+    return timestamp.tz_localize("UTC") if timestamp.tzinfo is None else timestamp.tz_convert("UTC")
+
+
+def select_datasets(records: pd.DataFrame, dates=None, start=None, end=None, min_duration: float = None,
+                    units=None, burn_units=None, polygon=None, datetimes: pd.Series = None,
+                    datetime_column: str = "DATETIME_START"):
+    """
+    Select the datasets of a metadata table matching every given criterion. Each criterion is evaluated over the
+    whole table at once.
+
+    :param records: metadata table with the `datetime_column`, DURATION in seconds, UNIT, burn_unit and geometry
+        columns used by the criteria
+    :param dates: optional dates, or ISO strings, of the UTC day the datasets started on
+    :param start: optional start of a time window the datasets must overlap, naive times are UTC
+    :param end: optional end of the time window
+    :param min_duration: optional duration in seconds the datasets must be longer than
+    :param units: optional UNIT values of the datasets to keep
+    :param burn_units: optional burn_unit values of the datasets to keep
+    :param polygon: optional shapely geometry in the CRS of the records, or GeoSeries/GeoDataFrame reprojected to it,
+        containing the datasets to keep
+    :param datetimes: optional start times already parsed with `start_datetimes`
+    :param datetime_column: column of the start times
+    :return: (selected records, report) with the report indexed like `records`, holding a boolean column per
+        criterion given, True where the dataset passes it, and "selected"
+    :group: catalog_utils
+    """
+    report = pd.DataFrame(index=records.index)
+    if dates is not None or start is not None or end is not None:
+        datetimes = start_datetimes(records, datetime_column) if datetimes is None else datetimes
+    if dates is not None:
+        days = np.array([np.datetime64(pd.Timestamp(date).date(), "D") for date in dates], dtype="datetime64[D]")
+        report["date"] = np.isin(datetimes.dt.tz_localize(None).to_numpy().astype("datetime64[D]"), days)
+    if start is not None or end is not None:
+        ends = datetimes
+        if "DURATION" in records:
+            ends = datetimes + pd.to_timedelta(pd.to_numeric(records["DURATION"]), unit="s")
+        in_window = np.ones(len(records), dtype=bool)
+        if start is not None:
+            in_window &= (ends >= _utc_timestamp(start)).to_numpy()
+        if end is not None:
+            in_window &= (datetimes <= _utc_timestamp(end)).to_numpy()
+        report["window"] = in_window
+    if min_duration is not None:
+        report["duration"] = (pd.to_numeric(records["DURATION"]) > min_duration).to_numpy()
+    if units is not None:
+        report["unit"] = records["UNIT"].isin(list(units)).to_numpy()
+    if burn_units is not None:
+        report["burn_unit"] = records["burn_unit"].isin(list(burn_units)).to_numpy()
+    if polygon is not None:
+        if isinstance(polygon, (gpd.GeoSeries, gpd.GeoDataFrame)):
+            polygon = polygon.to_crs(records.crs).union_all()
+        report["polygon"] = records.geometry.within(polygon).to_numpy()
+
+    report["selected"] = report.all(axis=1).to_numpy(dtype=bool)
+    return records[report["selected"].to_numpy()].copy(), report
+
+
+def selection_summary(report: pd.DataFrame, label: str = "") -> str:
+    """
+    One line summary of a `select_datasets` report: how many datasets were removed and how many failed each criterion
+
+    :param report: report from `select_datasets`
+    :param label: optional kind of the datasets, e.x. "UFM"
+    :return: summary
+    :group: catalog_utils
+    """
+    criteria = report.drop(columns="selected")
+    rejected = ", ".join(f"{column}: {np.count_nonzero(~criteria[column].to_numpy())}" for column in criteria.columns)
+    removed = len(report) - np.count_nonzero(report["selected"].to_numpy())
+    label = f"{label} " if label else ""
+    return f"Removed {removed} out of {len(report)} {label}datasets" + (f", rejected by {rejected}" if rejected else "")
+
+
+class DatasetCatalog:
+    """
+    Datasets of one sensor of an archive: their metadata records, and their traces loaded lazily through the shared
+    trace cache, see `read_trace`
+
+    :group: catalog_utils
+    """
+
+    def __init__(self, archive_dir: Path, metadata=None, sensor: str = "Dualband", cache: TraceCache = None):
+        """
+        :param archive_dir: root of the archive
+        :param metadata: metadata GeoJSON, or a table of records with the PROCESSING_LEVEL, SENSOR and DATAFILE
+            columns. By default the first of the `METADATA_FILES` of `sensor` in the archive.
+        :param sensor: "Dualband", "UFM" or "Fiveband"
+        :param cache: trace cache, by default the one shared by the process
+        """
+        self.archive_dir = Path(archive_dir)
+        self.sensor = sensor
+        self.cache = cache
+        self._metadata = metadata
+        self._records = metadata if isinstance(metadata, pd.DataFrame) else None
+        self._datetimes = {}
+
+    def metadata_path(self) -> Path:
+        """
+        Metadata table of the catalog
+
+        :return: path of the metadata GeoJSON
+        """
+        if self._metadata is not None and not isinstance(self._metadata, pd.DataFrame):
+            return Path(self._metadata)
+        for name in METADATA_FILES:
+            path = self.archive_dir.joinpath(name.format(sensor=self.sensor))
+            if path.is_file():
+                return path
+        raise FileNotFoundError(f"No {self.sensor} metadata table in {self.archive_dir}")
+
+    @property
+    def records(self) -> pd.DataFrame:
+        """
+        Metadata records of the datasets, read on first use
+        """
+        if self._records is None:
+            self._records = read_metadata(self.metadata_path())
+        return self._records
+
+    def __len__(self):
+        return len(self.records)
+
+    def select(self, **criteria):
+        """
+        Catalog of the datasets matching the criteria, see `select_datasets`. The start times of the records are
+        parsed once per catalog.
+
+        :param criteria: keyword arguments of `select_datasets`
+        :return: (catalog of the selected datasets, report)
+        """
+        column = criteria.get("datetime_column", "DATETIME_START")
+        if column in self.records and column not in self._datetimes:
+            self._datetimes[column] = start_datetimes(self.records, column)
+        selected, report = select_datasets(self.records, datetimes=self._datetimes.get(column), **criteria)
+        return DatasetCatalog(self.archive_dir, selected, self.sensor, self.cache), report
+
+    def record(self, record) -> pd.Series:
+        """
+        Metadata record of a dataset
+
+        :param record: row of the records, dictionary with the PROCESSING_LEVEL, SENSOR and DATAFILE, or index label
+        :return: record
+        """
+        if isinstance(record, (pd.Series, dict)):
+            return record
+        return self.records.loc[record]
+
+    def path(self, record) -> Path:
+        """
+        File of a dataset
+
+        :param record: see `record`
+        :return: path of the dataset in the archive
+        """
+        record = self.record(record)
+        return self.archive_dir.joinpath(record["PROCESSING_LEVEL"], record["SENSOR"], record["DATAFILE"])
+
+    def trace(self, record, columns: list = None, start=None, end=None) -> pd.DataFrame:
+        """
+        Trace of a dataset, see `read_trace`
+
+        :param record: see `record`
+        :param columns: optional list of the columns to read
+        :param start: optional first time of the samples to return
+        :param end: optional last time of the samples to return
+        :return: dataframe, indexed by the row numbers of the samples in the dataset
+        """
+        return read_trace(self.path(record), columns, start, end, self.cache)
+
+    def traces(self, records=None, columns: list = None, start=None, end=None):
+        """
+        Traces of several datasets
+
+        :param records: optional table of records, by default all of the records of the catalog
+        :param columns: optional list of the columns to read
+        :param start: optional first time of the samples to return
+        :param end: optional last time of the samples to return
+        :return: iterator of (index label, record, trace)
+        """
+        records = self.records if records is None else records
+        for i, row in records.iterrows():
+            yield i, row, self.trace(row, columns, start, end)
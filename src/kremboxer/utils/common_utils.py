@@ -1,11 +1,19 @@
 import datetime
 import numpy as np
+import pandas as pd
 import geopandas as gpd
-import scipy.optimize as so
 import scipy.constants as sc
-import kremboxer.utils.greybody_utils as gbu
 from pathlib import Path
 
+# Time of day strings shared by every call of `epoch_to_isoformat`, without and with the UTC offset
+_TIME_OF_DAY = {}
+
+# timedelta keyword of each epoch unit
+_EPOCH_UNITS = {"s": "seconds", "us": "microseconds"}
+
+# Number of bytes scanned for line breaks at once by `find_line_offsets`
+LINE_SCAN_BYTES = 2**24
+
 
 def construct_datetime(year, month, day, hours_utc, minutes, seconds):
     if int(year) == 0:
@@ -20,6 +28,156 @@ def construct_datetime(year, month, day, hours_utc, minutes, seconds):
     return dt
 
 
+def datetime_to_epoch(dt: datetime.datetime, unit="s") -> int:
+    """
+    Time since 1970-01-01T00:00:00 of a datetime, naive datetimes are treated as UTC
+
+    :param dt: datetime
+    :param unit: "s" for seconds or "us" for microseconds
+    :return: integer epoch time
+    :group: krembox_utils
+    """
+    return (dt.replace(tzinfo=None) - datetime.datetime(1970, 1, 1)) // datetime.timedelta(**{_EPOCH_UNITS[unit]: 1})
+
+
+def _time_of_day_strings(utc: bool):
+    """
+    "THH:MM:SS" or "THH:MM:SS+00:00" for every second of the day, built on first use
+    """
+    if utc not in _TIME_OF_DAY:
+        offset = "+00:00" if utc else ""
+        _TIME_OF_DAY[utc] = np.array([f"T{h:02d}:{m:02d}:{s:02d}{offset}"
+                                      for h in range(24) for m in range(60) for s in range(60)], dtype=object)
+    return _TIME_OF_DAY[utc]
+
+
+def epoch_to_isoformat(epoch: np.ndarray, utc=True, unit="s"):
+    """
+    Format int64 epoch times like `datetime.datetime.isoformat`, "2024-03-01T12:00:00.100000+00:00" for timezone aware
+    UTC times or without the offset for naive times, with the microseconds only when they are not zero. Only the
+    distinct days and fractions of a second are formatted, each sample is a concatenation of precomputed strings.
+
+    :param epoch: array of times since 1970-01-01T00:00:00
+    :param utc: whether to append the UTC offset
+    :param unit: "s" if `epoch` is in seconds or "us" if it is in microseconds
+    :return: array of strings
+    :group: krembox_utils
+    """
+    epoch = np.asarray(epoch, dtype=np.int64)
+    if len(epoch) == 0:
+        return np.zeros(0, dtype=object)
+    micros = None
+    if unit == "us":
+        epoch, micros = np.divmod(epoch, 1000000)
+    days, seconds = np.divmod(epoch, 86400)
+
+    first_day = days.min()
+    if days.max() - first_day < len(days):
+        # Traces span a few consecutive days, format all of them without sorting the samples
+        unique_days, day_index = np.arange(first_day, days.max() + 1), days - first_day
+    else:
+        unique_days, day_index = np.unique(days, return_inverse=True)
+    dates = np.datetime_as_string(unique_days.astype("datetime64[D]")).astype(object)
+
+    if micros is None or not micros.any():
+        return dates[day_index] + _time_of_day_strings(utc)[seconds]
+
+    # The UTC offset follows the fraction of a second
+    unique_micros, micro_index = np.unique(micros, return_inverse=True)
+    offset = "+00:00" if utc else ""
+    fractions = np.array([f".{m:06d}{offset}" if m else offset for m in unique_micros], dtype=object)
+    return dates[day_index] + _time_of_day_strings(False)[seconds] + fractions[micro_index]
+
+
+def epoch_to_datetime64(epoch: np.ndarray, utc=True, unit="s") -> pd.DatetimeIndex:
+    """
+    Convert int64 epoch times into datetime64 timestamps in one vectorized cast, without formatting or parsing strings
+
+    :param epoch: array of times since 1970-01-01T00:00:00
+    :param utc: whether the timestamps are timezone aware UTC times
+    :param unit: "s" if `epoch` is in seconds or "us" if it is in microseconds
+    :return: DatetimeIndex of microsecond resolution
+    :group: krembox_utils
+    """
+    times = pd.DatetimeIndex(np.asarray(epoch, dtype=np.int64).astype(f"datetime64[{unit}]").astype("datetime64[us]"))
+    return times.tz_localize("UTC") if utc else times
+
+
+def sample_datetimes(start: datetime.datetime, n_samples: int, sample_period: datetime.timedelta):
+    """
+    Timestamps of evenly spaced samples, materialized from the start time and the sample period rounded to
+    microseconds, like repeatedly adding the period to the start time
+
+    :param start: time of the first sample, naive times are not localized
+    :param n_samples: number of samples
+    :param sample_period: time between samples
+    :return: (epoch, datetimes), int64 array of microseconds since 1970 and DatetimeIndex of the samples
+    :group: krembox_utils
+    """
+    step = sample_period // datetime.timedelta(microseconds=1)
+    epoch = datetime_to_epoch(start, unit="us") + step * np.arange(n_samples, dtype=np.int64)
+    return epoch, epoch_to_datetime64(epoch, utc=start.tzinfo is not None, unit="us")
+
+
+def find_dataset_blocks(data: bytes, first_field: bytes):
+    """
+    Locate the datasets in the contents of a raw instrument file. Each dataset starts with a header row whose first
+    field is `first_field`, "DAY" for dualband files or "UNIT" for UFM files, and runs until the next header row or the
+    end of the file.
+
+    :param data: contents of the raw file, bytes or a memory map
+    :param first_field: first field of the dataset header rows
+    :return: list of (start, end) byte offsets of the datasets in `data`
+    :group: krembox_utils
+    """
+    candidates = [0] if data[:len(first_field)] == first_field else []
+    pos = data.find(b"\n" + first_field)
+    while pos >= 0:
+        candidates.append(pos + 1)
+        pos = data.find(b"\n" + first_field, pos + 1)
+
+    # The first field of the row must be exactly `first_field`
+    n = len(first_field)
+    starts = [start for start in candidates if data[start + n:start + n + 1] in (b",", b"\r", b"\n", b"")]
+    return list(zip(starts, starts[1:] + [len(data)]))
+
+
+def find_line_offsets(block):
+    """
+    Locate the lines in the contents of a raw instrument file, scanning for line breaks a few MB at a time so that no
+    mask of the size of the file is allocated. The last line does not need to end with a line break.
+
+    :param block: bytes, memoryview or memory map of the file contents
+    :return: (buf, line_starts, line_ends), uint8 view of `block` and int64 arrays of the offsets of the first character
+        and of the terminating line break of each line
+    :group: krembox_utils
+    """
+    buf = np.frombuffer(block, dtype=np.uint8)
+    line_ends = np.concatenate([np.flatnonzero(buf[i:i + LINE_SCAN_BYTES] == ord("\n")) + i
+                                for i in range(0, max(len(buf), 1), LINE_SCAN_BYTES)])
+    if len(line_ends) == 0 or line_ends[-1] != len(buf) - 1:
+        line_ends = np.append(line_ends, len(buf))
+    line_starts = np.concatenate([[0], line_ends[:-1] + 1])
+    return buf, line_starts, line_ends
+
+
+def _first_crossings(cumulative: np.ndarray, levels: np.ndarray) -> np.ndarray:
+    # Index of the first cumulative weight of each row reaching its level, searched in the running maximum of the
+    # cumulative weights since negative samples make them decrease
+    running_max = np.maximum.accumulate(cumulative, axis=-1)
+    return np.count_nonzero(running_max < levels[..., None], axis=-1)
+
+
+def _signal_bounds(data: np.ndarray, lengths: np.ndarray, p_start: float, p_end: float):
+    # `get_signal_bounds` of each row of `data`, holding a signal in its first `lengths` samples followed by zeros
+    total = np.sum(data, axis=-1)
+    cumulative = np.concatenate([np.zeros(data.shape[:-1] + (1,)), np.cumsum(data, axis=-1)], axis=-1)
+    ind_start = np.minimum(_first_crossings(cumulative, total * p_start), lengths)
+    ind_end = np.maximum(ind_start, np.minimum(_first_crossings(cumulative, total * p_end), lengths)) - 1
+    empty = total <= 0
+    return np.where(empty, 0, ind_start), np.where(empty, 0, ind_end)
+
+
 def get_signal_bounds(data: np.array, p_start: float, p_end: float):
     """
     Compute the indices, `ind_start` `ind_end`, containing the specified percentage of the signal's integrated weight.  IE `p_start` of the
@@ -33,80 +191,378 @@ def get_signal_bounds(data: np.array, p_start: float, p_end: float):
     :group: krembox_utils
     """
 
-    N = len(data)
-    Itotal = np.sum(data)
-
-    if Itotal <= 0:
+    data = np.asarray(data, dtype=float)
+    if np.sum(data) <= 0:
         print("get_signal_bounds: given array contains no data")
         return 0, 0
 
-    Imin = Itotal*p_start
-    Imax = Itotal*p_end
-
-    w = 0
-    i = 0
-    while w < Imin and i < N:
-        w += data[i]
-        i += 1
-    ind_start = i
-    while w < Imax and i < N:
-        w += data[i]
-        i += 1
-    ind_end = i-1
-    return ind_start, ind_end
-
-
-def associate_data2burnplot(rad_data_gdf: gpd.GeoDataFrame, burn_plot_gdf: gpd.GeoDataFrame):
-    """
-
-    :param rad_data_gdf:
-    :param burn_plot_gdf:
-    :return:
-    """
-    burn_plot_ids = []
-    for i, rad_data_row in rad_data_gdf.iterrows():
-        found = False
-        for j, burn_plot_row in burn_plot_gdf.iterrows():
-            if burn_plot_row.geometry.contains(rad_data_row.geometry):
-                burn_plot_ids.append(burn_plot_row.Id)
-                found = True
-                break
-        if not found:
-            print("Warning! Dataset ", rad_data_row["DATAFILE"], " not contained in any burn plot!!")
-            print("\t(lat,lon)=(", rad_data_row["LATITUDE"], ", ", rad_data_row["LONGITUDE"], ")")
-            print("\tSetting burn plot to unknown")
-            burn_plot_ids.append("unknown")
-
-    rad_data_gdf["burn_unit"] = burn_plot_ids
+    ind_start, ind_end = _signal_bounds(data, len(data), p_start, p_end)
+    return int(ind_start), int(ind_end)
+
+
+# Columns of the per dataset summaries of `summarize_frp_trace`, in the order they are added to the metadata tables
+FRP_SUMMARY_COLUMNS = ["max_FRP_index", "max_FRP_datetime", "max_FRP", "mean_FRP", "var_FRP", "MW_FRE", "LW_FRE",
+                       "fire_duration", "pstart_ind", "pend_ind", "fire_start", "fire_end", "over_1000FRP_duration"]
+
+
+def _duration_minutes(dt_start: np.ndarray, dt_end: np.ndarray) -> np.ndarray:
+    # Whole seconds between two times, in minutes
+    return np.floor((dt_end - dt_start) / np.timedelta64(1, "s")) / 60
+
+
+def _sample_weights(datetimes: np.ndarray, valid: np.ndarray, sample_rate: np.ndarray, max_gap: float):
+    # Number of sample periods each sample stands for in the FRE: the periods until the next sample for gaps of up
+    # to `max_gap` seconds, one period otherwise and for the last sample
+    if max_gap is None:
+        return None
+    periods = np.rint(np.diff(datetimes, axis=-1) / np.timedelta64(1, "us") * 1e-6 * sample_rate[:, None])
+    bridged = valid[:, 1:] & (periods > 1) & (periods <= max_gap * sample_rate[:, None])
+    weights = np.ones(valid.shape)
+    weights[:, :-1] = np.where(bridged, periods, 1.)
+    return weights
+
+
+def frp_trace_statistics(datetimes: np.ndarray, mw_frp: np.ndarray, lw_frp: np.ndarray, sample_rate,
+                         lengths=None, wide_frp: np.ndarray = None, max_gap: float = None) -> dict:
+    """
+    Summary statistics of a batch of FRP traces, see `summarize_frp_trace`, computed with whole array reductions over
+    the traces at once. Trace k is held in the first `lengths[k]` samples of row k of the arrays, the rest of the row is
+    ignored.
+
+    Each sample stands for one sample period of FRE, so the FRE of the missing samples of a gap in a trace is not
+    counted. With `max_gap`, the last sample before a gap of up to `max_gap` seconds stands for the whole gap.
+
+    :param datetimes: datetime64 array of shape (traces, samples) of the sample times
+    :param mw_frp: array of shape (traces, samples) of the MW FRP
+    :param lw_frp: array of shape (traces, samples) of the LW FRP
+    :param sample_rate: sample rate of each trace in Hz, or of all of them
+    :param lengths: optional number of samples of each trace, all of the samples of each row by default
+    :param wide_frp: optional array of shape (traces, samples) of the WIDE FRP
+    :param max_gap: optional longest gap in seconds whose FRE is filled in
+    :return: dictionary with an array of one value per trace of each of the `FRP_SUMMARY_COLUMNS`, and WIDE_FRE if
+        `wide_frp` is given
+    :group: krembox_utils
+    """
+    mw_frp = np.atleast_2d(np.asarray(mw_frp, dtype=float))
+    lw_frp = np.atleast_2d(np.asarray(lw_frp, dtype=float))
+    datetimes = np.atleast_2d(datetimes)
+    n_traces, n_samples = lw_frp.shape
+    lengths = np.broadcast_to(n_samples if lengths is None else np.asarray(lengths), (n_traces,))
+    sample_rate = np.broadcast_to(np.asarray(sample_rate, dtype=float), (n_traces,))
+    valid = np.arange(n_samples) < lengths[:, None]
+    rows = np.arange(n_traces)
+    summary = {}
+
+    # Compute when the max FRP occurs
+    max_FRP_index = np.argmax(np.where(valid, mw_frp, -np.inf), axis=-1)
+    summary["max_FRP_index"] = max_FRP_index
+    summary["max_FRP_datetime"] = datetimes[rows, max_FRP_index]
+    summary["max_FRP"] = mw_frp[rows, max_FRP_index]
+
+    # Mean and variance of the LW FRP over 1000 W/m**2, zero if it never is
+    over_1000 = valid & (lw_frp > 1000)
+    n_over = np.count_nonzero(over_1000, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_FRP = np.sum(np.where(over_1000, lw_frp, 0.), axis=-1) / n_over
+        var_FRP = np.sum(np.where(over_1000, (lw_frp - mean_FRP[:, None])**2, 0.), axis=-1) / (n_over - 1)
+    summary["mean_FRP"] = np.where(n_over > 0, mean_FRP, 0.)
+    summary["var_FRP"] = np.where(n_over > 0, var_FRP, 0.)
+
+    # Compute the FRE as the integral of the FRP over the entire dataset duration
+    weights = _sample_weights(datetimes, valid, sample_rate, max_gap)
+    bands = {"MW": mw_frp, "LW": lw_frp}
+    if wide_frp is not None:
+        bands["WIDE"] = np.atleast_2d(np.asarray(wide_frp, dtype=float))
+    for band, frp in bands.items():
+        frp = np.where(valid, frp, 0.)
+        if weights is not None:
+            frp = frp * weights
+        summary[f"{band}_FRE"] = np.sum(frp, axis=-1) * (1. / sample_rate)
+
+    # Find time bounds for the middle 90% of the integrated FRP signal
+    ind_start, ind_end = _signal_bounds(np.where(valid, lw_frp, 0.), lengths, 0.05, 0.95)
+    ind_start = np.minimum(ind_start, np.maximum(lengths - 1, 0))
+    summary["fire_start"] = datetimes[rows, ind_start]
+    summary["fire_end"] = datetimes[rows, ind_end]
+    summary["fire_duration"] = _duration_minutes(summary["fire_start"], summary["fire_end"])
+    summary["pstart_ind"] = ind_start
+    summary["pend_ind"] = ind_end
+
+    # Find how long the LW FRP stays over 1000 W/m**2, from the first to the last sample over it
+    first = np.argmax(over_1000, axis=-1)
+    last = n_samples - 1 - np.argmax(over_1000[:, ::-1], axis=-1)
+    summary["over_1000FRP_duration"] = np.where(
+        n_over > 0, _duration_minutes(datetimes[rows, first], datetimes[rows, last]), 0.)
+    return {column: summary[column] for column in FRP_SUMMARY_COLUMNS + ["WIDE_FRE"] if column in summary}
+
+
+def summarize_frp_trace(data_proc_df, sample_rate: float, max_gap: float = None) -> dict:
+    """
+    Summarize the FRP trace of a processed dataset: when and how high the MW FRP peaks, the FRE of each band, the
+    bounds of the middle 90% of the LW FRE and how long the LW FRP stays over 1000 W/m**2
+
+    :param data_proc_df: processed dataset with DATETIME, MW_FRP and LW_FRP columns, and optionally WIDE_FRP
+    :param sample_rate: sample rate of the dataset in Hz
+    :param max_gap: optional longest gap in seconds whose FRE is filled in, see `frp_trace_statistics`
+    :return: dictionary with the `FRP_SUMMARY_COLUMNS`, and WIDE_FRE if the dataset has a WIDE_FRP column
+    :group: krembox_utils
+    """
+    statistics = frp_trace_statistics(data_proc_df["DATETIME"].to_numpy(dtype="datetime64[us]"),
+                                      data_proc_df["MW_FRP"].to_numpy(), data_proc_df["LW_FRP"].to_numpy(),
+                                      sample_rate, wide_frp=data_proc_df.get("WIDE_FRP"), max_gap=max_gap)
+    summary = {column: values[0] for column, values in statistics.items()}
+    for column in ["max_FRP_index", "pstart_ind", "pend_ind"]:
+        summary[column] = int(summary[column])
+    for column, index in [("max_FRP_datetime", "max_FRP_index"), ("fire_start", "pstart_ind"),
+                          ("fire_end", "pend_ind")]:
+        summary[column] = data_proc_df["DATETIME"].iloc[summary[index]]
+
+    print("\tMax FRP: ", summary["max_FRP_index"], summary["max_FRP_datetime"], summary["max_FRP"], "W/m**2")
+    print("\t MW FRE:", summary["MW_FRE"], ', LW FRE:', summary["LW_FRE"])
+    print("\tDuration: {:.2f} minutes".format(summary["fire_duration"]))
+    return summary
+
+
+def summarize_frp_traces(data_proc_dfs: list, sample_rates, max_gap: float = None) -> pd.DataFrame:
+    """
+    Summarize the FRP traces of many processed datasets at once, see `summarize_frp_trace`
+
+    :param data_proc_dfs: list of processed datasets with DATETIME, MW_FRP and LW_FRP columns, and optionally WIDE_FRP
+    :param sample_rates: sample rate of each dataset in Hz, or of all of them
+    :param max_gap: optional longest gap in seconds whose FRE is filled in, see `frp_trace_statistics`
+    :return: dataframe of the `FRP_SUMMARY_COLUMNS` of each dataset, and WIDE_FRE if one of them has a WIDE_FRP column,
+        NaN for the others
+    :group: krembox_utils
+    """
+    lengths = np.array([len(df) for df in data_proc_dfs], dtype=int)
+    n_samples = max(1, lengths.max(initial=0))
+    wide = any("WIDE_FRP" in df for df in data_proc_dfs)
+
+    def padded(column, dtype, fill):
+        values = np.full((len(data_proc_dfs), n_samples), fill, dtype=dtype)
+        for k, df in enumerate(data_proc_dfs):
+            if column in df:
+                values[k, :lengths[k]] = df[column].to_numpy(dtype=dtype)
+        return values
+
+    datetimes = padded("DATETIME", "datetime64[us]", np.datetime64("NaT"))
+    statistics = frp_trace_statistics(datetimes, padded("MW_FRP", float, 0.), padded("LW_FRP", float, 0.),
+                                      sample_rates, lengths, padded("WIDE_FRP", float, 0.) if wide else None, max_gap)
+    summary_df = pd.DataFrame(statistics)
+    if wide:
+        summary_df.loc[[("WIDE_FRP" not in df) for df in data_proc_dfs], "WIDE_FRE"] = np.nan
+    for column in ["max_FRP_datetime", "fire_start", "fire_end"]:
+        summary_df[column] = summary_df[column].dt.tz_localize("UTC")
+    return summary_df
+
+
+# Ways `match_burn_units` picks the burn unit of a point inside overlapping units: the first of them in the burn unit
+# table, or the one with the smallest area
+BURN_UNIT_OVERLAP = ("first", "smallest")
+
+
+def match_burn_units(points: gpd.GeoSeries, burn_plot_gdf: gpd.GeoDataFrame, max_distance: float = 0.,
+                     overlap: str = "first", id_column: str = "Id") -> pd.DataFrame:
+    """
+    Find the burn unit containing each point with a spatial index query of the burn units. A point inside several
+    overlapping units is given one of them following `overlap`, see `BURN_UNIT_OVERLAP`. A point outside of every unit
+    is given the nearest unit within `max_distance` meters, or "unknown".
+
+    :param points: radiometer locations
+    :param burn_plot_gdf: burn unit polygons, reprojected to the CRS of the points if needed
+    :param max_distance: distance in meters up to which points outside of every unit are given the nearest one
+    :param overlap: "first" or "smallest", see `BURN_UNIT_OVERLAP`
+    :param id_column: column of the burn unit identifiers
+    :return: dataframe indexed like `points` with the "burn_unit", "burn_unit_match" ("contained", "overlap",
+        "nearest" or "unknown"), "burn_unit_count" of units containing the point and "burn_unit_distance" in meters
+    :group: krembox_utils
+    """
+    if overlap not in BURN_UNIT_OVERLAP:
+        raise ValueError(f"Unknown burn unit overlap resolution {overlap}, expected one of {BURN_UNIT_OVERLAP}")
+    units = burn_plot_gdf.geometry
+    if points.crs is not None and units.crs is not None and units.crs != points.crs:
+        units = units.to_crs(points.crs)
+    unit_ids = burn_plot_gdf[id_column].to_numpy()
+
+    # Distances and areas in meters, in the UTM zone of the points when they are in geographic coordinates
+    metric_points, metric_units = points, units
+    if len(points) > 0 and points.crs is not None and points.crs.is_geographic:
+        metric_crs = points.estimate_utm_crs()
+        metric_points, metric_units = points.to_crs(metric_crs), units.to_crs(metric_crs)
+
+    # Units containing each point, ordered by their precedence for overlapping units
+    point_ind, unit_ind = units.sindex.query(points.values, predicate="within")
+    rank = unit_ind if overlap == "first" else metric_units.area.to_numpy()[unit_ind]
+    order = np.lexsort((unit_ind, rank, point_ind))
+    point_ind, unit_ind = point_ind[order], unit_ind[order]
+    first = np.unique(point_ind, return_index=True)[1]
+
+    matches = pd.DataFrame({
+        "burn_unit": pd.Series("unknown", index=points.index, dtype=object),
+        "burn_unit_match": "unknown",
+        "burn_unit_count": np.bincount(point_ind, minlength=len(points)),
+        "burn_unit_distance": np.nan,
+    }, index=points.index)
+    matches.iloc[point_ind[first], 0] = unit_ids[unit_ind[first]]
+    matches.iloc[point_ind[first], 1] = np.where(matches["burn_unit_count"].iloc[point_ind[first]] > 1, "overlap",
+                                                 "contained")
+    matches.iloc[point_ind[first], 3] = 0.
+
+    # Nearest unit within the tolerance for the points outside of every unit
+    outside = np.flatnonzero(matches["burn_unit_count"].to_numpy() == 0)
+    if max_distance > 0 and len(outside) > 0:
+        (nearest_ind, unit_ind), distances = metric_units.sindex.nearest(
+            metric_points.values[outside], return_all=False, max_distance=max_distance, return_distance=True)
+        matches.iloc[outside[nearest_ind], 0] = unit_ids[unit_ind]
+        matches.iloc[outside[nearest_ind], 1] = "nearest"
+        matches.iloc[outside[nearest_ind], 3] = distances
+    return matches
+
+
+def burn_unit_report(matches: pd.DataFrame, labels: pd.Series) -> str:
+    """
+    Summary of a burn unit association: how many points were matched each way, and which points were not contained
+    in exactly one unit
+
+    :param matches: burn unit matches from `match_burn_units`
+    :param labels: label of each point in the report, e.x. the dataset file names
+    :return: multi-line report
+    """
+    counts = matches["burn_unit_match"].value_counts()
+    lines = [f"Burn units of {len(matches)} datasets: " + ", ".join(
+        f"{counts.get(match, 0)} {match}" for match in ["contained", "overlap", "nearest", "unknown"])]
+    for match, description in [("overlap", "inside {count} overlapping burn units, using {unit}"),
+                               ("nearest", "outside of every burn unit, using {unit} {distance:.1f} m away"),
+                               ("unknown", "not contained in any burn plot, setting burn plot to unknown")]:
+        for i, row in matches[matches["burn_unit_match"] == match].iterrows():
+            lines.append(f"\t{labels[i]} " + description.format(
+                count=row["burn_unit_count"], unit=row["burn_unit"], distance=row["burn_unit_distance"]))
+    return "\n".join(lines)
+
+
+def associate_data2burnplot(rad_data_gdf: gpd.GeoDataFrame, burn_plot_gdf: gpd.GeoDataFrame,
+                            max_distance: float = 0., overlap: str = "first"):
+    """
+    Add the burn unit of each dataset to the metadata, see `match_burn_units`, and print a summary of the association
+
+    :param rad_data_gdf: metadata of the datasets with their DATAFILE and location
+    :param burn_plot_gdf: burn unit polygons with an "Id" column
+    :param max_distance: distance in meters up to which datasets outside of every unit are given the nearest one
+    :param overlap: "first" or "smallest", how to pick among overlapping units, see `BURN_UNIT_OVERLAP`
+    :return: `rad_data_gdf` with a "burn_unit" column, "unknown" for the datasets without one
+    """
+    matches = match_burn_units(rad_data_gdf.geometry, burn_plot_gdf, max_distance, overlap)
+    print(burn_unit_report(matches, rad_data_gdf["DATAFILE"]))
+    rad_data_gdf["burn_unit"] = matches["burn_unit"]
 
     return rad_data_gdf
 
 
-def fit_detector_model(t_target, t_detector, v_sensor, A, N, p0):
-    T_data = np.stack((t_target, t_detector), axis=0)
-    (G, AL), pcov = so.curve_fit(
-        lambda T, G, AL: gbu.detector_model(T[0], G, AL, T[1], A, N),
-        T_data, v_sensor, maxfev=1000, p0=p0)
+def _solve_linear_detector_fit(X1, X2, v):
+    """
+    Batched least squares solution of v ~ c1*X1 + c2*X2 over the last axis, from the 2x2 normal equations
+    """
+    S11, S12, S22 = np.sum(X1 * X1, axis=-1), np.sum(X1 * X2, axis=-1), np.sum(X2 * X2, axis=-1)
+    b1, b2 = np.sum(X1 * v, axis=-1), np.sum(X2 * v, axis=-1)
+    det = S11 * S22 - S12**2
+    return (S22 * b1 - S12 * b2) / det, (S11 * b2 - S12 * b1) / det
+
 
-    return G, AL, pcov
+def _fit_covariance(J, r):
+    """
+    Parameter covariance of a least squares fit with Jacobian J (..., samples, parameters) and residuals r, scaled by
+    the residual variance like `scipy.optimize.curve_fit` does by default
+    """
+    dof = r.shape[-1] - J.shape[-1]
+    s2 = np.sum(r**2, axis=-1) / dof
+    return np.linalg.inv(np.swapaxes(J, -1, -2) @ J) * s2[..., None, None]
 
 
-def fit_kremens_detector_model(t_target, t_detector, v_sensor, A, N, p0):
-    T_data = np.stack((t_target, t_detector), axis=0)
-    G, pcov = so.curve_fit(
-        lambda T, G: G*(A*T[0]**N-A*T[1]**N),
-        T_data, v_sensor, maxfev=1000, p0=p0)
+def _batch_fit_inputs(t_target, t_detector, v_sensor, A, N):
+    v = np.asarray(v_sensor, dtype=float)
+    A = np.asarray(A, dtype=float)[..., None]
+    N = np.asarray(N, dtype=float)[..., None]
+    T = np.broadcast_to(np.asarray(t_target, dtype=float), v.shape)
+    TD = np.broadcast_to(np.asarray(t_detector, dtype=float), v.shape)
+    return T, TD, v, A, N
 
-    return G[0], pcov
 
+def _unbatch(*arrays):
+    return tuple(a.item() if np.ndim(a) == 0 else a for a in arrays)
 
-def fit_narrow_detector_model(t_target, t_detector, v_sensor, A, N, p0):
-    T_data = np.stack((t_target, t_detector), axis=0)
-    (G, AL), pcov = so.curve_fit(
-        lambda T, G, AL: G*(A*T[0]**N-AL*T[1]**4),
-        T_data, v_sensor, maxfev=1000, p0=p0)
 
-    return G, AL, 4, pcov
+def fit_detector_model(t_target, t_detector, v_sensor, A, N, p0=None):
+    """
+    Least squares fit of the gain G and detector emission coefficient AL of `gbu.detector_model`,
+    v = G*(A*T^N - AL*TD^N), for known bandpass coefficients A and N. The model is linear in G and G*AL, so the fit is
+    solved exactly from the normal equations instead of iteratively, and is batched over the leading axes of
+    `v_sensor` so that every band of every unit can be fit in one call.
+
+    :param t_target: blackbody temperatures, Kelvin, broadcastable to `v_sensor`
+    :param t_detector: detector temperatures, Kelvin, broadcastable to `v_sensor`
+    :param v_sensor: detector signals, last axis is the calibration points
+    :param A: bandpass coefficient, scalar or array matching the leading axes of `v_sensor`
+    :param N: bandpass power coefficient, scalar or array matching the leading axes of `v_sensor`
+    :param p0: ignored, the closed form fit needs no initial guess. Kept so that existing callers still work.
+    :return: G, AL, pcov, where pcov is the (2, 2) covariance of (G, AL) for each fit
+    :group: krembox_utils
+    """
+    T, TD, v, A, N = _batch_fit_inputs(t_target, t_detector, v_sensor, A, N)
+    X1 = A * T**N
+    X2 = -TD**N
+    G, GAL = _solve_linear_detector_fit(X1, X2, v)
+    AL = GAL / G
+
+    # Analytic Jacobian of the model with respect to (G, AL)
+    J = np.stack([X1 + AL[..., None] * X2, G[..., None] * X2], axis=-1)
+    pcov = _fit_covariance(J, v - G[..., None] * (X1 + AL[..., None] * X2))
+    return _unbatch(G, AL) + (pcov,)
+
+
+def fit_kremens_detector_model(t_target, t_detector, v_sensor, A, N, p0=None):
+    """
+    Least squares fit of the gain G of the detector model v = G*A*(T^N - TD^N), where the detector emission coefficient
+    equals the bandpass coefficient A. Solved in closed form and batched like `fit_detector_model`.
+
+    :param t_target: blackbody temperatures, Kelvin, broadcastable to `v_sensor`
+    :param t_detector: detector temperatures, Kelvin, broadcastable to `v_sensor`
+    :param v_sensor: detector signals, last axis is the calibration points
+    :param A: bandpass coefficient, scalar or array matching the leading axes of `v_sensor`
+    :param N: bandpass power coefficient, scalar or array matching the leading axes of `v_sensor`
+    :param p0: ignored, the closed form fit needs no initial guess. Kept so that existing callers still work.
+    :return: G, pcov, where pcov is the (1, 1) variance of G for each fit
+    :group: krembox_utils
+    """
+    T, TD, v, A, N = _batch_fit_inputs(t_target, t_detector, v_sensor, A, N)
+    X = A * (T**N - TD**N)
+    G = np.sum(X * v, axis=-1) / np.sum(X**2, axis=-1)
+    pcov = _fit_covariance(X[..., None], v - G[..., None] * X)
+    return _unbatch(G) + (pcov,)
+
+
+def fit_narrow_detector_model(t_target, t_detector, v_sensor, A, N, p0=None):
+    """
+    Least squares fit of G and AL in the narrow band detector model v = G*(A*T^N - AL*TD^4), where the detector
+    emission follows the Stefan-Boltzmann power. Solved in closed form and batched like `fit_detector_model`.
+
+    :param t_target: blackbody temperatures, Kelvin, broadcastable to `v_sensor`
+    :param t_detector: detector temperatures, Kelvin, broadcastable to `v_sensor`
+    :param v_sensor: detector signals, last axis is the calibration points
+    :param A: bandpass coefficient, scalar or array matching the leading axes of `v_sensor`
+    :param N: bandpass power coefficient, scalar or array matching the leading axes of `v_sensor`
+    :param p0: ignored, the closed form fit needs no initial guess. Kept so that existing callers still work.
+    :return: G, AL, 4, pcov, where pcov is the (2, 2) covariance of (G, AL) for each fit
+    :group: krembox_utils
+    """
+    T, TD, v, A, N = _batch_fit_inputs(t_target, t_detector, v_sensor, A, N)
+    X1 = A * T**N
+    X2 = -TD**4
+    G, GAL = _solve_linear_detector_fit(X1, X2, v)
+    AL = GAL / G
+
+    J = np.stack([X1 + AL[..., None] * X2, G[..., None] * X2], axis=-1)
+    pcov = _fit_covariance(J, v - G[..., None] * (X1 + AL[..., None] * X2))
+    return _unbatch(G, AL) + (4, pcov)
 
 
 def associate_data2fuelplot(rad_data_gdf: gpd.GeoDataFrame, fuel_plot_gdf: gpd.GeoDataFrame):
@@ -0,0 +1,204 @@
+"""
+cube_io - Storage of the IR image cubes of the archive
+
+Each cube is stored once. By default it is stored as a .npy file that can be memory mapped. With h5py installed it can
+instead be stored as an HDF5 file, chunked along the frames and compressed, with the timestamp of every frame. Either
+container is read lazily a range of frames at a time. MATLAB .mat and .npy copies are only written on demand.
+
+Usage:
+    python -m kremboxer.utils.cube_io --format mat <cube files>    # export cubes to MATLAB
+"""
+
+import sys
+import argparse
+import contextlib
+from pathlib import Path
+import numpy as np
+import scipy
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# Format name: file extension
+CUBE_FORMATS = {
+    "npy": ".npy",
+    "hdf5": ".h5",
+}
+
+# Export format name: file extension
+EXPORT_FORMATS = {
+    "npy": ".npy",
+    "mat": ".mat",
+}
+
+# Number of frames per HDF5 chunk, the unit of compression and of the frame range reads. 64 UFM frames are 96 kB.
+CHUNK_FRAMES = 64
+
+# Frames copied at a time by `export_cube`
+EXPORT_FRAMES = 4096
+
+# Names of the datasets in the HDF5 container
+HDF5_IMAGES = "ir_images"
+HDF5_TIMESTAMPS = "timestamps"
+
+
+def cube_format(path: Path) -> str:
+    """
+    Format of a cube file, from its extension
+
+    :param path: cube file
+    :return: "npy" or "hdf5"
+    :group: cube_io
+    """
+    suffix = Path(path).suffix.lower()
+    for fmt, extension in CUBE_FORMATS.items():
+        if suffix == extension:
+            return fmt
+    raise ValueError(f"Unknown IR image cube format of {path}, expected one of {list(CUBE_FORMATS.values())}")
+
+
+def cube_path(path: Path, fmt: str = "npy") -> Path:
+    """
+    Path of a cube file in the given format
+
+    :param path: cube file without extension
+    :param fmt: "npy" or "hdf5"
+    :return: path with the extension of the format
+    :group: cube_io
+    """
+    if fmt not in CUBE_FORMATS:
+        raise ValueError(f"Unknown IR image cube format {fmt}, expected one of {list(CUBE_FORMATS.keys())}")
+    path = Path(path)
+    return path.with_name(path.name + CUBE_FORMATS[fmt])
+
+
+def _require_h5py():
+    if h5py is None:
+        raise ImportError("Reading and writing HDF5 IR image cubes requires h5py, install it with: pip install h5py")
+
+
+@contextlib.contextmanager
+def create_cube(path: Path, shape: tuple, dtype=np.uint16, timestamps: np.ndarray = None, compression="gzip"):
+    """
+    Create a cube file and yield an array to fill it frame range by frame range, without holding the cube in memory.
+    The file is complete when the context exits.
+
+    :param path: cube file, the format is given by its extension
+    :param shape: (frames, rows, columns)
+    :param dtype: pixel type
+    :param timestamps: optional int64 array of the time of each frame in microseconds since 1970, HDF5 only
+    :param compression: HDF5 compression filter, e.x. "gzip", "lzf" or None
+    :group: cube_io
+    """
+    if cube_format(path) == "npy":
+        cube = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+        yield cube
+        cube.flush()
+        del cube
+        return
+
+    _require_h5py()
+    with h5py.File(path, "w") as fp:
+        chunks = (max(1, min(CHUNK_FRAMES, shape[0])),) + tuple(shape[1:])
+        cube = fp.create_dataset(HDF5_IMAGES, shape=shape, dtype=dtype, chunks=chunks, compression=compression,
+                                 shuffle=compression is not None)
+        if timestamps is not None:
+            fp.create_dataset(HDF5_TIMESTAMPS, data=np.asarray(timestamps, dtype=np.int64))
+        yield cube
+
+
+def open_cube(path: Path):
+    """
+    Open a cube for lazy reads, slicing the returned array only reads the frames of the slice
+
+    :param path: cube file
+    :return: read only np.memmap for .npy files, h5py dataset for HDF5 files
+    :group: cube_io
+    """
+    if cube_format(path) == "npy":
+        return np.load(path, mmap_mode="r")
+    _require_h5py()
+    return h5py.File(path, "r")[HDF5_IMAGES]
+
+
+def read_frames(path: Path, start: int = 0, stop: int = None) -> np.ndarray:
+    """
+    Read a range of frames of a cube
+
+    :param path: cube file
+    :param start: first frame
+    :param stop: frame after the last one, by default the end of the cube
+    :return: array of the frames
+    :group: cube_io
+    """
+    if cube_format(path) == "npy":
+        return np.array(open_cube(path)[start:stop])
+    _require_h5py()
+    with h5py.File(path, "r") as fp:
+        return fp[HDF5_IMAGES][start:stop]
+
+
+def read_timestamps(path: Path):
+    """
+    Read the frame timestamps of a cube
+
+    :param path: cube file
+    :return: int64 array of microseconds since 1970, or None if the container does not store them. The frames of a .npy
+        cube are the rows of their dataset, whose DATETIME column holds the timestamps.
+    :group: cube_io
+    """
+    if cube_format(path) == "npy":
+        return None
+    _require_h5py()
+    with h5py.File(path, "r") as fp:
+        return fp[HDF5_TIMESTAMPS][:] if HDF5_TIMESTAMPS in fp else None
+
+
+def export_cube(path: Path, fmt: str = "mat", export_path: Path = None) -> Path:
+    """
+    Export a cube to MATLAB, as the "ir_images" variable plus "timestamps" if stored, or to .npy, copying the frames a
+    block at a time. The MATLAB export holds the whole cube in memory.
+
+    :param path: cube file
+    :param fmt: "mat" or "npy"
+    :param export_path: output file, by default `path` with the extension of `fmt`
+    :return: path of the exported file
+    :group: cube_io
+    """
+    path = Path(path)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown IR image cube export format {fmt}, expected one of {list(EXPORT_FORMATS.keys())}")
+    export_path = path.with_suffix(EXPORT_FORMATS[fmt]) if export_path is None else Path(export_path)
+    if export_path == path:
+        raise ValueError(f"{path} is already a {fmt} file")
+
+    cube = open_cube(path)
+    if fmt == "mat":
+        variables = {"ir_images": np.asarray(cube[:])}
+        timestamps = read_timestamps(path)
+        if timestamps is not None:
+            variables["timestamps"] = timestamps
+        scipy.io.savemat(export_path, variables)
+        return export_path
+
+    out = np.lib.format.open_memmap(export_path, mode="w+", dtype=cube.dtype, shape=cube.shape)
+    for k0 in range(0, cube.shape[0], EXPORT_FRAMES):
+        out[k0:k0 + EXPORT_FRAMES] = cube[k0:k0 + EXPORT_FRAMES]
+    out.flush()
+    return export_path
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Export IR image cubes to MATLAB or numpy files")
+    parser.add_argument("cubes", type=Path, nargs="+", help="cube files")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS.keys()), default="mat", help="export format")
+    args = parser.parse_args(argv)
+    for path in args.cubes:
+        print(f"{path} -> {export_cube(path, args.format)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,231 @@
+"""
+dataset_io - Reading and writing of the per dataset files of the archive
+
+Datasets are stored as CSV by default. With pyarrow installed they can also be stored as Parquet or Feather files,
+with typed columns, compression, and reads of a subset of the columns or of a range of rows. The format of a dataset
+file is given by its extension, so readers do not need to know how the archive was written.
+
+In memory the DATETIME column of a dataset holds datetime64 timestamps. Columnar formats store them natively, CSV files
+store ISO 8601 strings that are formatted and parsed here, in one vectorized call per file.
+
+Usage:
+    python -m kremboxer.utils.dataset_io <dataset files>    # export Parquet or Feather datasets to CSV
+"""
+
+import sys
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import kremboxer.utils.common_utils as kucu
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+# Format name: file extension
+DATASET_FORMATS = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "feather": ".feather",
+}
+
+# Number of rows per Parquet row group, the unit of the row range reads
+PARQUET_ROW_GROUP_SIZE = 2**16
+
+DEFAULT_COMPRESSION = "zstd"
+
+
+def dataset_format(path: Path) -> str:
+    """
+    Format of a dataset file, from its extension
+
+    :param path: dataset file
+    :return: "csv", "parquet" or "feather"
+    :group: dataset_io
+    """
+    suffix = Path(path).suffix.lower()
+    for fmt, extension in DATASET_FORMATS.items():
+        if suffix == extension:
+            return fmt
+    raise ValueError(f"Unknown dataset format of {path}, expected one of {list(DATASET_FORMATS.values())}")
+
+
+def dataset_path(path: Path, fmt: str = "csv") -> Path:
+    """
+    Path of a dataset file in the given format
+
+    :param path: dataset file without extension, e.x. "Raw/Dualband/Dualband_7_2024-02-08T15-01-22+00-00"
+    :param fmt: "csv", "parquet" or "feather"
+    :return: path with the extension of the format
+    :group: dataset_io
+    """
+    if fmt not in DATASET_FORMATS:
+        raise ValueError(f"Unknown dataset format {fmt}, expected one of {list(DATASET_FORMATS.keys())}")
+    path = Path(path)
+    return path.with_name(path.name + DATASET_FORMATS[fmt])
+
+
+def _require_pyarrow(fmt: str):
+    if pa is None:
+        raise ImportError(f"Reading and writing {fmt} datasets requires pyarrow, install it with: pip install pyarrow")
+
+
+def _to_columnar(df: pd.DataFrame, float_dtype=None) -> pd.DataFrame:
+    """
+    Type the columns of a dataset for a columnar format, DATETIME strings become timestamps and floating point
+    columns are optionally downcast
+    """
+    df = df.copy(deep=False)
+    df.attrs = {}
+    if "DATETIME" in df and not pd.api.types.is_datetime64_any_dtype(df["DATETIME"]):
+        df["DATETIME"] = pd.to_datetime(df["DATETIME"], format="ISO8601")
+    if float_dtype is not None:
+        for column in df.select_dtypes(include="floating").columns:
+            df[column] = df[column].astype(float_dtype)
+    return df
+
+
+def _format_datetime(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Format a datetime64 DATETIME column into ISO 8601 strings for CSV files, see `common_utils.epoch_to_isoformat`
+    """
+    if "DATETIME" not in df or not pd.api.types.is_datetime64_any_dtype(df["DATETIME"]):
+        return df
+    df = df.copy(deep=False)
+    tz = df["DATETIME"].dt.tz
+    epoch = (df["DATETIME"] - pd.Timestamp(0, tz=tz)) // pd.Timedelta(microseconds=1)
+    df["DATETIME"] = kucu.epoch_to_isoformat(epoch.to_numpy(dtype=np.int64), utc=tz is not None, unit="us")
+    return df
+
+
+def _parse_datetime(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parse the ISO 8601 strings of the DATETIME column of a CSV file into datetime64 timestamps
+    """
+    if "DATETIME" in df and not pd.api.types.is_datetime64_any_dtype(df["DATETIME"]):
+        df["DATETIME"] = pd.to_datetime(df["DATETIME"], format="ISO8601")
+    return df
+
+
+def write_dataset(df: pd.DataFrame, path: Path, fmt: str = None, compression: str = DEFAULT_COMPRESSION,
+                  float_dtype=None, index=False):
+    """
+    Write a dataset. In the columnar formats the DATETIME column is stored as timestamps, and floating point columns
+    are stored as `float_dtype` if given, e.x. "float32" to halve the size of the archive. CSV files store it as ISO
+    8601 strings like "2024-02-08T15:01:22+00:00".
+
+    :param df: dataset
+    :param path: dataset file
+    :param fmt: "csv", "parquet" or "feather", by default the format of the extension of `path`
+    :param compression: compression of the columnar formats, e.x. "zstd", "lz4" or None
+    :param float_dtype: optional floating point type of the columnar formats
+    :param index: whether to write the dataframe index, CSV only
+    :group: dataset_io
+    """
+    fmt = dataset_format(path) if fmt is None else fmt
+    if fmt == "csv":
+        _format_datetime(df).to_csv(path, index=index)
+        return
+    if fmt not in DATASET_FORMATS:
+        raise ValueError(f"Unknown dataset format {fmt}, expected one of {list(DATASET_FORMATS.keys())}")
+    _require_pyarrow(fmt)
+    table = pa.Table.from_pandas(_to_columnar(df, float_dtype), preserve_index=False)
+    if fmt == "parquet":
+        pq.write_table(table, path, compression=compression, row_group_size=PARQUET_ROW_GROUP_SIZE)
+    else:
+        feather.write_feather(table, path, compression=compression if compression is not None else "uncompressed")
+
+
+def _row_range(rows, num_rows: int = None):
+    if rows is None:
+        start, stop = 0, num_rows
+    elif isinstance(rows, slice):
+        if rows.step not in (None, 1):
+            raise ValueError("Only contiguous row ranges can be read")
+        start, stop = rows.start or 0, rows.stop
+    else:
+        start, stop = rows
+    if start < 0 or (stop is not None and stop < 0):
+        raise ValueError(f"Row ranges must be positive, got {rows}")
+    if num_rows is not None:
+        stop = num_rows if stop is None else min(stop, num_rows)
+        start = min(start, stop)
+    return start, stop
+
+
+def read_dataset(path: Path, columns: list = None, rows=None) -> pd.DataFrame:
+    """
+    Read a dataset, or some of its columns or rows. Parquet files only decode the row groups overlapping `rows`, and
+    Feather files are memory mapped, so that reading part of a long dataset costs little more than the part.
+
+    :param path: dataset file
+    :param columns: optional list of the columns to read, in the order they are returned
+    :param rows: optional (start, stop) or slice of the rows to read
+    :return: dataframe, with a DATETIME column of datetime64 timestamps
+    :group: dataset_io
+    """
+    fmt = dataset_format(path)
+    if fmt == "csv":
+        start, stop = _row_range(rows)
+        df = pd.read_csv(path, usecols=columns, skiprows=range(1, start + 1) if start > 0 else None,
+                         nrows=None if stop is None else max(stop - start, 0))
+        return _parse_datetime(df if columns is None else df[list(columns)])
+
+    _require_pyarrow(fmt)
+    if fmt == "parquet":
+        parquet_file = pq.ParquetFile(path)
+        start, stop = _row_range(rows, parquet_file.metadata.num_rows)
+        group_sizes = [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)]
+        group_starts = np.concatenate([[0], np.cumsum(group_sizes)]).astype(int)
+        groups = [i for i in range(len(group_sizes)) if group_starts[i] < stop and group_starts[i + 1] > start]
+        if len(groups) == 0:
+            table = parquet_file.schema_arrow.empty_table()
+        else:
+            table = parquet_file.read_row_groups(groups, columns=columns)
+            table = table.slice(start - group_starts[groups[0]], stop - start)
+    else:
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        start, stop = _row_range(rows, table.num_rows)
+        table = table.slice(start, stop - start)
+    if columns is not None:
+        table = table.select(list(columns))
+    return table.to_pandas()
+
+
+def export_csv(path: Path, csv_path: Path = None) -> Path:
+    """
+    Export a dataset to CSV, with the DATETIME column formatted as in the raw archive
+
+    :param path: dataset file
+    :param csv_path: output file, by default `path` with a .csv extension
+    :return: path of the CSV file
+    :group: dataset_io
+    """
+    path = Path(path)
+    csv_path = path.with_suffix(DATASET_FORMATS["csv"]) if csv_path is None else Path(csv_path)
+    if csv_path == path:
+        raise ValueError(f"{path} is already a CSV file")
+    write_dataset(read_dataset(path), csv_path, "csv")
+    return csv_path
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Export Parquet or Feather datasets to CSV")
+    parser.add_argument("datasets", type=Path, nargs="+", help="dataset files")
+    parser.add_argument("--output-dir", type=Path, default=None, help="directory of the CSV files, default next to "
+                                                                       "the datasets")
+    args = parser.parse_args(argv)
+    for path in args.datasets:
+        csv_path = None
+        if args.output_dir is not None:
+            csv_path = args.output_dir.joinpath(path.with_suffix(DATASET_FORMATS["csv"]).name)
+        print(f"{path} -> {export_csv(path, csv_path)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,280 @@
+"""
+frp_utils - Fire radiative power products of any multi band radiometer
+
+The calibration JSON holds the band map of the instrument, the detector model parameters of each band under "bands"
+(or at the top level for the original dualband calibrations). Each band may name the data "column" of its raw
+voltage, and a numerator band may name the "ratio_denominator" band, and optionally the "ratio_name", of a ratio pair
+used to compute the target temperature. Without them the sensor defaults below apply.
+
+The detector models of all the bands are inverted at once, then each ratio pair gives a target temperature, from which
+the emissivity area product and FRP of the bands of the pair follow. Bands outside of every pair with a
+"BandpassFraction" give the FRP directly from their incident flux.
+"""
+
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import scipy.constants as sc
+import kremboxer.utils.greybody_utils as gbu
+import kremboxer.utils.cache_utils as cache_utils
+import kremboxer.utils.quadrature_utils as qu
+import kremboxer.utils.thermistor_utils as tu
+
+# Raw voltage column of each band, for the bands whose calibration does not name a "column"
+SENSOR_BAND_COLUMNS = {
+    "Dualband": {"LW": "LW-A", "MW": "MW-B"},
+    "UFM": {"LW": "LW-A", "MW": "MW-B", "WIDE": "WIDE"},
+    "Fiveband": {"LW": "LW", "MW": "MW", "3.95": "3.95", "10.95": "10.95", "WIDE": "WIDE"},
+}
+
+# Raw detector temperature sensor column of each sensor
+SENSOR_THERMISTOR_COLUMNS = {
+    "Dualband": "TH",
+    "UFM": "SensTH",
+    "Fiveband": "TH1",
+}
+
+# (name, numerator band, denominator band) of the ratio pairs used when no band names a "ratio_denominator", each
+# pair whose bands are both calibrated is used
+DEFAULT_RATIO_PAIRS = [
+    ("", "MW", "LW"),
+    ("NARROW", "3.95", "10.95"),
+]
+
+
+def temperature_column(name: str) -> str:
+    """
+    Column of the target temperature of a ratio pair, "T" for the unnamed pair and "T_<name>" otherwise
+
+    :param name: name of the ratio pair
+    :return: column name
+    :group: frp_utils
+    """
+    return "T" if name == "" else f"T_{name}"
+
+
+def band_columns(model_params: dict, sensor: str = None) -> dict:
+    """
+    Raw voltage column of each band, the "column" of its calibration, the sensor default, or the band name
+
+    :param model_params: dictionary of the detector model parameters of each band
+    :param sensor: "Dualband", "UFM", "Fiveband" or None
+    :return: dictionary of band: column
+    :group: frp_utils
+    """
+    defaults = SENSOR_BAND_COLUMNS.get(sensor, {})
+    return {band: params.get("column", defaults.get(band, band)) for band, params in model_params.items()}
+
+
+def ratio_pairs(model_params: dict) -> list:
+    """
+    Ratio pairs of a band map, the bands naming a "ratio_denominator" or otherwise the calibrated `DEFAULT_RATIO_PAIRS`
+
+    :param model_params: dictionary of the detector model parameters of each band
+    :return: list of (name, numerator band, denominator band)
+    :group: frp_utils
+    """
+    pairs = [(params.get("ratio_name", ""), band, params["ratio_denominator"])
+             for band, params in model_params.items() if "ratio_denominator" in params]
+    if len(pairs) == 0:
+        pairs = [pair for pair in DEFAULT_RATIO_PAIRS if pair[1] in model_params and pair[2] in model_params]
+    names = [pair[0] for pair in pairs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Ratio pairs {pairs} do not have unique names, set the 'ratio_name' of each pair")
+    for name, numerator, denominator in pairs:
+        if denominator not in model_params:
+            raise ValueError(f"Ratio denominator {denominator} of band {numerator} is not a calibrated band")
+    return pairs
+
+
+def _read_band_map(calibration_path: Path):
+    """
+    Calibration parameters, band map, bandpass file of each band and temperature sensor calibration file of a
+    calibration JSON
+    """
+    calibration_path = Path(calibration_path)
+    with open(calibration_path) as json_data_file:
+        cal_params = json.load(json_data_file)
+
+    # The original dualband calibrations keep each band at the top level, with its bandpass file in "<band>_bandpass"
+    if "bands" in cal_params:
+        model_params = {band: dict(params) for band, params in cal_params["bands"].items()}
+        bp_names = {band: params["bandpass"] for band, params in model_params.items() if "bandpass" in params}
+    else:
+        model_params = {band: dict(params) for band, params in cal_params.items()
+                        if isinstance(params, dict) and f"{band}_bandpass" in cal_params}
+        bp_names = {band: cal_params[f"{band}_bandpass"] for band in model_params}
+
+    cal_dir = calibration_path.parent
+    bp_files = {band: cal_dir.joinpath(name) for band, name in bp_names.items()}
+    return cal_params, model_params, bp_files, cal_dir.joinpath(cal_params["temp_cal_input"])
+
+
+def calibration_files(calibration_path: Path) -> list:
+    """
+    Files of a calibration, the calibration JSON, the temperature sensor calibration and the bandpass of each band
+
+    :param calibration_path: location of the json format calibration data
+    :return: list of paths
+    :group: frp_utils
+    """
+    cal_params, model_params, bp_files, detect_temp_cal_file = _read_band_map(calibration_path)
+    return [Path(calibration_path), detect_temp_cal_file] + list(bp_files.values())
+
+
+def load_band_calibration(calibration_path: Path, cache_dir: Path = None, thermistor_params: dict = None):
+    """
+    Loads the band map, bandpasses and detector temperature sensor calibration of a calibration JSON
+
+    :param calibration_path: location of the json format calibration data
+    :param cache_dir: optional calibration cache directory, the bandpasses and lookup table are memory mapped from the
+        cache when the calibration files have not changed since they were cached
+    :param thermistor_params: optional "method", "out_of_range" and "dtype" options of the detector temperature sensor
+        model, see `thermistor_utils.ThermistorModel`
+    :return: model_params, detect_temp_cal_data, bandpasses. Dictionaries of the detector model parameters of each
+        band, of the temperature sensor calibration, and of the bandpass of each band with a "bandpass" file
+    :group: frp_utils
+    """
+    cal_params, model_params, bp_files, detect_temp_cal_file = _read_band_map(calibration_path)
+    quadrature = cal_params.get("bandpass_quadrature", "rectangle")
+
+    def read_calibration_arrays():
+        arrays = {'lookup': np.flip(np.loadtxt(detect_temp_cal_file, skiprows=1, delimiter=',', usecols=[0, 1, 2]), 0)}
+        for band, bp_file in bp_files.items():
+            arrays[band] = qu.load_bandpass(bp_file, quadrature)
+        return arrays
+    cal_files = [Path(calibration_path), detect_temp_cal_file] + list(bp_files.values())
+    cal_arrays = cache_utils.cached_arrays(cache_dir, cal_files, read_calibration_arrays)
+
+    detect_temp_cal_data = {
+        'r_top': cal_params['r_top'],
+        'v_top': cal_params['v_top'],
+        'lookup': cal_arrays['lookup'],
+        'thermistor': tu.get_thermistor(detect_temp_cal_file, cal_params['v_top'], cal_params['r_top'],
+                                        **(thermistor_params or {}))
+    }
+    bandpasses = {band: cal_arrays[band] for band in bp_files}
+    return model_params, detect_temp_cal_data, bandpasses
+
+
+def build_ratio_tables(model_params: dict, bandpasses: dict, cache_dir: Path = None, **table_params) -> dict:
+    """
+    Ratio to temperature table of every ratio pair of a band map, see `cache_utils.cached_ratio_table`
+
+    :param model_params: dictionary of the detector model parameters of each band
+    :param bandpasses: dictionary of the bandpass of each band
+    :param cache_dir: root directory of the cache, or None to disable caching
+    :param table_params: keyword arguments of `gbu.build_ratio_table`
+    :return: dictionary of (numerator band, denominator band): ratio table
+    :group: frp_utils
+    """
+    return {(numerator, denominator): cache_utils.cached_ratio_table(bandpasses[numerator], bandpasses[denominator],
+                                                                     cache_dir, **table_params)
+            for name, numerator, denominator in ratio_pairs(model_params)}
+
+
+def invert_detector_models(V: np.ndarray, TDs: np.ndarray, G: np.ndarray, AL: np.ndarray, N: np.ndarray) -> np.ndarray:
+    """
+    Incident flux of every band, inverting the detector model W = V/G + AL*TD^N of all of the bands at once
+
+    :param V: (bands, samples) array of the detector voltages in mV
+    :param TDs: array of the detector temperature of each sample
+    :param G: fit coefficient of each band
+    :param AL: fit coefficient of each band
+    :param N: fit power coefficient of each band
+    :return: (bands, samples) array of the incident flux
+    :group: frp_utils
+    """
+    return V / G[:, None] + AL[:, None] * TDs[None, :] ** N[:, None]
+
+
+def compute_frp_products(rad_data: pd.DataFrame, model_params: dict, bandpasses: dict, detect_temp_cal_data: dict,
+                         sensor: str = None, ratio_tables: dict = None, thermistor_column: str = None) -> pd.DataFrame:
+    """
+    Use the radiometer data to compute the target temperature of each ratio pair, and the emissivity area product and
+    FRP of the bands
+
+    Adds, after the columns of `rad_data`, the temperature and out of range flag of each ratio pair, e.x. T and
+    T_OUT_OF_RANGE, then TD and TD_OUT_OF_RANGE, then for each band <band>_eA and <band>_FRP if it is in a ratio pair,
+    <band>_FRP if it has a "BandpassFraction" instead, and <band>_W and <band>_V. The bands of the ratio pairs come
+    first, in the order of the pairs.
+
+    :param rad_data: raw radiometer data
+    :param model_params: dictionary of the detector model parameters of each band, see `load_band_calibration`
+    :param bandpasses: dictionary of the bandpass of each band, only needed for the bands of the ratio pairs
+    :param detect_temp_cal_data: detector temperature sensor calibration
+    :param sensor: "Dualband", "UFM", "Fiveband" or None, gives the default data columns
+    :param ratio_tables: dictionary of (numerator band, denominator band): ratio table from `build_ratio_tables`, the
+        temperatures of the pairs without a table are solved exactly for each sample
+    :param thermistor_column: raw detector temperature sensor column, by default the one of `sensor`
+    :return: copy of `rad_data` with the added products
+    :group: frp_utils
+    """
+    ratio_tables = ratio_tables or {}
+    bands = list(model_params.keys())
+    columns = band_columns(model_params, sensor)
+    pairs = ratio_pairs(model_params)
+
+    # Load raw temperature sensor data and convert it into actual temperature readings
+    if thermistor_column is None:
+        thermistor_column = SENSOR_THERMISTOR_COLUMNS.get(sensor, "TH")
+    thermistor = tu.thermistor_from_cal_data(detect_temp_cal_data)
+    TDs, TD_in_range = thermistor.temperature(rad_data[thermistor_column].to_numpy(), return_in_range=True)
+
+    # Invert the detector models of all of the bands to get the incident fluxes
+    V = np.stack([rad_data[columns[band]].to_numpy(dtype=np.float64) for band in bands])
+    G, AL, N, A = (np.array([model_params[band].get(key, np.nan) for band in bands], dtype=np.float64)
+                   for key in ["G", "AL", "N", "A"])
+    W = invert_detector_models(V, TDs, G, AL, N)
+    k = {band: i for i, band in enumerate(bands)}
+
+    # Compute the target temperature of each pair from the ratio of the fluxes of its two bands, where both detected
+    # radiation. Flag samples where the ratio is outside of the table's temperature range.
+    T_columns = {}
+    T_bands = {}
+    for name, numerator, denominator in pairs:
+        ratios = W[k[numerator]] / W[k[denominator]]
+        detected = (V[k[numerator]] > 0) & (V[k[denominator]] > 0)
+        T_predict = np.zeros_like(ratios)
+        T_detected, in_range = gbu.ratio_temperature(ratios[detected], bandpasses[numerator], bandpasses[denominator],
+                                                     ratio_tables.get((numerator, denominator)))
+        T_predict[detected] = T_detected
+        T_out_of_range = np.zeros_like(detected)
+        T_out_of_range[detected] = ~in_range
+        T_columns[temperature_column(name)] = T_predict
+        T_columns[f"{temperature_column(name)}_OUT_OF_RANGE"] = T_out_of_range
+        for band in [numerator, denominator]:
+            T_bands.setdefault(band, T_predict)
+
+    # Compute emissivity * Area fraction product of the bands of the pairs, zero where the sensors did not detect
+    # radiation, and their fire radiative power, the bands of a pair should agree
+    paired = list(T_bands.keys())
+    products = {}
+    if len(paired) > 0:
+        rows = [k[band] for band in paired]
+        T_paired = np.stack([T_bands[band] for band in paired])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            eA = W[rows] / gbu.planck_model(T_paired, A[rows, None], N[rows, None])
+        eA[np.isinf(eA)] = 0
+        FRP = eA * sc.Stefan_Boltzmann * T_paired ** 4
+        for i, band in enumerate(paired):
+            products[band] = {"eA": eA[i], "FRP": FRP[i]}
+    for band in bands:
+        if band not in products and "BandpassFraction" in model_params[band]:
+            products[band] = {"FRP": W[k[band]] / model_params[band]["BandpassFraction"]}
+
+    # Create a copy of the radiometer dataframe and add the new data products
+    rad_data_proc = rad_data.copy(deep=True)
+    for column, values in T_columns.items():
+        rad_data_proc[column] = values
+    rad_data_proc["TD"] = TDs
+    rad_data_proc["TD_OUT_OF_RANGE"] = ~TD_in_range
+
+    for band in paired + [band for band in bands if band not in T_bands]:
+        for product, values in products.get(band, {}).items():
+            rad_data_proc[f"{band}_{product}"] = values
+        rad_data_proc[f"{band}_W"] = W[k[band]]
+        rad_data_proc[f"{band}_V"] = rad_data[columns[band]]
+
+    return rad_data_proc
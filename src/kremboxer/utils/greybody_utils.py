@@ -2,6 +2,7 @@ import sys
 import numpy as np
 import scipy.constants as sc
 import scipy.optimize as so
+import scipy.special as ss
 import math
 import matplotlib.pyplot as plt
 from matplotlib.dates import datestr2num
@@ -26,18 +27,109 @@ def fit_received_bandpass_energy(f, ts):
         Coefficients for the model fit $W^D(T) = A*T^N$
     """
 
-    lams = f[:, 0]*10**(-6)
-    dlam = lams[1] - lams[0]
-    wd = np.zeros_like(ts, dtype=float)
+    wd = GB_bandpass_integral(ts, f)
+
+    A, N = fit_planck_model(ts, wd)
+    return (A, N, wd)
+
+
+def fit_received_bandpass_energies(fs, ts, space="linear"):
+    """
+    Fit the model $W^D(T) = A*T^N$ of `fit_received_bandpass_energy` for many bandpasses at once, for example every
+    band of every unit in a fleet calibration, with one batched `fit_planck_model` call
 
-    for i in range(0, len(ts)):
-        w_lam = GB_lambda(lams, ts[i])
-        wd[i] = np.sum(w_lam*f[:, 1])*dlam
+    Parameters
+    ----------
+    fs: list of arrays
+        Bandpasses of the sensors, see `fit_received_bandpass_energy`
+    ts: array
+        Temperatures over which to perform the model fits, shared by all bandpasses
+    space: str
+        "linear" or "log" least squares, see `fit_planck_model`
 
-    (A, N), pcov = so.curve_fit(planck_model, ts, wd)
+    Returns
+    -------
+    (A, N, wd)
+        Arrays of the coefficients of each bandpass, and the (bandpasses x temperatures) array of received energies
+    """
+    wd = np.stack([GB_bandpass_integral(ts, f) for f in fs])
+    A, N = fit_planck_model(ts, wd, space=space)
     return (A, N, wd)
 
 
+def fit_planck_model(ts, wd, space="linear", maxiter=100, rtol=1e-12):
+    """
+    Least squares fit of `planck_model`, $W = A*T^N$, batched over the leading dimensions of `wd`.
+
+    The fit starts from the closed form linear least squares fit of $ln(W) = ln(A) + N ln(T)$, which is also the final
+    answer when `space` is "log" and weights every temperature by its relative error. For "linear", the same objective
+    as `scipy.optimize.curve_fit(planck_model, ts, wd)`, Levenberg-Marquardt steps with the analytic Jacobian
+    $[T^N, A T^N ln(T)]$ refine all of the fits together. The amplitude is parametrized as $ln(A) - N mean(ln(T))$ so that
+    the 2x2 normal equations stay well conditioned even for A ~ 1e-12.
+
+    :param ts: temperatures, Kelvin, broadcastable to `wd`
+    :param wd: received energies, last axis is temperature
+    :param space: "linear" or "log"
+    :param maxiter: maximum number of Levenberg-Marquardt iterations
+    :param rtol: relative parameter change below which a fit has converged
+    :return: (A, N), floats for a 1d `wd` or arrays matching the leading dimensions of `wd`
+    :group: greybody_utils
+    """
+    if space not in ("linear", "log"):
+        raise ValueError(f"Unknown fit space {space}")
+    wd = np.asarray(wd, dtype=float)
+    batch_shape = wd.shape[:-1]
+    wd = wd.reshape(-1, wd.shape[-1])
+    log_ts = np.broadcast_to(np.log(np.asarray(ts, dtype=float)), wd.shape)
+
+    # Log space fit, ignoring any non-positive energies
+    valid = wd > 0
+    n_valid = np.count_nonzero(valid, axis=1)
+    log_wd = np.log(np.where(valid, wd, 1))
+    c = np.sum(np.where(valid, log_ts, 0), axis=1) / n_valid
+    x = np.where(valid, log_ts - c[:, None], 0)
+    y_mean = np.sum(np.where(valid, log_wd, 0), axis=1) / n_valid
+    N = np.sum(x * (log_wd - y_mean[:, None]), axis=1) / np.sum(x**2, axis=1)
+    a = y_mean
+
+    if space == "linear":
+        # Levenberg-Marquardt on W = exp(a + N (ln(T) - c)), one damping factor per fit
+        x = log_ts - c[:, None]
+        lam = np.full(len(wd), 1e-3)
+        model = np.exp(a[:, None] + N[:, None] * x)
+        ssr = np.sum((wd - model)**2, axis=1)
+        active = np.ones(len(wd), dtype=bool)
+        for i in range(maxiter):
+            J0, J1 = model, model * x
+            r = wd - model
+            H00, H01, H11 = np.sum(J0**2, axis=1), np.sum(J0 * J1, axis=1), np.sum(J1**2, axis=1)
+            g0, g1 = np.sum(J0 * r, axis=1), np.sum(J1 * r, axis=1)
+            D00, D11 = H00 * (1 + lam), H11 * (1 + lam)
+            det = D00 * D11 - H01**2
+            da = (D11 * g0 - H01 * g1) / det
+            dN = (D00 * g1 - H01 * g0) / det
+
+            a_new, N_new = a + da, N + dN
+            model_new = np.exp(a_new[:, None] + N_new[:, None] * x)
+            ssr_new = np.sum((wd - model_new)**2, axis=1)
+            accept = active & (ssr_new <= ssr)
+            a = np.where(accept, a_new, a)
+            N = np.where(accept, N_new, N)
+            model = np.where(accept[:, None], model_new, model)
+            ssr = np.where(accept, ssr_new, ssr)
+            lam = np.where(accept, lam / 10, lam * 10)
+
+            converged = accept & (np.abs(da) <= rtol * (1 + np.abs(a))) & (np.abs(dN) <= rtol * (1 + np.abs(N)))
+            active &= ~converged & (lam < 1e16)
+            if not active.any():
+                break
+
+    A = np.exp(a - N * c)
+    if len(batch_shape) == 0:
+        return float(A[0]), float(N[0])
+    return A.reshape(batch_shape), N.reshape(batch_shape)
+
+
 def planck_model(T, A, N):
     """
     Computes a polynomial approximation to the planck curve, A*T^N
@@ -88,24 +180,134 @@ def GB_lambda(lams, T, emissivity=1):
     return A/(lams**5*(np.exp(B)-1))
 
 
-def GB_lambda_window(lam1, lam2, T, emissivity=1):
+def GB_lambda_window(lam1, lam2, T, emissivity=1, chunk_size=None, method="analytic"):
     """
     Integrated radiance of an object at temperature `T` over specified wavelengths
 
     :param lam1: lower wavelength bound
     :param lam2: upper wavelength bound
-    :param T: temperature of object
+    :param T: temperature of object, scalar or array of temperatures
     :param emissivity: emissivity of object
-    :return: float, integrated radiance over wavelength window
+    :param chunk_size: number of temperatures evaluated per Planck grid, see `GB_bandpass_integral`
+    :param method: "analytic" to evaluate the exact integral with the series in `GB_lambda_cumulative`, or "riemann"
+        for the reference sum over a 1nm grid
+    :return: float or array matching `T`, integrated radiance over wavelength window
     :group: greybody_utils
     """
-    dlam = 1e-9
-    lams = np.arange(lam1, lam2, dlam) # Integrate with 1nm grid
-    rads = GB_lambda(lams, T, emissivity)
-    return np.sum(rads)*dlam
+    if method == "riemann":
+        dlam = 1e-9
+        lams = np.arange(lam1, lam2, dlam) # Integrate with 1nm grid
+        return _integrate_planck_grid(lams, np.full_like(lams, dlam), T, emissivity, chunk_size)
+    elif method != "analytic":
+        raise ValueError(f"Unknown band integration method {method}")
+
+    # In terms of x = hc/(lam k T) the window is the integral of t^3/(e^t-1) from x2 to x1. Each bound is evaluated
+    # with the series that converges quickly there, and when both bounds fall on the same side the window is the
+    # difference of two tails instead of two values close to the total pi^4/15
+    Ts = np.asarray(T, dtype=float)
+    C = 2*math.pi*emissivity*sc.Boltzmann**4/(sc.Planck**3*sc.c**2)
+    if Ts.ndim == 0:
+        # Plain floats avoid the array overhead for the scalar calls made by root finders
+        x1 = sc.Planck*sc.c/(lam1*sc.Boltzmann*float(Ts))
+        x2 = sc.Planck*sc.c/(lam2*sc.Boltzmann*float(Ts))
+        if x2 >= _PLANCK_SERIES_SWITCH:
+            window = _planck_exp_series(x2) - _planck_exp_series(x1)
+        elif x1 < _PLANCK_SERIES_SWITCH:
+            window = _planck_bernoulli_series(x1) - _planck_bernoulli_series(x2)
+        else:
+            window = _PLANCK_TOTAL - _planck_exp_series(x1) - _planck_bernoulli_series(x2)
+        return np.float64(C*float(Ts)**4*window)
+
+    x1 = sc.Planck*sc.c/(lam1*sc.Boltzmann*Ts)
+    x2 = sc.Planck*sc.c/(lam2*sc.Boltzmann*Ts)
+    upper = x2 >= _PLANCK_SERIES_SWITCH
+    lower = x1 < _PLANCK_SERIES_SWITCH
+    mixed = ~upper & ~lower
+    window = np.empty_like(x1)
+    window[upper] = _planck_exp_series(x2[upper]) - _planck_exp_series(x1[upper])
+    window[lower] = _planck_bernoulli_series(x1[lower]) - _planck_bernoulli_series(x2[lower])
+    window[mixed] = _PLANCK_TOTAL - _planck_exp_series(x1[mixed]) - _planck_bernoulli_series(x2[mixed])
+    return C*Ts**4*window
+
+
+def GB_lambda_cumulative(lam, T, emissivity=1):
+    """
+    Exact integral of the greybody radiance from zero to wavelength `lam`
+
+    :param lam: upper wavelength bound of the integral
+    :param T: temperature of object, scalar or array of temperatures
+    :param emissivity: emissivity of object
+    :return: float or array matching `T`, integrated radiance below `lam`
+    :group: greybody_utils
+    """
+    Ts = np.asarray(T, dtype=float)
+    x = sc.Planck*sc.c/(lam*sc.Boltzmann*Ts)
+    W = 2*math.pi*emissivity*sc.Boltzmann**4*Ts**4/(sc.Planck**3*sc.c**2)*_planck_upper_integral(x)
+    if Ts.ndim == 0:
+        return W[()]
+    return W
 
 
-def GB_ratio(T, lam1, lam2, lam3, lam4):
+# Series for the integral of t^3/(e^t-1): the exponential series of the upper tail converges quickly for large x, the
+# Bernoulli series of the lower integral, x^3 (1/3 - x/8 + sum_k B_2k x^2k / ((2k)! (2k+3))), converges quickly for
+# x < 2 pi and 16 even terms reach double precision below x = 2
+_PLANCK_SERIES_SWITCH = 2.0
+_PLANCK_TOTAL = math.pi**4/15
+_PLANCK_EVEN_COEFFS_REVERSED = [float(ss.bernoulli(2*k)[2*k]/(math.factorial(2*k)*(2*k+3))) for k in range(16, 0, -1)]
+
+
+def _planck_upper_integral(x):
+    """
+    Integral of t^3/(e^t-1) from `x` to infinity
+
+    :param x: array of hc/(lam k T)
+    :return: array matching `x`
+    """
+    x = np.asarray(x, dtype=float)
+    upper = x >= _PLANCK_SERIES_SWITCH
+    G = np.empty_like(x)
+    G[upper] = _planck_exp_series(x[upper])
+    G[~upper] = _PLANCK_TOTAL - _planck_bernoulli_series(x[~upper])
+    return G
+
+
+def _planck_exp_series(x):
+    """
+    Integral of t^3/(e^t-1) from `x` to infinity from the series sum_n e^(-nx) (x^3/n + 3x^2/n^2 + 6x/n^3 + 6/n^4),
+    using 2 + 37/x terms to reach double precision for x >= 2. e^(-nx) is built up by repeated multiplication so that
+    only one exponential per element is evaluated.
+
+    :param x: float or array of hc/(lam k T)
+    :return: float or array matching `x`
+    """
+    if np.size(x) == 0:
+        return np.zeros_like(x)
+    x2 = x*x
+    x3 = x2*x
+    e1 = np.exp(-x)
+    en = 1.0
+    total = 0.0
+    for n in range(1, int(math.ceil(2 + 37/np.min(x))) + 1):
+        en = en*e1
+        total = total + en*(x3/n + 3*x2/n**2 + 6*x/n**3 + 6/n**4)
+    return total
+
+
+def _planck_bernoulli_series(x):
+    """
+    Integral of t^3/(e^t-1) from zero to `x` from the Bernoulli series, accurate to double precision for x < 2
+
+    :param x: float or array of hc/(lam k T)
+    :return: float or array matching `x`
+    """
+    xx = x*x
+    even_terms = 0.0
+    for c in _PLANCK_EVEN_COEFFS_REVERSED:
+        even_terms = (even_terms + c)*xx
+    return x**3*(1/3 - x/8 + even_terms)
+
+
+def GB_ratio(T, lam1, lam2, lam3, lam4, method="analytic"):
     """
     Compute the ratio of the integrated radiances in two wavelength windows
 
@@ -114,32 +316,290 @@ def GB_ratio(T, lam1, lam2, lam3, lam4):
     :param lam2: upper bound of first window
     :param lam3: lower bound of second window
     :param lam4: upper bound of second window
+    :param method: band integration method, see `GB_lambda_window`
     :return: ratio of radiances in given windows
     :group: greybody_utils
     """
-    return GB_lambda_window(lam1, lam2, T) / GB_lambda_window(lam3, lam4, T)
+    return GB_lambda_window(lam1, lam2, T, method=method) / GB_lambda_window(lam3, lam4, T, method=method)
+
+
+def GB_bandpass_integral(T, F, emissivity=1, chunk_size=None):
+    """
+    Compute the integrated radiance received through a detector bandpass from a greybody at each temperature in `T`.
+    Planck radiance is evaluated on a (temperature x wavelength) grid in one broadcast and contracted with the
+    bandpass, `chunk_size` temperatures at a time so that memory stays bounded for long temperature arrays.
+
+    :param T: temperature of object, scalar or array of temperatures
+    :param F: bandpass of the detector, columns are wavelength [um] and transmission fraction, with an optional third
+        column of quadrature weights [um] from `quadrature_utils.attach_quadrature_weights`. Without weights the
+        rectangle rule on a uniform grid is used.
+    :param emissivity: emissivity of the object
+    :param chunk_size: number of temperatures evaluated per grid, defaults to a grid of about 4 million elements
+    :return: float or array matching `T`, radiance received by the detector
+    :group: greybody_utils
+    """
+    lams, weights = _bandpass_weights(F)
+    return _integrate_planck_grid(lams, weights, T, emissivity, chunk_size)
+
 
+def GB_bandpass_integral_derivative(T, F, emissivity=1, chunk_size=None):
+    """
+    Compute the integrated radiance received through a detector bandpass and its derivative with respect to the
+    temperature of the greybody, see `GB_bandpass_integral`
+
+    :param T: temperature of object, scalar or array of temperatures
+    :param F: bandpass of the detector, columns are wavelength [um] and transmission fraction
+    :param emissivity: emissivity of the object
+    :param chunk_size: number of temperatures evaluated per grid
+    :return: (W, dW/dT), floats or arrays matching `T`
+    :group: greybody_utils
+    """
+    lams, weights = _bandpass_weights(F)
+    return _integrate_planck_grid(lams, weights, T, emissivity, chunk_size, derivative=True)
+
+
+def _bandpass_weights(F):
+    """
+    Wavelengths [m] and integration weights [m] of a bandpass, from its quadrature weight column when present and the
+    rectangle rule with the spacing of the first interval otherwise
+
+    :param F: bandpass of the detector
+    :return: (lams, weights)
+    """
+    lams = F[:, 0]*10**(-6)
+    if F.shape[1] > 2:
+        return lams, F[:, 2]*10**(-6)
+    dlam = lams[1] - lams[0]
+    return lams, F[:, 1]*dlam
+
+
+def _integrate_planck_grid(lams, weights, T, emissivity=1, chunk_size=None, derivative=False):
+    """
+    Sum the greybody radiance at wavelengths `lams` times `weights` for every temperature in `T`
 
-def GB_ratio_BP(T, F1, F2):
+    :param lams: wavelengths at which to compute the radiance
+    :param weights: integration weight of each wavelength
+    :param T: temperature of object, scalar or array of temperatures
+    :param emissivity: emissivity of the object
+    :param chunk_size: number of temperatures evaluated per grid
+    :param derivative: also return the derivative of the integral with respect to temperature
+    :return: float or array matching `T`, or a tuple of integral and derivative if `derivative` is set
+    """
+    Ts = np.asarray(T, dtype=float)
+    if chunk_size is None:
+        chunk_size = max(1, 2**22 // max(1, len(lams)))
+
+    flat_Ts = Ts.reshape(-1)
+    W = np.empty_like(flat_Ts)
+    dW = np.empty_like(flat_Ts)
+    with np.errstate(over='ignore'):
+        for start in range(0, len(flat_Ts), chunk_size):
+            stop = start + chunk_size
+            if derivative:
+                # dB/dT = B * x * e^x / (e^x - 1) / T, with x = hc / (lambda k T), sharing one exponential with B
+                chunk_Ts = flat_Ts[start:stop, np.newaxis]
+                x = sc.Planck*sc.c/(lams[np.newaxis, :]*sc.Boltzmann*chunk_Ts)
+                q = np.expm1(x)
+                rads = 2*math.pi*emissivity*sc.Planck*sc.c*sc.c/(lams[np.newaxis, :]**5*q)
+                dW[start:stop] = (rads * x * (1 + 1/q) / chunk_Ts) @ weights
+            else:
+                rads = GB_lambda(lams[np.newaxis, :], flat_Ts[start:stop, np.newaxis], emissivity)
+            W[start:stop] = rads @ weights
+
+    if Ts.ndim == 0:
+        W, dW = W[0], dW[0]
+    else:
+        W, dW = W.reshape(Ts.shape), dW.reshape(Ts.shape)
+    if derivative:
+        return W, dW
+    return W
+
+
+def GB_ratio_BP(T, F1, F2, chunk_size=None):
     """
     Compute the ratio of the integrated radiances in two wavelength windows, accounting for bandbass of detector
 
-    :param T: temperature of object
+    :param T: temperature of object, scalar or array of temperatures
     :param F1: bandpass of the first window detector
     :param F2: bandpass of the second window detector
-    :return: ratio of radiances
+    :param chunk_size: number of temperatures evaluated per Planck grid, see `GB_bandpass_integral`
+    :return: float or array matching `T`, ratio of radiances
     :group: greybody_utils
     """
-    lams1 = F1[:,0]*10**(-6)
-    dlam1 = lams1[1]-lams1[0]
-    W1 = np.sum(GB_lambda(lams1, T) * F1[:, 1])*dlam1
-
-    lams2 = F2[:,0]*10**(-6)
-    dlam2 = lams2[1]-lams2[0]
-    W2 = np.sum(GB_lambda(lams2, T) * F2[:, 1])*dlam2
+    W1 = GB_bandpass_integral(T, F1, chunk_size=chunk_size)
+    W2 = GB_bandpass_integral(T, F2, chunk_size=chunk_size)
     return W1 / W2
 
 
+def build_ratio_table(F1, F2, t_min=200, t_max=2000, dt=1.0, tolerance=0.01, max_refinements=4):
+    """
+    Precompute the ratio of the integrated radiances received through two bandpasses on a dense temperature grid, so
+    that target temperatures can be recovered from measured ratios by interpolation instead of a root find per sample.
+    The table is checked against `solve_ratio_temperature` at every midpoint of the grid and refined until the
+    interpolation error is below `tolerance`.
+
+    :param F1: bandpass of the numerator detector
+    :param F2: bandpass of the denominator detector
+    :param t_min: lowest temperature in the table, Kelvin
+    :param t_max: highest temperature in the table, Kelvin
+    :param dt: initial temperature spacing of the table, Kelvin
+    :param tolerance: maximum allowed difference, Kelvin, between the interpolated and exact temperatures
+    :param max_refinements: number of times the grid spacing may be halved to reach `tolerance`
+    :return: dict with the temperature grid 'T', the monotonic 'log_ratio' curve, and the 'max_error' over all of the
+        midpoints
+    :group: greybody_utils
+    """
+    for refinement in range(0, max_refinements + 1):
+        ts = np.arange(t_min, t_max + 0.5 * dt, dt, dtype=float)
+        log_ratios = np.log(GB_ratio_BP(ts, F1, F2))
+
+        # Keep only the monotonic branch of the ratio curve that reaches t_max, the ratio of some narrow band pairs
+        # turns over at low temperatures and can't be inverted there
+        non_increasing = np.nonzero(np.diff(log_ratios) <= 0)[0]
+        if len(non_increasing) > 0:
+            first = non_increasing[-1] + 1
+            print(f"build_ratio_table: ratio is not monotonic below {ts[first]}K, table restricted to {ts[first]}-{ts[-1]}K")
+            ts = ts[first:]
+            log_ratios = log_ratios[first:]
+        if len(ts) < 2:
+            raise ValueError("build_ratio_table: bandpass ratio has no monotonic range between t_min and t_max")
+
+        table = {
+            'T': ts,
+            'log_ratio': log_ratios,
+        }
+
+        # Check the interpolated temperatures against the exact solution at every grid midpoint, where the error of
+        # each interval is largest
+        t_checks = 0.5 * (ts[:-1] + ts[1:])
+        check_ratios = GB_ratio_BP(t_checks, F1, F2)
+        t_exact, converged, _ = solve_ratio_temperature(check_ratios, F1, F2, ts[0], ts[-1])
+        t_table, in_range = invert_ratio_table(check_ratios, table)
+        table['max_error'] = np.max(np.abs(t_table - t_exact))
+        if table['max_error'] <= tolerance:
+            return table
+        dt = dt / 2
+
+    raise ValueError(f"build_ratio_table: unable to reach tolerance {tolerance}K, max error {table['max_error']}K")
+
+
+def invert_ratio_table(ratios, ratio_table):
+    """
+    Look up the temperatures that produce the given radiance ratios, using a table from `build_ratio_table`. Ratios that
+    fall outside of the table are flagged rather than raising an error.
+
+    :param ratios: array of measured radiance ratios
+    :param ratio_table: precomputed ratio table
+    :return: (T, in_range), array of temperatures (0 where out of range) and boolean array of valid samples
+    :group: greybody_utils
+    """
+    ratios = np.asarray(ratios, dtype=float)
+    log_ratio = ratio_table['log_ratio']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_ratios = np.log(ratios)
+    in_range = (log_ratios >= log_ratio[0]) & (log_ratios <= log_ratio[-1])
+    T = np.zeros_like(ratios)
+    T[in_range] = np.interp(log_ratios[in_range], log_ratio, ratio_table['T'])
+    return T, in_range
+
+
+def solve_ratio_temperature(ratios, F1, F2, t_min=200, t_max=2000, xtol=2e-12, rtol=4*np.finfo(float).eps,
+                            maxiter=50, grid_dt=1.0):
+    """
+    Solve GB_ratio_BP(T, F1, F2) = ratio for every ratio at once with a safeguarded Newton/bisection iteration on the
+    log of the ratio. Each sample starts from a bracket on a coarse temperature grid and takes Newton steps using the
+    analytic temperature derivative of the bandpass integrals, falling back to bisection whenever a step leaves the
+    bracket. Unlike `invert_ratio_table` the result is accurate to the same tolerance as `brentq`, for calibration
+    validation and research runs.
+
+    :param ratios: array of measured radiance ratios
+    :param F1: bandpass of the numerator detector
+    :param F2: bandpass of the denominator detector
+    :param t_min: lowest temperature searched, Kelvin
+    :param t_max: highest temperature searched, Kelvin
+    :param xtol: absolute temperature tolerance, Kelvin
+    :param rtol: relative temperature tolerance
+    :param maxiter: maximum number of iterations per sample
+    :param grid_dt: spacing of the coarse grid used to bracket each sample, Kelvin
+    :return: (T, converged, iterations), arrays of temperatures (0 where out of range), boolean mask of samples that
+        converged within `maxiter`, and the number of iterations taken by each sample
+    :group: greybody_utils
+    """
+    ratios = np.asarray(ratios, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_ratios = np.log(ratios).reshape(-1)
+    T = np.zeros_like(log_ratios)
+    converged = np.zeros(log_ratios.shape, dtype=bool)
+    iterations = np.zeros(log_ratios.shape, dtype=int)
+
+    # Bracket every sample on a coarse grid, restricted to the monotonic branch that reaches t_max
+    ts = np.linspace(t_min, t_max, max(2, int(np.ceil((t_max - t_min) / grid_dt)) + 1))
+    grid_log_ratios = np.log(GB_ratio_BP(ts, F1, F2))
+    non_increasing = np.nonzero(np.diff(grid_log_ratios) <= 0)[0]
+    if len(non_increasing) > 0:
+        first = non_increasing[-1] + 1
+        ts = ts[first:]
+        grid_log_ratios = grid_log_ratios[first:]
+    if len(ts) < 2:
+        raise ValueError("solve_ratio_temperature: bandpass ratio has no monotonic range between t_min and t_max")
+
+    active = np.nonzero((log_ratios >= grid_log_ratios[0]) & (log_ratios <= grid_log_ratios[-1]))[0]
+    k = np.clip(np.searchsorted(grid_log_ratios, log_ratios[active]) - 1, 0, len(ts) - 2)
+    lo = np.full_like(log_ratios, np.nan)
+    hi = np.full_like(log_ratios, np.nan)
+    lo[active] = ts[k]
+    hi[active] = ts[k + 1]
+    T[active] = np.interp(log_ratios[active], grid_log_ratios, ts)
+
+    for i in range(0, maxiter):
+        if len(active) == 0:
+            break
+        T_a, lo_a, hi_a = T[active], lo[active], hi[active]
+        W1, dW1 = GB_bandpass_integral_derivative(T_a, F1)
+        W2, dW2 = GB_bandpass_integral_derivative(T_a, F2)
+        f = np.log(W1 / W2) - log_ratios[active]
+        fp = dW1 / W1 - dW2 / W2
+
+        # The ratio increases with temperature on the bracketed branch
+        lo_a = np.where(f < 0, T_a, lo_a)
+        hi_a = np.where(f > 0, T_a, hi_a)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = f / fp
+        T_new = T_a - step
+        tol = xtol + rtol * np.abs(T_a)
+        done = (f == 0) | (np.abs(step) <= tol)
+        bisect = ~done & (~np.isfinite(T_new) | (T_new <= lo_a) | (T_new >= hi_a))
+        T_new[bisect] = 0.5 * (lo_a[bisect] + hi_a[bisect])
+        T_new[f == 0] = T_a[f == 0]
+        done |= hi_a - lo_a <= tol
+        T[active], lo[active], hi[active] = T_new, lo_a, hi_a
+        iterations[active] += 1
+        converged[active[done]] = True
+        active = active[~done]
+
+    if len(active) > 0:
+        print(f"solve_ratio_temperature: {len(active)} samples did not converge in {maxiter} iterations")
+    return T.reshape(ratios.shape), converged.reshape(ratios.shape), iterations.reshape(ratios.shape)
+
+
+def ratio_temperature(ratios, F1, F2, ratio_table=None):
+    """
+    Compute the target temperatures that produce the given radiance ratios, by interpolation in `ratio_table` when one
+    is given and with the exact `solve_ratio_temperature` otherwise
+
+    :param ratios: array of measured radiance ratios
+    :param F1: bandpass of the numerator detector
+    :param F2: bandpass of the denominator detector
+    :param ratio_table: precomputed ratio table from `build_ratio_table`, or None to solve for each sample
+    :return: (T, in_range), array of temperatures (0 where no solution was found) and boolean array of valid samples
+    :group: greybody_utils
+    """
+    if ratio_table is not None:
+        return invert_ratio_table(ratios, ratio_table)
+    T, converged, iterations = solve_ratio_temperature(ratios, F1, F2)
+    return T, converged
+
+
 def stefan_boltzmann(T, emissivity=1):
     """
     Compute the total radiation emitted by a greybody object via Stefan-Boltzmann law
@@ -158,11 +618,13 @@ def detector_temperature_lookup(R, temp_cal_data):
 
     :param R: - Resistance of temperature sensor, Ohms
     :param temp_cal_data: - Lookup table that translates Resistance readings to temperature measurements. Columns are [T Celcius, T Kelvin, Resistance]
-    :return: Td, the temperature of the sensor
+    :return: Td, the temperature of the sensor, clipped to the temperature range of the lookup table
     :group: greybody_utils
     """
 
-    index = np.searchsorted(temp_cal_data[:,2], R)
+    # Resistances outside of the table are clipped to its ends, see `thermistor_utils.ThermistorModel` for flagging them
+    R = np.clip(R, temp_cal_data[0, 2], temp_cal_data[-1, 2])
+    index = np.clip(np.searchsorted(temp_cal_data[:,2], R), 1, len(temp_cal_data) - 1)
 
     w = (R - temp_cal_data[index - 1, 2]) / (temp_cal_data[index, 2] - temp_cal_data[index - 1, 2])
     Td = (1-w)*temp_cal_data[index-1, 1] + (w)*temp_cal_data[index, 1]
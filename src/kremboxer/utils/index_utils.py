@@ -0,0 +1,224 @@
+import os
+import csv
+import json
+import mmap
+import datetime
+import numpy as np
+from pathlib import Path
+import kremboxer.utils.common_utils as kucu
+import kremboxer.dualband.dualband_utils as db_utils
+import kremboxer.dualband.dualband_clean as db_clean
+import kremboxer.ufm.ufm_clean as ufm_clean
+
+# Bump when the layout or content of the index files changes, so stale indexes are rebuilt
+INDEX_VERSION = 1
+
+# First field of the header row that starts each dataset in the raw files of each sensor
+DATASET_HEADER_FIELDS = {
+    "Dualband": b"DAY",
+    "UFM": b"UNIT",
+    "Fiveband": b"TIME",
+}
+
+# Sensors whose datasets can be read on their own with `read_indexed_dataset`
+INDEXED_READERS = ("Dualband", "UFM")
+
+
+def index_path(file: Path, index_dir: Path = None) -> Path:
+    """
+    Path of the sidecar index of a raw file, "<file name>.index.json" next to the file or in `index_dir`
+
+    :param file: raw instrument file
+    :param index_dir: optional directory for the index, e.x. when the raw data is on a read only card
+    :return: path of the index json
+    :group: index_utils
+    """
+    file = Path(file)
+    return Path(index_dir if index_dir is not None else file.parent).joinpath(f"{file.name}.index.json")
+
+
+def _file_signature(file: Path) -> dict:
+    stat = Path(file).stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _index_dataset(file: Path, sensor: str, view, start: int, end: int) -> dict:
+    """
+    Index entry of one dataset: its byte range, header values, number of samples and duration
+    """
+    buf, line_starts, line_ends = kucu.find_line_offsets(view[start:end])
+    n_header_rows = 1 if sensor == "Fiveband" else 3
+    header_rows = list(csv.reader(bytes(buf[line_starts[i]:line_ends[i]]).decode().rstrip("\r")
+                                  for i in range(min(n_header_rows, len(line_starts)))))
+
+    if sensor == "UFM":
+        n_samples = ufm_clean.count_ufm_frames(len(line_starts) - n_header_rows)
+    else:
+        # Blank lines, also the one after the last line break, are not samples
+        lengths = line_ends[n_header_rows:] - line_starts[n_header_rows:]
+        first = buf[np.minimum(line_starts[n_header_rows:], len(buf) - 1)]
+        n_samples = int(np.count_nonzero((lengths > 1) | ((lengths == 1) & (first != ord("\r")))))
+
+    header = {}
+    if sensor == "Dualband":
+        header = db_utils.construct_dualband_header_dict(header_rows[0], header_rows[1])
+        header['UNIT'] = db_clean.dualband_unit_from_file(file)
+    elif sensor == "UFM":
+        header = ufm_clean.construct_ufm_header_dict(header_rows[0], header_rows[1])
+    if "DATETIME_START" in header:
+        header["DATETIME_START"] = header["DATETIME_START"].isoformat()
+
+    # Fiveband files record one sample per second, their start time is only known once the GPS rows are parsed
+    sample_rate = header.get('SAMPLE-RATE(Hz)', 1.0)
+    return {
+        "offset": int(start),
+        "length": int(end - start),
+        "n_samples": int(n_samples),
+        "duration": n_samples / sample_rate if sample_rate > 0 else 0.0,
+        "header": header,
+    }
+
+
+def build_dataset_index(file: Path, sensor: str) -> dict:
+    """
+    Scan a raw file once and record the byte offset, length, header values and number of samples of each of its
+    datasets, so that they can be filtered and read without parsing the rest of the file
+
+    :param file: raw instrument file
+    :param sensor: "Dualband", "UFM" or "Fiveband", see `archive_utils.id_sensor_from_raw_file`
+    :return: index dictionary, with the file size and modification time it was built from and a list of "datasets"
+    :group: index_utils
+    """
+    index = {
+        "version": INDEX_VERSION,
+        "file": Path(file).name,
+        "sensor": sensor,
+        **_file_signature(file),
+        "datasets": [],
+    }
+    if index["size"] == 0:
+        return index
+
+    with open(file, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for start, end in kucu.find_dataset_blocks(data, DATASET_HEADER_FIELDS[sensor]):
+            with memoryview(data) as view:
+                index["datasets"].append(_index_dataset(file, sensor, view, start, end))
+    return index
+
+
+def load_dataset_index(file: Path, sensor: str, index_dir: Path = None, write=True) -> dict:
+    """
+    Load the sidecar index of a raw file, building it if it does not exist or if the file changed since it was built.
+    New indexes are written next to the file or to `index_dir`, unless the directory is read only.
+
+    :param file: raw instrument file
+    :param sensor: "Dualband", "UFM" or "Fiveband"
+    :param index_dir: optional directory for the index
+    :param write: whether to save a newly built index
+    :return: index dictionary, see `build_dataset_index`
+    :group: index_utils
+    """
+    path = index_path(file, index_dir)
+    if path.is_file():
+        try:
+            with open(path) as fp:
+                index = json.load(fp)
+            if (index.get("version") == INDEX_VERSION and index.get("sensor") == sensor and
+                    all(index.get(key) == value for key, value in _file_signature(file).items())):
+                return index
+        except (OSError, ValueError):
+            print(f"Ignoring unreadable dataset index {path}")
+
+    index = build_dataset_index(file, sensor)
+    if write:
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "w") as fp:
+                json.dump(index, fp, indent=1)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Unable to write dataset index {path}: {e}")
+    return index
+
+
+def dataset_start(entry: dict):
+    """
+    Start time of an indexed dataset, None if it is not known before parsing the dataset
+
+    :group: index_utils
+    """
+    start = entry["header"].get("DATETIME_START")
+    return None if start is None else datetime.datetime.fromisoformat(start)
+
+
+def select_datasets(index: dict, burn_dates: list = None, duration_cutoff: float = None) -> list:
+    """
+    Select the datasets of an index recorded on one of `burn_dates` and longer than `duration_cutoff`, the same
+    criteria used by the processing steps. Datasets without samples are always skipped, datasets whose start time is
+    not in the index are kept.
+
+    :param index: index dictionary, see `load_dataset_index`
+    :param burn_dates: optional list of dates, as dates or ISO strings
+    :param duration_cutoff: optional minimum duration, seconds
+    :return: list of index entries
+    :group: index_utils
+    """
+    target_dates = None
+    if burn_dates is not None:
+        target_dates = {d if isinstance(d, datetime.date) else datetime.date.fromisoformat(d) for d in burn_dates}
+
+    entries = []
+    for entry in index["datasets"]:
+        if entry["n_samples"] == 0:
+            continue
+        if duration_cutoff is not None and not entry["duration"] > duration_cutoff:
+            continue
+        start = dataset_start(entry)
+        if target_dates is not None and start is not None and start.date() not in target_dates:
+            continue
+        entries.append(entry)
+    return entries
+
+
+def read_dataset_bytes(file: Path, entry: dict) -> bytes:
+    """
+    Read the contents of one indexed dataset, seeking straight to it
+
+    :group: index_utils
+    """
+    with open(file, 'rb') as fp:
+        fp.seek(entry["offset"])
+        block = fp.read(entry["length"])
+    if len(block) != entry["length"]:
+        raise ValueError(f"Dataset at byte {entry['offset']} of {file} is truncated, rebuild the index")
+    return block
+
+
+def read_indexed_dataset(file: Path, sensor: str, entry: dict, cube_dir: Path = None, epoch_column=False,
+                         cube_format="npy"):
+    """
+    Parse one indexed dataset of a raw file, without reading the rest of the file
+
+    :param file: raw instrument file
+    :param sensor: "Dualband" or "UFM"
+    :param entry: index entry of the dataset, see `build_dataset_index`
+    :param cube_dir: optional directory to write UFM IR image cubes to, see `ufm_clean.parse_ufm_block`
+    :param epoch_column: also return the sample times as an int64 "EPOCH" column
+    :param cube_format: format of the cubes written to `cube_dir`, "npy" or "hdf5", see `cube_io`
+    :return: (header_dict, data_df) for dualband datasets, (header_dict, data_df, ir_image_cube) for UFM datasets
+    :group: index_utils
+    """
+    if sensor not in INDEXED_READERS:
+        raise ValueError(f"Indexed reads are not supported for {sensor} datasets")
+    block = read_dataset_bytes(file, entry)
+    if sensor == "Dualband":
+        header_dict, data_df = db_clean.parse_dualband_block(block, epoch_column)
+        header_dict['UNIT'] = db_clean.dualband_unit_from_file(file)
+        return header_dict, data_df
+
+    cube_path = None
+    if cube_dir is not None:
+        header = dict(entry["header"], DATETIME_START=dataset_start(entry))
+        cube_path = Path(cube_dir).joinpath(ufm_clean.cube_file_name(header, cube_format))
+    return ufm_clean.parse_ufm_block(block, cube_path, epoch_column)
@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import datetime
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# Bump when the layout of the manifests changes, so old manifests are ignored and the outputs rebuilt
+MANIFEST_VERSION = 1
+
+# Bytes hashed at a time by `hash_file`
+HASH_CHUNK_BYTES = 2**20
+
+
+def hash_file(file: Path) -> str:
+    """
+    Compute the sha256 content hash of a file, reading it a chunk at a time
+
+    :param file: path of the file
+    :return: hex digest of the file contents
+    :group: manifest_utils
+    """
+    h = hashlib.sha256()
+    with open(file, "rb") as fp:
+        for chunk in iter(lambda: fp.read(HASH_CHUNK_BYTES), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_record(file: Path, previous: dict = None) -> dict:
+    """
+    Record the size, modification time and content hash of a file. The hash of `previous` is reused when the size and
+    modification time did not change, so unchanged files are not read again.
+
+    :param file: path of the file
+    :param previous: optional earlier record of the file
+    :return: dictionary with "size", "mtime_ns" and "sha256"
+    :group: manifest_utils
+    """
+    stat = Path(file).stat()
+    record = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if previous is not None and all(previous.get(key) == value for key, value in record.items()):
+        record["sha256"] = previous["sha256"]
+    else:
+        record["sha256"] = hash_file(file)
+    return record
+
+
+def json_safe(value):
+    """
+    Convert metadata values into json serializable values, datetimes become ISO strings, see `from_json_safe`
+
+    :group: manifest_utils
+    """
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if isinstance(value, (datetime.datetime, pd.Timestamp)):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def from_json_safe(value):
+    """
+    Convert values stored with `json_safe` back, ISO strings become datetimes
+
+    :group: manifest_utils
+    """
+    if isinstance(value, dict):
+        if value.keys() == {"datetime"}:
+            return datetime.datetime.fromisoformat(value["datetime"])
+        return {key: from_json_safe(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_json_safe(item) for item in value]
+    return value
+
+
+def load_manifest(path: Path):
+    """
+    Load a manifest written by `save_manifest`
+
+    :param path: manifest json
+    :return: manifest dictionary, or None if there is no manifest of the current version at `path`
+    :group: manifest_utils
+    """
+    path = Path(path)
+    if not path.is_file():
+        return None
+    try:
+        with open(path) as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError):
+        print(f"Ignoring unreadable manifest {path}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(path: Path, manifest: dict):
+    """
+    Write a manifest to a temporary file and rename it into place, so that an interrupted run leaves the previous
+    manifest intact
+
+    :param path: manifest json
+    :param manifest: json serializable dictionary, see `json_safe`
+    :group: manifest_utils
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as fp:
+        json.dump(dict(manifest, version=MANIFEST_VERSION), fp, indent=1)
+    os.replace(tmp_path, path)
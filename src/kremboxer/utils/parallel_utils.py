@@ -0,0 +1,149 @@
+import concurrent.futures
+from pathlib import Path
+import pandas as pd
+import kremboxer.utils.common_utils as cu
+import kremboxer.utils.manifest_utils as mu
+
+# Processing manifest of each sensor, in the root of the archive
+PROCESSING_MANIFEST = "{sensor}_processing_manifest.json"
+
+# Data processing parameters that change the processed datasets, a change to any of them reprocesses every dataset
+PROCESSING_SETTINGS = ("temperature_solver", "ratio_table_tolerance", "thermistor")
+
+# Calibration shared by the datasets processed in this worker process, set once per worker by `_init_worker`
+_WORKER_CALIBRATION = None
+
+
+def _init_worker(calibration: dict):
+    global _WORKER_CALIBRATION
+    _WORKER_CALIBRATION = calibration
+
+
+def _process_in_worker(process_dataset, task: dict):
+    return process_dataset(task, _WORKER_CALIBRATION)
+
+
+def map_datasets(process_dataset, tasks: list, calibration: dict, num_workers: int = 1) -> list:
+    """
+    Apply `process_dataset(task, calibration)` to every task, in this process or with a pool of `num_workers`
+    processes. The calibration is sent to each worker once when it starts, rather than with every task.
+
+    :param process_dataset: module level function of a task and the calibration
+    :param tasks: list of the tasks, e.x. one dictionary of file paths per dataset
+    :param calibration: calibration shared by all of the tasks
+    :param num_workers: number of worker processes, 1 to process the tasks serially
+    :return: list of the results, in the order of `tasks`
+    :group: parallel_utils
+    """
+    if num_workers <= 1 or len(tasks) <= 1:
+        return [process_dataset(task, calibration) for task in tasks]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(num_workers, len(tasks)), initializer=_init_worker,
+                                                initargs=(calibration,)) as executor:
+        return list(executor.map(_process_in_worker, [process_dataset] * len(tasks), tasks))
+
+
+def processing_fingerprint(calibration_files: list, params: dict) -> dict:
+    """
+    Fingerprint of everything besides the raw data that the processed datasets depend on: the contents of the
+    calibration files and the `PROCESSING_SETTINGS` of the data processing parameters
+
+    :param calibration_files: files of the calibration, see `frp_utils.calibration_files`
+    :param params: data processing parameters
+    :return: json serializable dictionary
+    :group: parallel_utils
+    """
+    return mu.json_safe({
+        "calibration": [mu.hash_file(file) for file in calibration_files],
+        "params": {key: params.get(key) for key in PROCESSING_SETTINGS},
+    })
+
+
+def _processed_output_record(processed_path: Path):
+    if processed_path is None:
+        return None
+    stat = processed_path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _processed_output_current(processed_path: Path, record: dict) -> bool:
+    if processed_path is None:
+        return True
+    return processed_path.is_file() and _processed_output_record(processed_path) == record.get("processed")
+
+
+def process_datasets(datasets_gdf: pd.DataFrame, process_dataset, calibration: dict, archive_root: Path,
+                     processed_data_dir: Path = None, num_workers: int = 1, manifest_path: Path = None,
+                     fingerprint: dict = None, incremental: bool = True) -> pd.DataFrame:
+    """
+    Process every dataset of a metadata table with `process_dataset`, see `map_datasets`, and add the summary
+    returned for each dataset to its row of the table
+
+    With a `manifest_path`, the size, modification time and content hash of the raw data of each dataset are recorded
+    with its summary and the `fingerprint` of the calibration and parameters. Datasets whose raw data did not change,
+    and whose processed dataset is still the one written, are skipped on the next call with the same fingerprint and
+    their recorded summary is reused.
+
+    :param datasets_gdf: metadata table of the raw datasets
+    :param process_dataset: module level function of a task and the calibration, returning a summary dictionary. The
+        task has the "data_path" of the raw dataset, the "processed_path" to write the processed dataset to, None if
+        `processed_data_dir` is None, and the "sample_rate" of the dataset.
+    :param calibration: calibration shared by all of the datasets
+    :param archive_root: root of the archive
+    :param processed_data_dir: optional directory of the processed datasets
+    :param num_workers: number of worker processes
+    :param manifest_path: optional processing manifest json, see `PROCESSING_MANIFEST`
+    :param fingerprint: fingerprint of the calibration and processing parameters, see `processing_fingerprint`
+    :param incremental: false to reprocess every dataset, the manifest is still written
+    :return: copy of `datasets_gdf` with a column per summary entry, at least the `common_utils.FRP_SUMMARY_COLUMNS`
+    :group: parallel_utils
+    """
+    tasks = []
+    keys = []
+    for i, row in datasets_gdf.iterrows():
+        tasks.append({
+            "data_path": archive_root.joinpath(row['PROCESSING_LEVEL'], row['SENSOR'], row['DATAFILE']),
+            "processed_path": None if processed_data_dir is None else processed_data_dir.joinpath(row['DATAFILE']),
+            "sample_rate": row['SAMPLE-RATE(Hz)'],
+        })
+        keys.append(Path(row['PROCESSING_LEVEL'], row['SENSOR'], row['DATAFILE']).as_posix())
+
+    # Reuse the summaries of the datasets that did not change since the last call
+    manifest = None if manifest_path is None else mu.load_manifest(manifest_path)
+    settings = mu.json_safe(fingerprint)
+    old_records = {}
+    if incremental and manifest is not None and manifest["settings"] == settings:
+        old_records = manifest["datasets"]
+    records = []
+    summaries = []
+    to_process = []
+    for k, (task, key) in enumerate(zip(tasks, keys)):
+        previous = old_records.get(key)
+        record = mu.file_record(task["data_path"], previous) if manifest_path is not None else {}
+        if (previous is not None and record["sha256"] == previous["sha256"]
+                and previous["sample_rate"] == mu.json_safe(task["sample_rate"])
+                and _processed_output_current(task["processed_path"], previous)):
+            summaries.append(mu.from_json_safe(previous["summary"]))
+        else:
+            summaries.append(None)
+            to_process.append(k)
+        records.append(record)
+    if manifest_path is not None:
+        print(f"Processing {len(to_process)} new or changed datasets out of {len(tasks)}")
+
+    for k, summary in zip(to_process, map_datasets(process_dataset, [tasks[k] for k in to_process], calibration,
+                                                   num_workers)):
+        summaries[k] = summary
+
+    if manifest_path is not None:
+        datasets = {}
+        for k, (task, key) in enumerate(zip(tasks, keys)):
+            datasets[key] = dict(records[k], sample_rate=mu.json_safe(task["sample_rate"]),
+                                 summary=mu.json_safe(summaries[k]),
+                                 processed=_processed_output_record(task["processed_path"]))
+        mu.save_manifest(manifest_path, {"settings": settings, "datasets": datasets})
+
+    summary_df = pd.DataFrame(summaries, index=datasets_gdf.index)
+    datasets_gdf = datasets_gdf.copy()
+    for column in cu.FRP_SUMMARY_COLUMNS + [x for x in summary_df.columns if x not in cu.FRP_SUMMARY_COLUMNS]:
+        datasets_gdf[column] = summary_df[column] if column in summary_df else pd.Series(dtype=object)
+    return datasets_gdf
@@ -8,12 +8,19 @@ import scipy.constants as sc
 import kremboxer.dualband.dualband_process
 import kremboxer.ufm.ufm_process
 import kremboxer.fiveband.fiveband_process
+import kremboxer.utils.cache_utils as cache_utils
 
 
 def run_data_processing(data_processing_params: dict):
 
     archive_root = Path(data_processing_params["archive_dir"])
 
+    # Trim the calibration cache before the processing adds to it
+    if data_processing_params.get("calibration_cache_dir") is not None:
+        cache_utils.evict_cache(Path(data_processing_params["calibration_cache_dir"]),
+                                max_mb=data_processing_params.get("calibration_cache_max_mb"),
+                                max_age_days=data_processing_params.get("calibration_cache_max_age_days"))
+
     # Process raw dualband data
     dualband_metadata_path = Path(archive_root.joinpath("Dualband_raw_metadata.geojson"))
     if dualband_metadata_path.exists():
@@ -0,0 +1,113 @@
+import numpy as np
+import kremboxer.utils.greybody_utils as gbu
+
+# Next more accurate rule, used to estimate the error of a quadrature rule on a given grid
+_REFERENCE_RULE = {
+    "rectangle": "trapezoid",
+    "trapezoid": "simpson",
+}
+
+
+def quadrature_weights(x, rule="trapezoid"):
+    """
+    Compute weights w such that sum(w * f(x)) approximates the integral of f over the grid `x`. The grid only needs to
+    be increasing, not uniform, so that bandpasses can be integrated on the native grid of the manufacturer data.
+
+    :param x: increasing array of abscissas
+    :param rule: "rectangle" for the legacy left rectangle rule with the spacing of the first interval, "trapezoid", or
+        "simpson" for composite Simpson on pairs of unequal intervals, with a three point correction for the last
+        interval of an odd number of intervals
+    :return: array of weights matching `x`
+    :group: quadrature_utils
+    """
+    x = np.asarray(x, dtype=float)
+    h = np.diff(x)
+    if np.any(h <= 0):
+        raise ValueError("quadrature_weights: grid must be strictly increasing")
+
+    if rule == "rectangle":
+        return np.full_like(x, h[0])
+    if rule == "trapezoid" or (rule == "simpson" and len(x) < 3):
+        w = np.zeros_like(x)
+        w[:-1] += h / 2
+        w[1:] += h / 2
+        return w
+    if rule != "simpson":
+        raise ValueError(f"Unknown quadrature rule {rule}")
+
+    w = np.zeros_like(x)
+    n_pairs = len(h) // 2
+    h0 = h[0:2*n_pairs:2]
+    h1 = h[1:2*n_pairs:2]
+    first = np.arange(0, 2*n_pairs, 2)
+    np.add.at(w, first, (h0 + h1) / 6 * (2 - h1 / h0))
+    np.add.at(w, first + 1, (h0 + h1) / 6 * (h0 + h1)**2 / (h0 * h1))
+    np.add.at(w, first + 2, (h0 + h1) / 6 * (2 - h0 / h1))
+
+    if len(h) % 2 == 1:
+        # Integrate the last interval with the quadratic through the last three points
+        h0, h1 = h[-2], h[-1]
+        w[-1] += (2 * h1**2 + 3 * h0 * h1) / (6 * (h0 + h1))
+        w[-2] += (h1**2 + 3 * h1 * h0) / (6 * h0)
+        w[-3] -= h1**3 / (6 * h0 * (h0 + h1))
+    return w
+
+
+def attach_quadrature_weights(F, rule="trapezoid", drop_zero_weights=False):
+    """
+    Precompute the quadrature weights of a bandpass once, returned as a third column holding transmission times
+    wavelength weight [um]. `gbu.GB_bandpass_integral` and the functions built on it use the third column when present
+    instead of the legacy rectangle rule.
+
+    :param F: bandpass, columns are wavelength [um] and transmission fraction
+    :param rule: quadrature rule, see `quadrature_weights`
+    :param drop_zero_weights: remove wavelengths that contribute nothing to the integral, so that fewer Planck
+        evaluations are needed
+    :return: bandpass array with columns wavelength [um], transmission fraction, and integration weight [um]
+    :group: quadrature_utils
+    """
+    weights = F[:, 1] * quadrature_weights(F[:, 0], rule)
+    F_weighted = np.column_stack([F[:, 0], F[:, 1], weights])
+    if drop_zero_weights:
+        F_weighted = F_weighted[weights != 0]
+    return F_weighted
+
+
+def quadrature_error_estimate(F, rule="trapezoid", Ts=(300., 600., 1200., 2000.)):
+    """
+    Estimate the relative error of the bandpass integral with the given rule, from its difference with the next more
+    accurate rule on the same grid, or for Simpson from Richardson extrapolation against every other grid point
+
+    :param F: bandpass, columns are wavelength [um] and transmission fraction
+    :param rule: quadrature rule, see `quadrature_weights`
+    :param Ts: temperatures at which to compare the integrals, Kelvin
+    :return: largest relative error estimate over `Ts`
+    :group: quadrature_utils
+    """
+    Ts = np.asarray(Ts, dtype=float)
+    W = gbu.GB_bandpass_integral(Ts, attach_quadrature_weights(F[:, :2], rule))
+    if rule in _REFERENCE_RULE:
+        W_ref = gbu.GB_bandpass_integral(Ts, attach_quadrature_weights(F[:, :2], _REFERENCE_RULE[rule]))
+        error = np.abs(W - W_ref)
+    else:
+        # Keep the last point so that both grids cover the same wavelengths
+        coarse = np.unique(np.append(np.arange(0, len(F), 2), len(F) - 1))
+        W_coarse = gbu.GB_bandpass_integral(Ts, attach_quadrature_weights(F[coarse, :2], rule))
+        error = np.abs(W - W_coarse) / 15
+    return np.max(error / np.abs(W))
+
+
+def load_bandpass(bandpass_path, rule="rectangle"):
+    """
+    Load a bandpass csv, with quadrature weights attached for any rule other than the legacy rectangle rule. Wavelengths
+    that do not contribute to the integral are dropped to save Planck evaluations.
+
+    :param bandpass_path: csv file with columns wavelength [um] and transmission fraction
+    :param rule: quadrature rule the calibration was computed with, see `quadrature_weights`
+    :return: bandpass array
+    :group: quadrature_utils
+    """
+    F = np.loadtxt(bandpass_path, delimiter=',', skiprows=1, usecols=[0, 1])
+    if rule == "rectangle":
+        return F
+    return attach_quadrature_weights(F, rule, drop_zero_weights=True)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import kremboxer.utils.greybody_utils as gbu
+import kremboxer.utils.thermistor_utils as tu
+
+
+def bandpass_energy_interpolator(F, t_min=200, t_max=2000, dt=1.0):
+    """
+    Tabulate the energy received through a bandpass from a blackbody, `gbu.GB_bandpass_integral`, and return a function
+    interpolating it in log-log space. Simulating long traces this way costs one interpolation per sample instead of one
+    bandpass integral per sample.
+
+    :param F: bandpass, columns are wavelength [um] and transmission fraction
+    :param t_min: lowest tabulated temperature, Kelvin
+    :param t_max: highest tabulated temperature, Kelvin
+    :param dt: temperature spacing of the table, Kelvin
+    :return: function mapping an array of temperatures to received energy
+    :group: simulation_utils
+    """
+    Ts = np.arange(t_min, t_max + dt, dt)
+    log_Ts = np.log(Ts)
+    log_W = np.log(gbu.GB_bandpass_integral(Ts, F))
+
+    def energy(T):
+        return np.exp(np.interp(np.log(T), log_Ts, log_W))
+    return energy
+
+
+def thermistor_reading(thermistor, TD):
+    """
+    Invert a thermistor model, computing the mV reading of the temperature sensor for a detector temperature
+
+    :param thermistor: `thermistor_utils.ThermistorModel`
+    :param TD: array of detector temperatures, Kelvin
+    :return: array of sensor readings, mV
+    :group: simulation_utils
+    """
+    # The table is sorted by increasing resistance, so temperature is decreasing
+    R = np.interp(TD, thermistor.T[::-1].astype(float), thermistor.R[::-1].astype(float))
+    return R * thermistor.v_top / (R + thermistor.r_top)
+
+
+def simulate_fire_trace(n_samples, t_ambient=300., t_peak=1100., eA_peak=0.2, TD_range=(295., 310.), noise=0.0,
+                        seed=0):
+    """
+    Simulate the true target temperature, emissivity area product and detector temperature seen by a radiometer while a
+    fire front passes underneath. The fire is a Gaussian pulse centered on the trace with a width of a tenth of the
+    trace, flickering with uniform noise, and the detector slowly warms over the trace.
+
+    :param n_samples: number of samples in the trace
+    :param t_ambient: temperature of the ground before and after the fire, Kelvin
+    :param t_peak: temperature at the center of the fire pulse, Kelvin
+    :param eA_peak: emissivity area product at the center of the fire pulse
+    :param TD_range: detector temperatures at the start and end of the trace, Kelvin
+    :param noise: relative amplitude of the flicker of the target temperature
+    :param seed: seed of the random number generator
+    :return: (T, eA, TD) arrays
+    :group: simulation_utils
+    """
+    rng = np.random.default_rng(seed)
+    s = (np.arange(n_samples) - n_samples / 2) / max(n_samples / 10, 1)
+    pulse = np.exp(-s**2 / 2)
+    T = t_ambient + (t_peak - t_ambient) * pulse * (1 + noise * rng.uniform(-1, 1, n_samples))
+    eA = 0.01 + (eA_peak - 0.01) * pulse
+    TD = np.linspace(TD_range[0], TD_range[1], n_samples)
+    return T, eA, TD
+
+
+def simulate_dualband_trace(n_samples, F_MW, F_LW, model_params: dict, detect_temp_cal_data: dict, dt=0.1,
+                            **fire_params):
+    """
+    Simulate a raw dualband trace by running a simulated fire, `simulate_fire_trace`, forward through the detector
+    model, `gbu.detector_model`, with the received energy integrated over the sensor bandpasses. The result has the
+    columns read by `dualband_process.compute_FRP`, plus the true target temperature and emissivity area product so
+    that the inversion can be checked.
+
+    :param n_samples: number of samples in the trace
+    :param F_MW: bandpass of the MW sensor
+    :param F_LW: bandpass of the LW sensor
+    :param model_params: detector model parameters of the "LW" and "MW" sensors from the calibration
+    :param detect_temp_cal_data: detector temperature sensor calibration, see `dualband_process.load_dualband_calibration_data`
+    :param dt: sample spacing, seconds
+    :param fire_params: keyword arguments of `simulate_fire_trace`
+    :return: pandas dataframe with columns "Time", "TH", "LW-A", "MW-B", "T_TRUE", "eA_TRUE", "TD_TRUE"
+    :group: simulation_utils
+    """
+    T, eA, TD = simulate_fire_trace(n_samples, **fire_params)
+    rad_data = pd.DataFrame({
+        "Time": np.arange(n_samples) * dt,
+        "TH": thermistor_reading(tu.thermistor_from_cal_data(detect_temp_cal_data), TD),
+    })
+    for band, F, column in [("LW", F_LW, "LW-A"), ("MW", F_MW, "MW-B")]:
+        p = model_params[band]
+        energy = bandpass_energy_interpolator(F)
+        rad_data[column] = p["G"] * (eA * energy(T) - p["AL"] * TD**p["N"])
+    rad_data["T_TRUE"] = T
+    rad_data["eA_TRUE"] = eA
+    rad_data["TD_TRUE"] = TD
+    return rad_data
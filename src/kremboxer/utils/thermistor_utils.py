@@ -0,0 +1,155 @@
+import hashlib
+import numpy as np
+from pathlib import Path
+
+# Thermistor models shared by every calibration that uses the same lookup table, keyed by table contents and options
+_THERMISTORS = {}
+
+
+class ThermistorModel:
+    """
+    Converts the mV readings of the detector temperature sensor into temperatures. The sensor is a thermistor at the
+    bottom of a voltage divider, its resistance is converted to temperature by interpolating the calibration lookup
+    table or with a Steinhart-Hart fit to the table.
+
+    Readings whose resistance falls outside of the table, on cold mornings or when the sensor is disconnected, are
+    handled according to `out_of_range`: "clip" to the temperature at the end of the table, "nan", or "raise" a
+    ValueError.
+
+    :group: thermistor_utils
+    """
+
+    def __init__(self, lookup, v_top, r_top, method="linear", out_of_range="clip", dtype=np.float64):
+        """
+        :param lookup: calibration table, columns are [T Celsius, T Kelvin, Resistance Ohms], in any order
+        :param v_top: voltage at the top of the divider, mV
+        :param r_top: resistance of the resistor at the top of the divider, Ohms
+        :param method: "linear" interpolation of the table, or "steinhart-hart"
+        :param out_of_range: "clip", "nan" or "raise"
+        :param dtype: floating point type of the computed temperatures, np.float32 or np.float64
+        """
+        if method not in ("linear", "steinhart-hart"):
+            raise ValueError(f"Unknown thermistor method {method}")
+        if out_of_range not in ("clip", "nan", "raise"):
+            raise ValueError(f"Unknown thermistor out of range policy {out_of_range}")
+
+        lookup = np.asarray(lookup, dtype=float)
+        order = np.argsort(lookup[:, 2])
+        self.dtype = np.dtype(dtype)
+        self.R = lookup[order, 2].astype(self.dtype)
+        self.T = lookup[order, 1].astype(self.dtype)
+        self.v_top = v_top
+        self.r_top = r_top
+        self.method = method
+        self.out_of_range = out_of_range
+
+        if method == "steinhart-hart":
+            # 1/T = A + B ln(R) + C ln(R)^3, least squares fit over the table
+            lnR = np.log(lookup[:, 2])
+            X = np.column_stack([np.ones_like(lnR), lnR, lnR**3])
+            self.steinhart_hart = np.linalg.lstsq(X, 1 / lookup[:, 1], rcond=None)[0]
+
+    @classmethod
+    def from_csv(cls, lookup_path: Path, v_top, r_top, **kwargs):
+        """
+        Build a thermistor model from a temperature_sensor_calibration.csv lookup table
+
+        :param lookup_path: csv with a header row and columns T[C], T[K], R[Ohm]
+        :param v_top: voltage at the top of the divider, mV
+        :param r_top: resistance of the resistor at the top of the divider, Ohms
+        :param kwargs: options of `ThermistorModel`
+        :return: ThermistorModel
+        """
+        lookup = np.loadtxt(lookup_path, skiprows=1, delimiter=',', usecols=[0, 1, 2])
+        return cls(lookup, v_top, r_top, **kwargs)
+
+    def resistance(self, mV):
+        """
+        Convert mV readings of the voltage divider into thermistor resistances. Readings at or above `v_top`, from a
+        disconnected sensor, give an infinite resistance.
+
+        :param mV: array of sensor readings, mV
+        :return: array of resistances, Ohms
+        """
+        mV = np.asarray(mV, dtype=self.dtype)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            R = mV * self.dtype.type(self.r_top) / (self.dtype.type(self.v_top) - mV)
+        R[mV >= self.v_top] = np.inf
+        return R
+
+    def temperature_from_resistance(self, R, return_in_range=False):
+        """
+        Convert thermistor resistances into temperatures
+
+        :param R: array of resistances, Ohms
+        :param return_in_range: also return a boolean array marking resistances inside of the lookup table
+        :return: array of temperatures in Kelvin, and the in range mask if `return_in_range`
+        """
+        R = np.asarray(R, dtype=self.dtype)
+        in_range = (R >= self.R[0]) & (R <= self.R[-1])
+        if self.out_of_range == "raise" and not in_range.all():
+            raise ValueError(f"{np.count_nonzero(~in_range)} thermistor resistances outside of the lookup table range "
+                             f"{self.R[0]}-{self.R[-1]} Ohms")
+        R_clipped = np.clip(R, self.R[0], self.R[-1])
+
+        if self.method == "steinhart-hart":
+            lnR = np.log(R_clipped.astype(float))
+            A, B, C = self.steinhart_hart
+            T = (1 / (A + B * lnR + C * lnR**3)).astype(self.dtype)
+        else:
+            index = np.clip(np.searchsorted(self.R, R_clipped), 1, len(self.R) - 1)
+            w = (R_clipped - self.R[index - 1]) / (self.R[index] - self.R[index - 1])
+            T = (1 - w) * self.T[index - 1] + w * self.T[index]
+
+        if self.out_of_range == "nan":
+            T[~in_range] = np.nan
+        if return_in_range:
+            return T, in_range
+        return T
+
+    def temperature(self, mV, return_in_range=False):
+        """
+        Convert mV readings of the temperature sensor into temperatures
+
+        :param mV: array of sensor readings, mV
+        :param return_in_range: also return a boolean array marking readings inside of the lookup table
+        :return: array of temperatures in Kelvin, and the in range mask if `return_in_range`
+        """
+        return self.temperature_from_resistance(self.resistance(mV), return_in_range)
+
+
+def get_thermistor(lookup_path: Path, v_top, r_top, method="linear", out_of_range="clip", dtype="float64"):
+    """
+    Return the thermistor model for a lookup table, shared between every calibration that uses a table with the same
+    contents and the same options, so that it is built once per process rather than once per calibration load
+
+    :param lookup_path: csv with a header row and columns T[C], T[K], R[Ohm]
+    :param v_top: voltage at the top of the divider, mV
+    :param r_top: resistance of the resistor at the top of the divider, Ohms
+    :param method: "linear" or "steinhart-hart"
+    :param out_of_range: "clip", "nan" or "raise"
+    :param dtype: "float32" or "float64"
+    :return: ThermistorModel
+    :group: thermistor_utils
+    """
+    with open(lookup_path, "rb") as fp:
+        digest = hashlib.sha256(fp.read()).hexdigest()
+    key = (digest, v_top, r_top, method, out_of_range, np.dtype(dtype).str)
+    if key not in _THERMISTORS:
+        _THERMISTORS[key] = ThermistorModel.from_csv(lookup_path, v_top, r_top, method=method,
+                                                     out_of_range=out_of_range, dtype=dtype)
+    return _THERMISTORS[key]
+
+
+def thermistor_from_cal_data(detect_temp_cal_data: dict):
+    """
+    Return the thermistor model of a detector temperature calibration dictionary, building one from its lookup table
+    if the dictionary was not created by one of the calibration loaders
+
+    :param detect_temp_cal_data: dictionary with 'v_top', 'r_top', 'lookup' and optionally 'thermistor'
+    :return: ThermistorModel
+    :group: thermistor_utils
+    """
+    if 'thermistor' in detect_temp_cal_data:
+        return detect_temp_cal_data['thermistor']
+    return ThermistorModel(detect_temp_cal_data['lookup'], detect_temp_cal_data['v_top'], detect_temp_cal_data['r_top'])
@@ -6,6 +6,7 @@ from pathlib import Path
 import datetime
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+import kremboxer.utils.catalog_utils as catalog_utils
 
 
 def plot_FRP_traces_by_burn_unit(gdf: gpd.GeoDataFrame, root_dir: Path, time_window_map, plot_lookup_df: pd.DataFrame):
@@ -16,6 +17,7 @@ def plot_FRP_traces_by_burn_unit(gdf: gpd.GeoDataFrame, root_dir: Path, time_win
     print(plot_lookup_df.head())
     plot_lookup_df["rad"] = plot_lookup_df["rad"].str.lower()
 
+    catalog = catalog_utils.DatasetCatalog(root_dir, gdf)
     for burn_unit in burn_units:
         plt.rcParams.update({'font.size': 14})
         plt.rc('legend', fontsize=10)
@@ -23,14 +25,10 @@ def plot_FRP_traces_by_burn_unit(gdf: gpd.GeoDataFrame, root_dir: Path, time_win
 
         burn_unit_gdf = gdf[gdf['burn_unit'] == burn_unit]
         for i, row in burn_unit_gdf.iterrows():
-            datafile = root_dir.joinpath(row['PROCESSING_LEVEL'], row['SENSOR'], row['DATAFILE'])
             start_dt = datetime.datetime.fromisoformat(str(row['fire_start']))
             end_dt = datetime.datetime.fromisoformat(str(row['fire_end']))
 
-            df = pd.read_csv(datafile)
-            datetimes = pd.to_datetime(df['DATETIME'])
-
-            mask = (datetimes >= start_dt) & (datetimes <= end_dt)
+            df = catalog.trace(row, ["DATETIME", "MW_FRP"], start_dt, end_dt)
             clipplot = plot_lookup_df[(plot_lookup_df.burn_unit == burn_unit) & (plot_lookup_df.rad == row['UNIT'].lower())]
 
             if len(clipplot) == 0:
@@ -42,7 +40,7 @@ def plot_FRP_traces_by_burn_unit(gdf: gpd.GeoDataFrame, root_dir: Path, time_win
                 print("Using first entry")
             clipplot_name = clipplot.iloc[0]['clipplot']
             print(clipplot_name)
-            axs.plot(datetimes[mask], df[mask]['MW_FRP'], label=clipplot_name)
+            axs.plot(df['DATETIME'], df['MW_FRP'], label=clipplot_name)
 
         axs.legend()
         axs.set_title(f'FRP vs Datetime, Burn Unit: {burn_unit}')
@@ -61,7 +59,7 @@ if __name__ == "__main__":
     clipplot_rad_lookup_table = Path("/home/jepaki/Projects/Objects/Eglin_2023/eglin_2023_clipplot_rad_lookuptable.csv")
     plot_lookup_df = pd.read_csv(clipplot_rad_lookup_table)
     dualband_processed_metadatafile = root_dir.joinpath("Dualband_processed_metadata.geojson")
-    gdf = gpd.read_file(dualband_processed_metadatafile, engine='fiona')
+    gdf = catalog_utils.read_metadata(dualband_processed_metadatafile)
     time_window_map = {
         'G-20': {
             't_start': datetime.datetime(year=2023, month=3, day=19, hour=15, minute=45, second=0,
@@ -0,0 +1,85 @@
+"""
+test_dualband_clean - Test suite for kremboxer.dualband.dualband_clean
+
+Checks the bulk DATLOG parser against the row by row reference reader, with and without pyarrow. Its speed is checked
+by benchmarks/benchmark_frp.py.
+"""
+
+import csv
+import numpy as np
+import pandas as pd
+import pytest
+
+import kremboxer.dualband.dualband_clean as dc
+
+
+def write_datlog(path, n_samples=(50, 0, 120), newline="\n", ragged=False):
+    """
+    Write a raw dualband file with a preamble and one dataset per entry of `n_samples`, the second dataset crossing
+    midnight at the end of February of a leap year. With `ragged`, every 7th sample row has an extra trailing field.
+    """
+    rng = np.random.default_rng(0)
+    lines = ["preamble"]
+    for d, n in enumerate(n_samples):
+        lines.append("DAY,MONTH,YEAR,HOURS(UTC),MINUTES,SECONDS,SAMPLE-RATE(Hz),LATITUDE,LONGITUDE,GPS-TYPE")
+        lines.append(f"{27 + d},2,2024,23,59,55,1,31123456,-81654321,G")
+        lines.append("TH,LW-A,MW-B,")
+        for k, (th, lw, mw) in enumerate(zip(rng.uniform(1000, 2000, n), rng.normal(0, 50, n), rng.normal(0, 5, n))):
+            lines.append(f"{th:.2f},{lw:.3f},{float(mw)!r}," + ("7," if ragged and k % 7 == 3 else ""))
+    with open(path, "w", newline="") as fp:
+        fp.write(newline.join(lines) + newline)
+
+
+def read_reference(path):
+    header_dicts, data_dfs = [], []
+    with open(path, "r") as csvfile:
+        csvreader = csv.reader(csvfile)
+        row = next(csvreader, None)
+        while not row[0] == "DAY":
+            row = next(csvreader, None)
+        while row is not None:
+            row, header_dict, data_df = dc.read_dualband_dataset(path, csvreader, row)
+            header_dicts.append(header_dict)
+            data_dfs.append(data_df)
+    return header_dicts, data_dfs
+
+
+@pytest.mark.parametrize("use_pyarrow", [True, False])
+@pytest.mark.parametrize("newline, ragged", [("\n", False), ("\r\n", False), ("\n", True)])
+def test_bulk_parser_matches_reference(tmp_path, monkeypatch, newline, ragged, use_pyarrow):
+    """
+    Headers and data are identical to the row by row reader, with DATETIME timestamps at the times of its strings
+    """
+    if not use_pyarrow:
+        monkeypatch.setattr(dc, "pa", None)
+    elif dc.pa is None:
+        pytest.skip("pyarrow is not installed")
+    path = tmp_path.joinpath("DATLOG_07.CSV")
+    write_datlog(path, (50, 8, 120), newline, ragged)
+    header_dicts, data_dfs = dc.extract_dualband_datasets_from_raw_file(path)
+    ref_header_dicts, ref_data_dfs = read_reference(path)
+
+    assert len(data_dfs) == len(ref_data_dfs) == 3
+    for header_dict, ref_header_dict in zip(header_dicts, ref_header_dicts):
+        assert header_dict.pop("UNIT") == "7"
+        assert header_dict == ref_header_dict
+    for data_df, ref_data_df in zip(data_dfs, ref_data_dfs):
+        pd.testing.assert_frame_equal(data_df.drop(columns="DATETIME"), ref_data_df.drop(columns="DATETIME"))
+        assert data_df["DATETIME"].dtype == "datetime64[us, UTC]"
+        assert [dt.isoformat() for dt in data_df["DATETIME"]] == list(ref_data_df["DATETIME"])
+    assert data_dfs[1]["DATETIME"].iloc[-1] == pd.Timestamp("2024-02-29T00:00:02+00:00")
+
+
+def test_bulk_parser_epoch_column(tmp_path):
+    """
+    The optional EPOCH column holds int64 seconds matching the DATETIME timestamps
+    """
+    path = tmp_path.joinpath("DATLOG_07.CSV")
+    write_datlog(path)
+    _, data_dfs = dc.extract_dualband_datasets_from_raw_file(path, epoch_column=True)
+    assert [len(df) for df in data_dfs] == [50, 0, 120]
+    for data_df in data_dfs:
+        assert data_df["EPOCH"].dtype == np.int64
+        expected = [int(dt.timestamp()) for dt in data_df["DATETIME"]]
+        assert np.array_equal(data_df["EPOCH"], expected)
+
@@ -0,0 +1,117 @@
+"""
+test_dualband_process - Test suite for kremboxer.dualband.dualband_process
+
+Checks that processing the datasets of an archive with a pool of workers gives the same processed datasets and
+metadata as processing them serially.
+"""
+
+from pathlib import Path
+import geopandas as gpd
+import pandas as pd
+import pytest
+import shapely
+
+import kremboxer.utils.archive_utils as au
+import kremboxer.utils.common_utils as cu
+import kremboxer.utils.dataset_io as dio
+import kremboxer.dualband.dualband_process as dp
+from test_dualband_clean import write_datlog
+from test_utils_archive import write_raw_file
+
+CALIBRATION_FILE = Path(__file__).parents[2].joinpath("calibration_data", "calibration_output", "FortStewart2024",
+                                                      "FortStewart2024_Dualband_2024-05-29T15-14-51.702863.json")
+
+
+@pytest.fixture
+def archive(tmp_path):
+    source_dir = tmp_path.joinpath("source")
+    write_raw_file(source_dir.joinpath("card1", "DATLOG_07.CSV"), write_datlog, (300, 20, 400))
+    write_raw_file(source_dir.joinpath("card2", "DATLOG_08.CSV"), write_datlog, (200, 500))
+    archive_dir = tmp_path.joinpath("archive")
+    archive_dir.mkdir()
+    au.create_dataset_archive({"archive_dir": archive_dir, "data_source_directories": [source_dir]})
+
+    burn_units = gpd.GeoDataFrame({"Id": ["U1"]}, geometry=[shapely.box(-82, 31, -81, 32)], crs="EPSG:4326")
+    burn_units_file = tmp_path.joinpath("burn_units.geojson")
+    burn_units.to_file(burn_units_file, driver="GeoJSON")
+    return archive_dir, burn_units_file
+
+
+def test_parallel_processing_matches_serial(tmp_path, archive):
+    """
+    Processed datasets and summaries are identical with and without workers, in the order of the raw metadata
+    """
+    archive_dir, burn_units_file = archive
+    results = {}
+    for num_workers in [1, 3]:
+        dp.process_dualband_datasets(archive_dir.joinpath("Dualband_raw_metadata.geojson"), {
+            "archive_dir": archive_dir,
+            "burn_units": burn_units_file,
+            "dualband_calibration_file": CALIBRATION_FILE,
+            "burn_dates": ["2024-02-27", "2024-02-28"],
+            "duration_cutoff": 100,
+            "num_workers": num_workers,
+        })
+        processed_dir = archive_dir.joinpath("Processed", "Dualband")
+        results[num_workers] = {
+            "metadata": pd.read_csv(archive_dir.joinpath("Dualband_processed_metadata_raw_location.csv")),
+            "datasets": {file.name: file.read_bytes() for file in sorted(processed_dir.iterdir())},
+        }
+        for file in processed_dir.iterdir():
+            file.unlink()
+
+    pd.testing.assert_frame_equal(results[1]["metadata"], results[3]["metadata"])
+    assert results[1]["datasets"] == results[3]["datasets"]
+
+    metadata = results[1]["metadata"]
+    assert list(metadata["DURATION"]) == [300, 200, 500]
+    assert set(cu.FRP_SUMMARY_COLUMNS) <= set(metadata.columns)
+    assert (metadata["PROCESSING_LEVEL"] == "Processed").all() and (metadata["burn_unit"] == "U1").all()
+    assert len(results[1]["datasets"]) == 3
+
+
+def test_incremental_processing(tmp_path, archive, monkeypatch):
+    """
+    Reruns only process the datasets whose raw data or processed file changed, and everything when the processing
+    parameters change, with the same metadata as a full run
+    """
+    archive_dir, burn_units_file = archive
+    processed = []
+    process_dualband_dataset = dp.process_dualband_dataset
+
+    def counting_process_dualband_dataset(task, calibration):
+        processed.append(task["data_path"].name)
+        return process_dualband_dataset(task, calibration)
+    monkeypatch.setattr(dp, "process_dualband_dataset", counting_process_dualband_dataset)
+
+    params = {
+        "archive_dir": archive_dir,
+        "burn_units": burn_units_file,
+        "dualband_calibration_file": CALIBRATION_FILE,
+        "burn_dates": ["2024-02-27", "2024-02-28"],
+        "duration_cutoff": 100,
+    }
+    metadata_file = archive_dir.joinpath("Dualband_processed_metadata_raw_location.csv")
+
+    def run(**changes):
+        processed.clear()
+        dp.process_dualband_datasets(archive_dir.joinpath("Dualband_raw_metadata.geojson"), dict(params, **changes))
+        return sorted(processed), metadata_file.read_bytes()
+
+    names, full = run()
+    assert len(names) == 3
+    assert run() == ([], full)
+
+    processed_dir = archive_dir.joinpath("Processed", "Dualband")
+    processed_dir.joinpath(names[0]).unlink()
+    raw_file = archive_dir.joinpath("Raw", "Dualband", names[1])
+    raw_file.write_bytes(raw_file.read_bytes())
+    assert run() == ([names[0]], full)
+
+    raw_df = dio.read_dataset(archive_dir.joinpath("Raw", "Dualband", names[2]))
+    raw_df["LW-A"] = raw_df["LW-A"] * 2
+    dio.write_dataset(raw_df, archive_dir.joinpath("Raw", "Dualband", names[2]))
+    assert run()[0] == [names[2]]
+
+    assert run(ratio_table_tolerance=0.02)[0] == names
+    assert run(incremental=False)[0] == names
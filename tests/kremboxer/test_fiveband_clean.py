@@ -0,0 +1,89 @@
+"""
+test_fiveband_clean - Test suite for kremboxer.fiveband.fiveband_clean
+
+Checks the typed block parser of the fiveband logs and the reconstruction of the sample times from the GPS fixes.
+"""
+
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+
+import kremboxer.fiveband.fiveband_clean as fc
+
+FIVEBAND_HEADER = "TIME,STATUS,LAT,N|S,LONG,E|W,SPEED,COURSE,DATE,TH1,3.95,10.95,TH2,MW,LW,WIDE"
+
+
+def write_fiveband_datlog(path, datasets):
+    """
+    Write a raw fiveband file with one dataset per entry of `datasets`, given as a list of the UTC time of each sample,
+    None for samples logged without a GPS fix
+    """
+    rng = np.random.default_rng(0)
+    lines = []
+    for times in datasets:
+        lines.append(FIVEBAND_HEADER)
+        for t in times:
+            values = ",".join(f"{x:.2f}" for x in rng.normal(500, 50, 7))
+            if t is None:
+                lines.append(f",V,,,,,,,,{values}")
+            else:
+                lines.append(f"{t:%H%M%S.%f}"[:-3] + f",A,3112.3456,N,08139.2593,W,0.02,12.5,{t:%d%m%y},{values}")
+    with open(path, "w") as fp:
+        fp.write("\n".join(lines) + "\n")
+
+
+def test_decode_gps_epoch():
+    """
+    Time and date fields with or without leading zeros decode to the same times as `datetime`, rows without a fix
+    or with an invalid date or time, e.g. 31 February or 60 minutes, are flagged
+    """
+    times = [datetime.datetime(2024, 2, 27, 23, 59, 59, 500000), datetime.datetime(2005, 1, 3, 0, 0, 7),
+             datetime.datetime(2031, 12, 31, 9, 5, 0)]
+    time = [float(f"{t:%H%M%S.%f}") for t in times] + [np.nan, 120000., 120000., 120000., 120000., 126000., 120060.]
+    date = [float(f"{t:%d%m%y}") for t in times] + [10124., np.nan, 0., 310224., 300223., 290224., 290224.]
+    epoch, valid = fc.decode_gps_epoch(np.array(time), np.array(date))
+    np.testing.assert_array_equal(valid, [True, True, True, False, False, False, False, False, False, False])
+    expected = [(t - datetime.datetime(1970, 1, 1)) // datetime.timedelta(microseconds=1) for t in times]
+    np.testing.assert_array_equal(epoch[:3], expected)
+
+
+def test_decode_gps_coordinate():
+    degrees = fc.decode_gps_coordinate(np.array([3112.3456, 8139.2593, np.nan]), np.array(["N", "W", None],
+                                                                                          dtype=object), "W")
+    np.testing.assert_allclose(degrees[:2], [31 + 12.3456 / 60, -(81 + 39.2593 / 60)])
+    assert np.isnan(degrees[2])
+
+
+def test_sample_times_follow_gps_fixes(tmp_path):
+    """
+    Samples before the first fix are extrapolated, samples of GPS dropouts interpolated, the date rolls over at
+    midnight, and the sample rate is estimated from the fixes. Datasets without a fix start on 2000-01-01.
+    """
+    start = datetime.datetime(2024, 2, 27, 23, 59, 50)
+    one_hz = [start + datetime.timedelta(seconds=k) for k in range(30)]
+    two_hz = [start + datetime.timedelta(seconds=k / 2) for k in range(12)]
+    datasets = [
+        [None] * 5 + one_hz[5:15] + [None] * 3 + one_hz[18:],
+        two_hz[:8] + [None] * 4,
+        [None] * 4,
+        [],
+    ]
+    path = tmp_path.joinpath("DATALOG_FB3.CSV")
+    write_fiveband_datlog(path, datasets)
+    header_dicts, data_dfs, optical_image_cubes, ir_image_cubes = fc.extract_fiveband_datasets_from_raw_file(path)
+
+    assert len(data_dfs) == 3
+    expected = [pd.DatetimeIndex(times, tz="UTC") for times in [one_hz, two_hz]]
+    for header_dict, data_df, times, rate in zip(header_dicts, data_dfs, expected, [1.0, 2.0]):
+        pd.testing.assert_index_equal(pd.DatetimeIndex(data_df["DATETIME"]), times, check_names=False)
+        assert header_dict["SAMPLE-RATE(Hz)"] == pytest.approx(rate)
+        assert header_dict["DATETIME_START"] == times[0]
+        assert header_dict["UNIT"] == "3"
+        assert header_dict["LATITUDE"] == pytest.approx(31 + 12.3456 / 60)
+        assert header_dict["LONGITUDE"] == pytest.approx(-(81 + 39.2593 / 60))
+
+    assert data_dfs[2]["DATETIME"].iloc[0] == pd.Timestamp("2000-01-01", tz="UTC")
+    assert (data_dfs[2]["DATETIME"].diff().iloc[1:] == pd.Timedelta(seconds=1)).all()
+    assert data_dfs[0]["MW"].dtype == np.float64 and data_dfs[0]["LAT"].isna().sum() == 8
+    assert optical_image_cubes == [] and ir_image_cubes == []
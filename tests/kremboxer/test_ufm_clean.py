@@ -0,0 +1,92 @@
+"""
+test_ufm_clean - Test suite for kremboxer.ufm.ufm_clean
+
+Checks the block parser of the UFM IR frames against the row by row reference reader.
+"""
+
+import csv
+import numpy as np
+import pandas as pd
+import pytest
+
+import kremboxer.ufm.ufm_clean as uc
+
+
+def write_ufm_datlog(path, n_frames=(30, 0, 45), rate=10, newline="\n", final_blank=True):
+    """
+    Write a raw UFM file with a preamble and one dataset per entry of `n_frames`, each sample being a 24x32 IR image
+    followed by the radiometer / flow row and a blank line
+    """
+    rng = np.random.default_rng(0)
+    lines = ["preamble"]
+    for d, n in enumerate(n_frames):
+        lines.append("UNIT,DAY,MONTH,YEAR,HOURS(UTC),MINUTES,SECONDS,SAMPLE-RATE(Hz),LATITUDE,LONGITUDE,GPS-TYPE")
+        lines.append(f"05,{27 + d},2,2024,23,59,58,{rate},31123456,-81654321,G")
+        lines.append("SensTH,LW,MW,WIDE,Flow,AirT,")
+        for k in range(n):
+            lines += [",".join(map(str, row)) + "," for row in rng.integers(0, 65535, (24, 32))]
+            lines.append(",".join(f"{x:.3f}" for x in rng.normal(100, 30, 6)) + ",")
+            if k < n - 1 or final_blank or d < len(n_frames) - 1:
+                lines.append("")
+    with open(path, "w", newline="") as fp:
+        fp.write(newline.join(lines) + newline)
+
+
+def read_reference(path):
+    header_dicts, data_dfs, ir_image_cubes = [], [], []
+    with open(path, "r") as csvfile:
+        csvreader = csv.reader(csvfile)
+        row = next(csvreader)
+        while not row[0] == "UNIT":
+            row = next(csvreader)
+        while row is not None:
+            row, header_dict, data_df, ir_image_cube = uc.read_ufm_dataset(path, csvreader, row)
+            if ir_image_cube is not None:
+                header_dicts.append(header_dict)
+                data_dfs.append(data_df)
+                ir_image_cubes.append(ir_image_cube)
+    return header_dicts, data_dfs, ir_image_cubes
+
+
+@pytest.mark.parametrize("rate, newline, final_blank", [(10, "\n", True), (3, "\r\n", False)])
+def test_block_parser_matches_reference(tmp_path, rate, newline, final_blank):
+    """
+    Headers, data and image cubes are identical to the row by row reader, with DATETIME timestamps at the times of its
+    strings, and datasets without samples are skipped
+    """
+    path = tmp_path.joinpath("DATLOG6.CSV")
+    write_ufm_datlog(path, rate=rate, newline=newline, final_blank=final_blank)
+    header_dicts, data_dfs, ir_image_cubes = uc.extract_ufm_datasets_from_raw_file(path)
+    ref_header_dicts, ref_data_dfs, ref_ir_image_cubes = read_reference(path)
+
+    assert len(data_dfs) == len(ref_data_dfs) == 2
+    assert header_dicts == ref_header_dicts
+    for data_df, ref_data_df in zip(data_dfs, ref_data_dfs):
+        pd.testing.assert_frame_equal(data_df.drop(columns="DATETIME"), ref_data_df.drop(columns="DATETIME"))
+        assert data_df["DATETIME"].dtype == "datetime64[us, UTC]"
+        assert [dt.isoformat() for dt in data_df["DATETIME"]] == list(ref_data_df["DATETIME"])
+        assert data_df.attrs == ref_data_df.attrs
+    for ir_image_cube, ref_ir_image_cube in zip(ir_image_cubes, ref_ir_image_cubes):
+        assert ir_image_cube.dtype == np.uint16
+        assert np.array_equal(ir_image_cube, ref_ir_image_cube)
+
+
+def test_block_parser_memory_mapped_cubes(tmp_path):
+    """
+    Cubes parsed into a directory are memory mapped .npy files with the same contents as in memory cubes, and
+    truncated samples are rejected
+    """
+    path = tmp_path.joinpath("DATLOG6.CSV")
+    write_ufm_datlog(path, n_frames=(7,))
+    _, data_dfs, ir_image_cubes = uc.extract_ufm_datasets_from_raw_file(path, cube_dir=tmp_path, epoch_column=True)
+    _, _, ref_ir_image_cubes = uc.extract_ufm_datasets_from_raw_file(path)
+
+    assert isinstance(ir_image_cubes[0], np.memmap)
+    cube_file = tmp_path.joinpath("UFM_05_2024-02-27T23-59-58+00-00_ir_images.npy")
+    assert np.array_equal(np.load(cube_file), ref_ir_image_cubes[0])
+    assert np.array_equal(np.diff(data_dfs[0]["EPOCH"]), np.full(6, 100000))
+
+    with open(path, "rb") as fp:
+        data = fp.read()
+    with pytest.raises(ValueError):
+        uc.parse_ufm_block(data[data.find(b"UNIT"):-200])
@@ -0,0 +1,108 @@
+"""
+test_utils_archive - Test suite for kremboxer.utils.archive_utils
+
+Checks that parallel and incremental archive creation write the same archive as a serial build from scratch.
+"""
+
+import shutil
+import scipy
+from pathlib import Path
+
+import kremboxer.utils.archive_utils as au
+from test_dualband_clean import write_datlog
+from test_ufm_clean import write_ufm_datlog
+
+
+def write_raw_file(path, writer, *args):
+    """
+    Write a raw file starting at its first header row, like the files on the SD cards
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer(path, *args)
+    with open(path) as fp:
+        lines = fp.readlines()
+    with open(path, "w") as fp:
+        fp.writelines(lines[1:])
+
+
+def read_archive(archive_dir: Path):
+    contents = {}
+    for file in sorted(archive_dir.rglob("*")):
+        if file.suffix == ".mat":
+            # MAT files record their creation time
+            contents[file.relative_to(archive_dir)] = scipy.io.loadmat(file)["ir_images"].tobytes()
+        elif file.is_file():
+            contents[file.relative_to(archive_dir)] = file.read_bytes()
+    return contents
+
+
+def test_parallel_archive_matches_serial(tmp_path):
+    """
+    The same datasets, metadata and file contents are written with and without workers, including for a dataset found
+    on two cards, whose last copy wins in both cases
+    """
+    source_dir = tmp_path.joinpath("source")
+    write_raw_file(source_dir.joinpath("card1", "DATLOG_07.CSV"), write_datlog, (30, 40))
+    write_raw_file(source_dir.joinpath("card2", "DATLOG_07.CSV"), write_datlog, (50,))
+    write_raw_file(source_dir.joinpath("card2", "DATLOG_08.CSV"), write_datlog, (60, 0, 20))
+    write_raw_file(source_dir.joinpath("card3", "DATLOG6.CSV"), write_ufm_datlog, (5, 7))
+
+    archives = {}
+    for num_workers in [1, 3]:
+        archive_dir = tmp_path.joinpath(f"archive_{num_workers}")
+        archive_dir.mkdir()
+        au.create_dataset_archive({
+            "archive_dir": archive_dir,
+            "data_source_directories": [source_dir],
+            "num_workers": num_workers,
+            "index_dir": tmp_path.joinpath(f"index_{num_workers}"),
+        })
+        archives[num_workers] = read_archive(archive_dir)
+
+    assert archives[1].keys() == archives[3].keys()
+    for name, contents in archives[1].items():
+        assert archives[3][name] == contents, name
+
+    # The dataset on both cards has the 50 samples of the second card and the metadata of the first
+    assert archives[1][Path("Raw", "Dualband", "Dualband_7_2024-02-27T23-59-55+00-00.csv")].count(b"\n") == 51
+    assert len([name for name in archives[1] if name.suffix == ".npy"]) == 2
+
+
+def test_incremental_archive_matches_full_rebuild(tmp_path):
+    """
+    Reruns only archive new and changed files, remove the datasets of removed files, and end with the same archive
+    as a build from scratch
+    """
+    source_dir = tmp_path.joinpath("source")
+    write_raw_file(source_dir.joinpath("card1", "DATLOG_07.CSV"), write_datlog, (30, 40))
+    write_raw_file(source_dir.joinpath("card2", "DATLOG_07.CSV"), write_datlog, (50,))
+    write_raw_file(source_dir.joinpath("card2", "DATLOG_08.CSV"), write_datlog, (60, 0, 20))
+
+    def build(archive_dir):
+        archive_dir.mkdir(exist_ok=True)
+        au.create_dataset_archive({"archive_dir": archive_dir, "data_source_directories": [source_dir],
+                                   "index_dir": tmp_path.joinpath("index")})
+        return read_archive(archive_dir)
+
+    def full_build():
+        full_dir = tmp_path.joinpath("full")
+        if full_dir.exists():
+            shutil.rmtree(full_dir)
+        return build(full_dir)
+
+    archive_dir = tmp_path.joinpath("archive")
+    build(archive_dir)
+    unchanged = archive_dir.joinpath("Raw", "Dualband", "Dualband_8_2024-02-27T23-59-55+00-00.csv")
+    mtime_ns = unchanged.stat().st_mtime_ns
+
+    # A new card is archived without touching the datasets of the others
+    write_raw_file(source_dir.joinpath("card3", "DATLOG6.CSV"), write_ufm_datlog, (5, 7))
+    assert build(archive_dir) == full_build()
+    assert unchanged.stat().st_mtime_ns == mtime_ns
+
+    # Removing the last copy of a shared dataset restores the first copy, removing a file removes its datasets
+    shutil.rmtree(source_dir.joinpath("card2"))
+    incremental = build(archive_dir)
+    assert incremental == full_build()
+    assert not unchanged.exists()
+    assert incremental[Path("Raw", "Dualband", "Dualband_7_2024-02-27T23-59-55+00-00.csv")].count(b"\n") == 31
@@ -0,0 +1,131 @@
+"""
+test_utils_cache - Test suite for kremboxer.utils.cache_utils
+
+Checks that calibration artifacts are reused while the calibration files are unchanged, rebuilt when they change,
+and evicted by size and age, along with the temporary directories of interrupted saves.
+"""
+
+import os
+import time
+import shutil
+from pathlib import Path
+import numpy as np
+
+import kremboxer.utils.cache_utils as cache_utils
+import kremboxer.dualband.dualband_process as dp
+
+cal_dir = Path(__file__).parents[2].joinpath("calibration_data", "calibration_output", "FortStewart2024")
+cal_file = cal_dir.joinpath("FortStewart2024_Dualband_2024-09-18T15-52-17.839307.json")
+
+
+def test_calibration_cache_roundtrip(tmp_path):
+    """
+    Cached calibration data is memory mapped and identical to the data read from the csv files
+    """
+    reference = dp.load_dualband_calibration_data(cal_file)
+    first = dp.load_dualband_calibration_data(cal_file, tmp_path)
+    cached = dp.load_dualband_calibration_data(cal_file, tmp_path)
+
+    assert len(list(tmp_path.iterdir())) == 1
+    assert isinstance(cached[2], np.memmap)
+    assert cached[0] == reference[0]
+    for a, b, c in zip(reference[2:], first[2:], cached[2:]):
+        assert np.array_equal(a, b) and np.array_equal(a, c)
+    assert np.array_equal(reference[1]['lookup'], cached[1]['lookup'])
+
+
+def test_calibration_cache_key_follows_file_contents(tmp_path):
+    """
+    Changing any referenced file changes the cache key
+    """
+    files = [tmp_path.joinpath(name) for name in ["cal.json", "bandpass.csv"]]
+    files[0].write_text('{"LW_bandpass": "bandpass.csv"}')
+    files[1].write_text("wavelength,transmission\n1,0.5\n")
+    key = cache_utils.hash_files(files)
+    assert cache_utils.hash_files(files) == key
+
+    files[1].write_text("wavelength,transmission\n1,0.6\n")
+    assert cache_utils.hash_files(files) != key
+
+
+def test_cached_ratio_table(tmp_path):
+    """
+    Ratio tables are stored once per bandpass pair and tolerance
+    """
+    F1 = np.loadtxt(cal_dir.joinpath("DC-6216_u1_Saph_longwave.csv"), delimiter=',', skiprows=1, usecols=[0, 1])
+    F2 = np.loadtxt(cal_dir.joinpath("DC-6073_W1_8-14Si.csv"), delimiter=',', skiprows=1, usecols=[0, 1])
+    table = cache_utils.cached_ratio_table(F1, F2, tmp_path, tolerance=0.01)
+    cached = cache_utils.cached_ratio_table(F1, F2, tmp_path, tolerance=0.01)
+    assert np.array_equal(table['log_ratio'], cached['log_ratio'])
+    assert table['max_error'] == cached['max_error']
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_unreadable_cache_entry_is_replaced(tmp_path):
+    """
+    Entries with a corrupt meta.json or a missing array are removed on load and rewritten by the next save
+    """
+    for broken in ["meta.json", "a.npy"]:
+        entry = cache_utils.save_cache_entry(tmp_path, "entry", {"a": np.arange(4.)})
+        if broken == "meta.json":
+            entry.joinpath(broken).write_text("{")
+        else:
+            entry.joinpath(broken).unlink()
+        assert cache_utils.load_cache_entry(tmp_path, "entry") is None
+        assert not entry.exists()
+
+        entry.mkdir()
+        cache_utils.save_cache_entry(tmp_path, "entry", {"a": np.arange(3.)})
+        arrays, _ = cache_utils.load_cache_entry(tmp_path, "entry")
+        np.testing.assert_array_equal(arrays["a"], np.arange(3.))
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["entry"]
+        shutil.rmtree(entry)
+
+
+def test_read_only_cache_entry_loads(tmp_path, monkeypatch):
+    """
+    Entries of a cache without write access load even though their access time cannot be recorded
+    """
+    cache_utils.save_cache_entry(tmp_path, "entry", {"a": np.arange(4.)})
+
+    def utime(*args, **kwargs):
+        raise PermissionError("read only file system")
+    monkeypatch.setattr(os, "utime", utime)
+    arrays, _ = cache_utils.load_cache_entry(tmp_path, "entry")
+    np.testing.assert_array_equal(arrays["a"], np.arange(4.))
+
+
+def test_evict_cache(tmp_path):
+    """
+    Entries unused for longer than the age limit are removed first, then the least recently used until under the size
+    """
+    now = time.time()
+    for i, age_days in enumerate([10, 3, 2, 0]):
+        entry = cache_utils.save_cache_entry(tmp_path, f"entry{i}", {"a": np.zeros(2**17)})
+        os.utime(entry.joinpath("meta.json"), (now - age_days * 86400, now - age_days * 86400))
+
+    removed = cache_utils.evict_cache(tmp_path, max_age_days=5)
+    assert [p.name for p in removed] == ["entry0"]
+
+    removed = cache_utils.evict_cache(tmp_path, max_mb=2.5)
+    assert [p.name for p in removed] == ["entry1"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["entry2", "entry3"]
+
+
+def test_evict_stale_tmp_dirs(tmp_path):
+    """
+    Temporary directories left by interrupted saves are removed once stale, ones still being written are kept
+    """
+    cache_utils.save_cache_entry(tmp_path, "entry0", {"a": np.zeros(8)})
+    now = time.time()
+    for name, age_hours in [(".stale.123.tmp", 3), (".active.456.tmp", 0)]:
+        tmp_dir = tmp_path.joinpath(name)
+        tmp_dir.mkdir()
+        np.save(tmp_dir.joinpath("a.npy"), np.zeros(8))
+        for path in [tmp_dir.joinpath("a.npy"), tmp_dir]:
+            os.utime(path, (now - age_hours * 3600, now - age_hours * 3600))
+
+    removed = cache_utils.evict_cache(tmp_path)
+    assert [p.name for p in removed] == [".stale.123.tmp"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == [".active.456.tmp", "entry0"]
+    assert cache_utils.evict_cache(tmp_path, stale_tmp_hours=0)[0].name == ".active.456.tmp"
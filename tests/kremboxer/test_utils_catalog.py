@@ -0,0 +1,139 @@
+"""
+test_utils_catalog - Test suite for kremboxer.utils.catalog_utils
+
+Checks that catalog traces match the archived datasets, and that the trace cache shares the columns it has read and
+keeps within its byte budget, and that metadata queries select the datasets the row by row filters did.
+"""
+
+import datetime
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import kremboxer.dualband.dualband_clean as dc
+import kremboxer.utils.catalog_utils as catalog_utils
+import kremboxer.utils.dataset_io as dio
+from test_dualband_clean import write_datlog
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """
+    Archive of two dualband datasets with their metadata table
+    """
+    path = tmp_path.joinpath("DATLOG_07.CSV")
+    write_datlog(path, (1000, 600))
+    header_dicts, data_dfs = dc.extract_dualband_datasets_from_raw_file(path)
+    data_dir = tmp_path.joinpath("Raw", "Dualband")
+    data_dir.mkdir(parents=True)
+    records = []
+    for k, data_df in enumerate(data_dfs):
+        dio.write_dataset(data_df, data_dir.joinpath(f"Dualband_{k}.csv"))
+        records.append({"PROCESSING_LEVEL": "Raw", "SENSOR": "Dualband", "DATAFILE": f"Dualband_{k}.csv",
+                        "UNIT": str(k)})
+    gdf = gpd.GeoDataFrame(records, geometry=[shapely.Point(-81.6, 31.9)] * len(records), crs="EPSG:4326")
+    gdf.to_file(tmp_path.joinpath("Dualband_raw_metadata.geojson"), driver="GeoJSON")
+    return tmp_path, data_dfs
+
+
+def test_trace_projection(archive, monkeypatch):
+    """
+    Traces are projected to columns and time windows, and the columns read once are shared by later reads
+    """
+    archive_dir, data_dfs = archive
+    cache = catalog_utils.TraceCache()
+    catalog = catalog_utils.DatasetCatalog(archive_dir, cache=cache)
+    assert catalog.metadata_path().name == "Dualband_raw_metadata.geojson"
+    assert len(catalog) == 2 and list(catalog.records["UNIT"]) == ["0", "1"]
+
+    pd.testing.assert_frame_equal(catalog.trace(0), data_dfs[0])
+    reads = []
+    read_dataset = dio.read_dataset
+    monkeypatch.setattr(dio, "read_dataset",
+                        lambda *args, **kwargs: reads.append(kwargs) or read_dataset(*args, **kwargs))
+
+    start = data_dfs[0]["DATETIME"].iloc[100]
+    end = start + datetime.timedelta(seconds=50)
+    trace_df = catalog.trace(0, ["LW-A", "MW-B"], start, end)
+    expected = data_dfs[0][(data_dfs[0]["DATETIME"] >= start) & (data_dfs[0]["DATETIME"] <= end)][["LW-A", "MW-B"]]
+    pd.testing.assert_frame_equal(trace_df, expected)
+    assert len(trace_df) > 0 and reads == []
+    naive_df = catalog.trace(0, ["LW-A", "MW-B"], start.tz_localize(None).to_pydatetime(), str(end.tz_localize(None)))
+    pd.testing.assert_frame_equal(naive_df, expected)
+
+    other = catalog_utils.DatasetCatalog(archive_dir, catalog.records.iloc[1:], cache=cache)
+    for i, row, trace_df in other.traces(columns=["DATETIME", "LW-A"]):
+        pd.testing.assert_frame_equal(trace_df, data_dfs[1][["DATETIME", "LW-A"]])
+    assert reads == [{"columns": ["DATETIME", "LW-A"]}]
+
+
+def test_cache_budget(archive):
+    """
+    The least recently used columns are evicted to keep within the budget, and rewritten datasets are read again
+    """
+    archive_dir, data_dfs = archive
+    column_bytes = int(data_dfs[0]["LW-A"].memory_usage(index=False))
+    cache = catalog_utils.TraceCache(max_bytes=5 * column_bytes // 2)
+    catalog = catalog_utils.DatasetCatalog(archive_dir, cache=cache)
+
+    catalog.trace(0, ["LW-A", "MW-B"])
+    catalog.trace(0, ["LW-A"])
+    catalog.trace(1, ["TH"])
+    assert cache.nbytes <= cache.max_bytes and len(cache) == 2
+    hits, misses = cache.hits, cache.misses
+    catalog.trace(0, ["LW-A"])
+    catalog.trace(0, ["MW-B"])
+    assert (cache.hits, cache.misses) == (hits + 1, misses + 1)
+
+    cache.resize(0)
+    assert len(cache) == 0 and cache.nbytes == 0
+
+    cache.resize(catalog_utils.TRACE_CACHE_BYTES)
+    catalog.trace(0, ["LW-A"])
+    changed_df = data_dfs[0].copy()
+    changed_df["LW-A"] = changed_df["LW-A"] + 1
+    dio.write_dataset(changed_df, catalog.path(0))
+    pd.testing.assert_series_equal(catalog.trace(0, ["LW-A"])["LW-A"], changed_df["LW-A"])
+
+
+def test_select_datasets():
+    """
+    Date and duration selections match the row by row filter of the processing pipelines, and each criterion is
+    reported separately
+    """
+    rng = np.random.default_rng(0)
+    n = 2000
+    starts = pd.Timestamp("2024-02-26T12:00:00+00:00") + pd.to_timedelta(rng.uniform(0, 4 * 86400, n), unit="s")
+    records = gpd.GeoDataFrame({
+        "DATETIME_START": [start.isoformat() for start in starts],
+        "DURATION": rng.integers(0, 2000, n),
+        "UNIT": rng.choice(["D01", "D02", "D03"], n),
+        "burn_unit": rng.choice(["U1", "U2", "unknown"], n),
+    }, geometry=gpd.points_from_xy(rng.uniform(-82, -81, n), rng.uniform(31, 32, n)), crs="EPSG:4326")
+
+    burn_dates = ["2024-02-27", "2024-02-28"]
+    target_dates = [datetime.datetime.fromisoformat(x).date() for x in burn_dates]
+    mask = [datetime.datetime.fromisoformat(str(row["DATETIME_START"])).date() in target_dates and row["DURATION"] > 100
+            for i, row in records.iterrows()]
+    selected, report = catalog_utils.select_datasets(records, dates=burn_dates, min_duration=100)
+    pd.testing.assert_frame_equal(selected, records[mask])
+    assert list(report.columns) == ["date", "duration", "selected"] and report.index.equals(records.index)
+    assert catalog_utils.selection_summary(report, "UFM") == (
+        f"Removed {n - sum(mask)} out of {n} UFM datasets, rejected by date: {(~report['date']).sum()}, "
+        f"duration: {(~report['duration']).sum()}")
+
+    # Datasets overlapping a time window, from given units, inside a polygon, parsed once by a catalog
+    start, end = datetime.datetime(2024, 2, 27, 12), datetime.datetime(2024, 2, 27, 18)
+    polygon = gpd.GeoSeries([shapely.box(-81.5, 31, -81, 32)], crs="EPSG:4326").to_crs("EPSG:3857")
+    catalog = catalog_utils.DatasetCatalog(".", records)
+    selected_catalog, report = catalog.select(start=start, end=end, units=["D01", "D02"], burn_units=["U1"],
+                                              polygon=polygon)
+    ends = starts + pd.to_timedelta(records["DURATION"], unit="s")
+    expected = ((ends >= pd.Timestamp(start, tz="UTC")) & (starts <= pd.Timestamp(end, tz="UTC"))
+                & records["UNIT"].isin(["D01", "D02"]) & (records["burn_unit"] == "U1")
+                & (records.geometry.x > -81.5))
+    pd.testing.assert_frame_equal(selected_catalog.records, records[expected.to_numpy()])
+    assert list(report.columns) == ["window", "unit", "burn_unit", "polygon", "selected"]
+    assert 0 < len(selected_catalog) < report["window"].sum()
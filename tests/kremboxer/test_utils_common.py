@@ -0,0 +1,135 @@
+"""
+test_utils_common - Test suite for kremboxer.utils.common_utils
+
+Checks the closed form detector model fits against scipy's iterative least squares, and the vectorized FRP trace
+summaries against sample by sample accumulation, and the burn unit matches of overlapping and nearby units.
+"""
+
+import pytest
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import scipy.optimize as so
+
+import kremboxer.utils.greybody_utils as gbu
+import kremboxer.utils.common_utils as cu
+
+
+def test_detector_model_fits_match_curve_fit():
+    """
+    Single and batched closed form fits agree with curve_fit, including the parameter covariance
+    """
+    rng = np.random.default_rng(0)
+    T = np.linspace(373., 1173., 9)
+    TD = 300 + rng.normal(0, 1, 9)
+    A, N = 6.2e-5, 2.66
+    v = gbu.detector_model(T, 0.33, 4.9e-5, TD, A, N) + rng.normal(0, 0.05, 9)
+
+    (G_ref, AL_ref), pcov_ref = so.curve_fit(lambda X, G, AL: gbu.detector_model(X[0], G, AL, X[1], A, N),
+                                             np.stack([T, TD]), v, p0=[0.3, 5e-5])
+    G, AL, pcov = cu.fit_detector_model(T, TD, v, A, N)
+    assert G == pytest.approx(G_ref, rel=1e-8) and AL == pytest.approx(AL_ref, rel=1e-8)
+    assert cu.fit_detector_model(T, TD, v, A, N, [0.3, 5e-5])[:2] == (G, AL)
+    assert np.allclose(pcov, pcov_ref, rtol=1e-5)
+
+    G_kremens, pcov_kremens = cu.fit_kremens_detector_model(T, TD, v, A, N)
+    G_ref, _ = so.curve_fit(lambda X, G: G * A * (X[0]**N - X[1]**N), np.stack([T, TD]), v, p0=[0.3])
+    assert G_kremens == pytest.approx(G_ref[0], rel=1e-8)
+    assert pcov_kremens.shape == (1, 1)
+
+    # Three units of the same band fit in one call
+    scale = np.array([1.0, 0.5, 2.0])
+    Gs, ALs, pcovs = cu.fit_detector_model(T, TD, scale[:, None] * v, [A] * 3, [N] * 3)
+    assert np.allclose(Gs, scale * G) and np.allclose(ALs, AL)
+    assert pcovs.shape == (3, 2, 2)
+
+
+def frp_trace(rng, n_samples, peak):
+    """
+    Processed dataset sampled at 10 Hz with a noisy FRP peak in the middle
+    """
+    datetimes = pd.Series(pd.date_range("2024-02-27 15:00", periods=n_samples, freq="100ms", tz="UTC", unit="us"))
+    frp = peak * np.exp(-((np.arange(n_samples) - n_samples / 2) / (n_samples / 8))**2)
+    return pd.DataFrame({"DATETIME": datetimes, "MW_FRP": 0.8 * frp + rng.normal(0, 20, n_samples),
+                         "LW_FRP": frp + rng.normal(0, 20, n_samples)})
+
+
+def accumulated_signal_bounds(data, p_start, p_end):
+    """
+    Signal bounds found by accumulating the signal one sample at a time
+    """
+    w, i = 0, 0
+    while w < np.sum(data) * p_start and i < len(data):
+        w, i = w + data[i], i + 1
+    ind_start = i
+    while w < np.sum(data) * p_end and i < len(data):
+        w, i = w + data[i], i + 1
+    return ind_start, i - 1
+
+
+def test_frp_trace_summaries():
+    """
+    Signal bounds match accumulating the signal one sample at a time, batched summaries match the summaries of each
+    trace, and gaps only add FRE when they are filled in
+    """
+    rng = np.random.default_rng(0)
+    data = rng.normal(1, 2, 500)
+    for p_start, p_end in [(0.05, 0.95), (0., 1.), (0.5, 0.5)]:
+        assert cu.get_signal_bounds(data, p_start, p_end) == accumulated_signal_bounds(data, p_start, p_end)
+    assert cu.get_signal_bounds(-np.abs(data), 0.05, 0.95) == (0, 0)
+
+    data_proc_dfs = [frp_trace(rng, n_samples, peak) for n_samples, peak in [(3000, 4000), (800, 600), (1, 0)]]
+    data_proc_dfs[0]["WIDE_FRP"] = 2 * data_proc_dfs[0]["LW_FRP"]
+    summary_df = cu.summarize_frp_traces(data_proc_dfs, 10.)
+    assert list(summary_df.columns) == cu.FRP_SUMMARY_COLUMNS + ["WIDE_FRE"]
+    for k, data_proc_df in enumerate(data_proc_dfs):
+        summary = cu.summarize_frp_trace(data_proc_df, 10.)
+        for column, value in summary.items():
+            if isinstance(value, pd.Timestamp):
+                assert summary_df[column].iloc[k] == value
+            else:
+                assert summary_df[column].iloc[k] == pytest.approx(value, rel=1e-9, nan_ok=True)
+    assert summary_df["LW_FRE"].iloc[0] == pytest.approx(data_proc_dfs[0]["LW_FRP"].sum() / 10.)
+    assert summary_df["WIDE_FRE"].iloc[0] == pytest.approx(2 * summary_df["LW_FRE"].iloc[0])
+    assert np.isnan(summary_df["WIDE_FRE"].iloc[1])
+    over_1000 = data_proc_dfs[0][data_proc_dfs[0]["LW_FRP"] > 1000]
+    assert summary_df["mean_FRP"].iloc[0] == pytest.approx(over_1000["LW_FRP"].mean())
+    assert summary_df["var_FRP"].iloc[0] == pytest.approx(over_1000["LW_FRP"].var())
+    assert summary_df["mean_FRP"].iloc[1] == 0 and summary_df["over_1000FRP_duration"].iloc[1] == 0
+
+    # Drop 2 seconds of samples, then 60 seconds, and hold the sample before each gap for up to 5 seconds
+    gap_df = data_proc_dfs[0].drop(index=list(range(1000, 1020)) + list(range(2000, 2600)))
+    summary = cu.summarize_frp_trace(gap_df, 10.)
+    assert summary["LW_FRE"] == pytest.approx(gap_df["LW_FRP"].sum() / 10.)
+    filled = cu.summarize_frp_trace(gap_df, 10., max_gap=5.)
+    assert filled["LW_FRE"] == pytest.approx(summary["LW_FRE"] + 20 * gap_df["LW_FRP"].loc[999] / 10.)
+    assert filled["pend_ind"] == summary["pend_ind"]
+
+
+def test_match_burn_units():
+    """
+    Points inside overlapping units get the first or the smallest of them, points near a unit get it within the
+    tolerance, and burn units in another CRS are reprojected
+    """
+    burn_plot_gdf = gpd.GeoDataFrame({"Id": ["A", "B", "C"]}, geometry=[
+        shapely.box(-81.70, 31.90, -81.60, 32.00), shapely.box(-81.65, 31.95, -81.64, 31.96),
+        shapely.box(-81.50, 31.90, -81.45, 31.95)], crs="EPSG:4326").to_crs("EPSG:3857")
+    points = gpd.GeoSeries.from_xy([-81.68, -81.645, -81.449, -81.30], [31.92, 31.955, 31.92, 31.92], crs="EPSG:4326",
+                                   index=[10, 11, 12, 13])
+
+    matches = cu.match_burn_units(points, burn_plot_gdf)
+    assert list(matches["burn_unit"]) == ["A", "A", "unknown", "unknown"]
+    assert list(matches["burn_unit_match"]) == ["contained", "overlap", "unknown", "unknown"]
+    assert list(matches["burn_unit_count"]) == [1, 2, 0, 0] and list(matches.index) == [10, 11, 12, 13]
+
+    matches = cu.match_burn_units(points, burn_plot_gdf, max_distance=500., overlap="smallest")
+    assert list(matches["burn_unit"]) == ["A", "B", "C", "unknown"]
+    assert list(matches["burn_unit_match"]) == ["contained", "overlap", "nearest", "unknown"]
+    assert 50 < matches["burn_unit_distance"].loc[12] < 150
+
+    report = cu.burn_unit_report(matches, pd.Series(["a.csv", "b.csv", "c.csv", "d.csv"], index=points.index))
+    assert report.splitlines()[0] == "Burn units of 4 datasets: 1 contained, 1 overlap, 1 nearest, 1 unknown"
+    assert len(report.splitlines()) == 4
+    with pytest.raises(ValueError):
+        cu.match_burn_units(points, burn_plot_gdf, overlap="largest")
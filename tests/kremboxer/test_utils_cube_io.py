@@ -0,0 +1,55 @@
+"""
+test_utils_cube_io - Test suite for kremboxer.utils.cube_io
+
+Checks that UFM IR image cubes written in each format read back the same frames and frame times, and that the
+exports match the stored cube.
+"""
+
+import numpy as np
+import pandas as pd
+import scipy
+import pytest
+
+import kremboxer.ufm.ufm_clean as uc
+import kremboxer.utils.cube_io as cube_io
+from test_ufm_clean import write_ufm_datlog
+
+
+@pytest.mark.parametrize("fmt", ["npy", "hdf5"])
+def test_cube_round_trip(tmp_path, fmt):
+    """
+    Cubes parsed into a file read back whole or a range of frames at a time, HDF5 cubes with the frame times of their
+    dataset, and export to .mat and .npy unchanged
+    """
+    if fmt == "hdf5":
+        pytest.importorskip("h5py")
+    path = tmp_path.joinpath("DATLOG6.CSV")
+    write_ufm_datlog(path, n_frames=(150,))
+    ref_header_dicts, ref_data_dfs, ref_cubes = uc.extract_ufm_datasets_from_raw_file(path)
+    header_dicts, data_dfs, ir_image_cubes = uc.extract_ufm_datasets_from_raw_file(path, tmp_path, epoch_column=True,
+                                                                                     cube_format=fmt)
+
+    cube_path = tmp_path.joinpath(uc.cube_file_name(header_dicts[0], fmt))
+    assert cube_io.cube_format(cube_path) == fmt
+    np.testing.assert_array_equal(ir_image_cubes[0][:], ref_cubes[0])
+    np.testing.assert_array_equal(cube_io.read_frames(cube_path, 70, 140), ref_cubes[0][70:140])
+    np.testing.assert_array_equal(cube_io.read_frames(cube_path, 140), ref_cubes[0][140:])
+
+    timestamps = cube_io.read_timestamps(cube_path)
+    if fmt == "hdf5":
+        np.testing.assert_array_equal(timestamps, data_dfs[0]["EPOCH"])
+        assert pd.Timestamp(timestamps[0], unit="us", tz="UTC") == header_dicts[0]["DATETIME_START"]
+    else:
+        assert timestamps is None
+
+    mat_path = cube_io.export_cube(cube_path, "mat")
+    np.testing.assert_array_equal(scipy.io.loadmat(mat_path)["ir_images"], ref_cubes[0])
+    npy_path = cube_io.export_cube(cube_path, "npy", tmp_path.joinpath("export.npy"))
+    np.testing.assert_array_equal(np.load(npy_path), ref_cubes[0])
+
+
+def test_unknown_cube_format(tmp_path):
+    with pytest.raises(ValueError):
+        cube_io.cube_format(tmp_path.joinpath("cube.mat"))
+    with pytest.raises(ValueError):
+        cube_io.cube_path(tmp_path.joinpath("cube"), "mat")
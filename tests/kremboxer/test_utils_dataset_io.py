@@ -0,0 +1,67 @@
+"""
+test_utils_dataset_io - Test suite for kremboxer.utils.dataset_io
+
+Checks that datasets read back the same from every storage format, in full or in part.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import kremboxer.dualband.dualband_clean as dc
+import kremboxer.utils.dataset_io as dio
+from test_dualband_clean import write_datlog
+
+
+@pytest.fixture
+def dualband_df(tmp_path):
+    path = tmp_path.joinpath("DATLOG_07.CSV")
+    write_datlog(path, (1000,))
+    _, data_dfs = dc.extract_dualband_datasets_from_raw_file(path)
+    return data_dfs[0]
+
+
+def test_csv_projection_and_row_ranges(tmp_path, dualband_df):
+    """
+    Column and row subsets of CSV datasets match the subsets of the full dataset, DATETIME is stored as ISO 8601
+    strings and read back as timestamps
+    """
+    path = dio.dataset_path(tmp_path.joinpath("Dualband_7"), "csv")
+    assert path.name == "Dualband_7.csv" and dio.dataset_format(path) == "csv"
+    dio.write_dataset(dualband_df, path)
+    pd.testing.assert_frame_equal(dio.read_dataset(path), dualband_df)
+    assert pd.read_csv(path)["DATETIME"].iloc[0] == "2024-02-27T23:59:55+00:00"
+
+    subset = dio.read_dataset(path, columns=["LW-A", "DATETIME"], rows=(10, 25))
+    expected = dualband_df[["LW-A", "DATETIME"]].iloc[10:25].reset_index(drop=True)
+    pd.testing.assert_frame_equal(subset, expected)
+    assert len(dio.read_dataset(path, rows=slice(990, 2000))) == 10
+    with pytest.raises(ValueError):
+        dio.dataset_format(tmp_path.joinpath("Dualband_7.txt"))
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather"])
+def test_columnar_round_trip(tmp_path, dualband_df, fmt, monkeypatch):
+    """
+    Columnar datasets store typed columns, read back the CSV values in full and in part, and export to the same CSV
+    """
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(dio, "PARQUET_ROW_GROUP_SIZE", 64)
+    path = dio.dataset_path(tmp_path.joinpath("Dualband_7"), fmt)
+    dio.write_dataset(dualband_df, path)
+
+    pd.testing.assert_frame_equal(dio.read_dataset(path), dualband_df)
+
+    subset = dio.read_dataset(path, columns=["MW-B", "TH"], rows=(100, 300))
+    pd.testing.assert_frame_equal(subset, dualband_df[["MW-B", "TH"]].iloc[100:300].reset_index(drop=True))
+    assert len(dio.read_dataset(path, rows=(2000, 3000))) == 0
+
+    csv_path = tmp_path.joinpath("reference.csv")
+    dio.write_dataset(dualband_df, csv_path)
+    assert dio.export_csv(path).read_bytes() == csv_path.read_bytes()
+
+    float32_path = tmp_path.joinpath(f"Dualband_7_float32.{fmt}")
+    dio.write_dataset(dualband_df, float32_path, float_dtype="float32")
+    float32_df = dio.read_dataset(float32_path)
+    assert float32_df["LW-A"].dtype == np.float32
+    assert np.allclose(float32_df["LW-A"], dualband_df["LW-A"], rtol=1e-6)
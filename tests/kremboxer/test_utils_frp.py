@@ -0,0 +1,123 @@
+"""
+test_utils_frp - Test suite for kremboxer.utils.frp_utils
+
+Checks that the band products of simulated fiveband and UFM traces invert back to the simulated fire, and that the
+band map of the calibration drives the data columns and ratio pairs. Also checks that the legacy dualband pipeline
+gives the same product schema.
+"""
+
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+
+import kremboxer.krembox_dualband_frp as kdf
+import kremboxer.utils.frp_utils as fu
+import kremboxer.utils.simulation_utils as su
+import kremboxer.utils.thermistor_utils as tu
+
+cal_dir = Path(__file__).parents[2].joinpath("calibration_data", "calibration_output", "FortStewart2024")
+fiveband_cal_file = cal_dir.joinpath("fiveband", "FortStewart2024_Fiveband_2026-02-25T18-44-51.649500.json")
+dualband_cal_file = cal_dir.joinpath("FortStewart2024_Dualband_2024-05-29T15-14-51.702863.json")
+ufm_cal_file = cal_dir.joinpath("ufm", "FortStewart2024_UFM_2025-08-04T16-27-17.760636.json")
+
+
+def simulate_trace(model_params, bandpasses, detect_temp_cal_data, columns, thermistor_column, n_samples=500):
+    """
+    Simulated raw trace of every band with a bandpass, see `simulation_utils.simulate_dualband_trace`
+    """
+    T, eA, TD = su.simulate_fire_trace(n_samples, noise=0.05)
+    thermistor = tu.thermistor_from_cal_data(detect_temp_cal_data)
+    rad_data = pd.DataFrame({thermistor_column: su.thermistor_reading(thermistor, TD)})
+    for band, F in bandpasses.items():
+        p = model_params[band]
+        rad_data[columns[band]] = p["G"] * (eA * su.bandpass_energy_interpolator(F)(T) - p["AL"] * TD**p["N"])
+    return rad_data, T, TD
+
+
+def test_fiveband_products():
+    """
+    Each band is inverted from its own voltage, the MW/LW and 3.95/10.95 pairs both recover the simulated fire
+    """
+    model_params, detect_temp_cal_data, bandpasses = fu.load_band_calibration(fiveband_cal_file)
+    rad_data, T, TD = simulate_trace(model_params, bandpasses, detect_temp_cal_data,
+                                     fu.SENSOR_BAND_COLUMNS["Fiveband"], "TH1")
+    rad_data_proc = fu.compute_frp_products(rad_data, model_params, bandpasses, detect_temp_cal_data, "Fiveband")
+
+    assert list(rad_data_proc.columns[len(rad_data.columns):len(rad_data.columns) + 6]) == [
+        "T", "T_OUT_OF_RANGE", "T_NARROW", "T_NARROW_OUT_OF_RANGE", "TD", "TD_OUT_OF_RANGE"]
+    np.testing.assert_allclose(rad_data_proc["TD"], TD, atol=1e-9)
+    for band in ["3.95", "10.95", "WIDE"]:
+        p = model_params[band]
+        np.testing.assert_allclose(rad_data_proc[f"{band}_W"], rad_data[band] / p["G"] + p["AL"] * TD**p["N"])
+
+    for column in ["T", "T_NARROW"]:
+        detected = rad_data_proc[column].to_numpy() > 0
+        assert 0 < np.count_nonzero(detected)
+        np.testing.assert_allclose(rad_data_proc[column][detected], T[detected], rtol=1e-5)
+    assert "WIDE_FRP" not in rad_data_proc and "WIDE_eA" not in rad_data_proc
+
+
+def test_wide_band_frp():
+    """
+    A band outside of the ratio pairs with a "BandpassFraction" gives its FRP from the incident flux
+    """
+    model_params, detect_temp_cal_data, bandpasses = fu.load_band_calibration(ufm_cal_file)
+    rad_data, T, TD = simulate_trace(model_params, bandpasses, detect_temp_cal_data, fu.SENSOR_BAND_COLUMNS["UFM"],
+                                     "SensTH")
+    rad_data_proc = fu.compute_frp_products(rad_data, model_params, bandpasses, detect_temp_cal_data, "UFM")
+    assert list(rad_data_proc.columns[-3:]) == ["WIDE_FRP", "WIDE_W", "WIDE_V"]
+    np.testing.assert_allclose(rad_data_proc["WIDE_FRP"],
+                               rad_data_proc["WIDE_W"] / model_params["WIDE"]["BandpassFraction"])
+
+
+def test_band_map_overrides():
+    """
+    The calibration of a band names its data column and ratio pair, replacing the sensor defaults
+    """
+    model_params, detect_temp_cal_data, bandpasses = fu.load_band_calibration(fiveband_cal_file)
+    model_params["WIDE"]["ratio_denominator"] = "LW"
+    model_params["WIDE"]["ratio_name"] = "BROAD"
+    model_params["LW"]["column"] = "LW-CH2"
+    columns = fu.band_columns(model_params, "Fiveband")
+    assert columns["LW"] == "LW-CH2" and columns["MW"] == "MW"
+    assert fu.ratio_pairs(model_params) == [("BROAD", "WIDE", "LW")]
+
+    rad_data, T, TD = simulate_trace(model_params, bandpasses, detect_temp_cal_data, columns, "TH1")
+    rad_data_proc = fu.compute_frp_products(rad_data, model_params, bandpasses, detect_temp_cal_data, "Fiveband")
+    assert "T_BROAD" in rad_data_proc and "T" not in rad_data_proc
+    assert [c for c in rad_data_proc.columns if c.endswith("_eA")] == ["WIDE_eA", "LW_eA"]
+    detected = rad_data_proc["T_BROAD"].to_numpy() > 0
+    np.testing.assert_allclose(rad_data_proc["T_BROAD"][detected], T[detected], rtol=1e-5)
+
+    model_params["MW"]["ratio_denominator"] = "LW"
+    model_params["MW"]["ratio_name"] = "BROAD"
+    with pytest.raises(ValueError):
+        fu.ratio_pairs(model_params)
+
+
+def test_legacy_dualband_products():
+    """
+    The legacy dualband pipeline computes TD with the thermistor model of the calibration and its options, giving the
+    same products as the engine
+    """
+    model_params, detect_temp_cal_data, bandpasses = fu.load_band_calibration(dualband_cal_file)
+    rad_data, T, TD = simulate_trace(model_params, bandpasses, detect_temp_cal_data,
+                                     fu.SENSOR_BAND_COLUMNS["Dualband"], "TH")
+    rad_data.loc[0, "TH"] = detect_temp_cal_data["v_top"] * 0.999
+    rad_data_proc = kdf.compute_FRP(rad_data, bandpasses["MW"], bandpasses["LW"], model_params, detect_temp_cal_data)
+    pd.testing.assert_frame_equal(rad_data_proc, fu.compute_frp_products(rad_data, model_params, bandpasses,
+                                                                         detect_temp_cal_data, "Dualband"))
+    assert rad_data_proc["TD_OUT_OF_RANGE"].iloc[0] and not rad_data_proc["TD_OUT_OF_RANGE"].iloc[1:].any()
+
+
+    # The thermistor options apply to the calibrations loaded by the legacy pipeline
+    with open(dualband_cal_file) as fp:
+        cal_params = json.load(fp)
+    for key in ["temp_cal_input", "LW_bandpass", "MW_bandpass"]:
+        cal_params[key] = dualband_cal_file.parent.joinpath(cal_params[key])
+    model_params, detect_temp_cal_data, F_MW, F_LW = kdf.load_calibration_data(cal_params, {"out_of_range": "nan"})
+    rad_data_proc = kdf.compute_FRP(rad_data, F_MW, F_LW, model_params, detect_temp_cal_data)
+    assert np.isnan(rad_data_proc["TD"].iloc[0])
+    np.testing.assert_allclose(rad_data_proc["TD"].iloc[1:], TD[1:], atol=1e-9)
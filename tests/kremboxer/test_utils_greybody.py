@@ -0,0 +1,155 @@
+"""
+test_utils_greybody - Test suite for kremboxer.utils.greybody_utils
+
+Checks the fast temperature inversion and band integration routines against the
+scalar reference implementations.
+"""
+
+from pathlib import Path
+import pytest
+import numpy as np
+import scipy.optimize as so
+from scipy.integrate import quad
+
+import kremboxer.utils.greybody_utils as gbu
+
+cal_dir = Path(__file__).parents[2].joinpath("calibration_data", "calibration_output", "FortStewart2024")
+
+
+@pytest.fixture(scope="module")
+def bandpasses():
+    F_LW = np.loadtxt(cal_dir.joinpath("DC-6073_W1_8-14Si.csv"), delimiter=',', skiprows=1, usecols=[0, 1])
+    F_MW = np.loadtxt(cal_dir.joinpath("DC-6216_u1_Saph_longwave.csv"), delimiter=',', skiprows=1, usecols=[0, 1])
+    return F_MW, F_LW
+
+
+def test_ratio_table_matches_brentq(bandpasses):
+    """
+    Temperatures interpolated from the ratio table agree with brentq to within the table tolerance
+    """
+    F_MW, F_LW = bandpasses
+    table = gbu.build_ratio_table(F_MW, F_LW, tolerance=0.01)
+    assert table['max_error'] <= 0.01
+
+    T_actual = np.array([250.3, 480.7, 873.0, 1333.3, 1999.1])
+    ratios = np.array([gbu.GB_ratio_BP(T, F_MW, F_LW) for T in T_actual])
+    T_brentq = np.array([so.brentq(lambda Ts: gbu.GB_ratio_BP(Ts, F_MW, F_LW) - r, 200, 2000) for r in ratios])
+    T_table, in_range = gbu.invert_ratio_table(ratios, table)
+
+    assert in_range.all()
+    assert np.allclose(T_table, T_brentq, atol=0.01)
+
+
+def test_ratio_table_error_covers_every_midpoint(bandpasses):
+    """
+    The reported error is the largest over every grid midpoint, so a tolerance between the largest error and the
+    errors of a sample of the midpoints refines the table
+    """
+    F_MW, F_LW = bandpasses
+    table = gbu.build_ratio_table(F_MW, F_LW, tolerance=0.01)
+    t_mid = 0.5 * (table['T'][:-1] + table['T'][1:])
+    errors = np.abs(gbu.invert_ratio_table(gbu.GB_ratio_BP(t_mid, F_MW, F_LW), table)[0] - t_mid)
+    assert table['max_error'] == pytest.approx(errors.max(), abs=1e-9)
+
+    sampled_error = errors[::(len(t_mid)) // 50].max()
+    assert sampled_error < table['max_error']
+    refined = gbu.build_ratio_table(F_MW, F_LW, tolerance=0.5 * (sampled_error + table['max_error']))
+    assert len(refined['T']) > len(table['T']) and refined['max_error'] < sampled_error
+
+
+def test_ratio_table_flags_out_of_range(bandpasses):
+    """
+    Ratios outside of the table are flagged instead of raising
+    """
+    F_MW, F_LW = bandpasses
+    table = gbu.build_ratio_table(F_MW, F_LW)
+    r_min, r_max = np.exp(table['log_ratio'][[0, -1]])
+    T, in_range = gbu.invert_ratio_table([r_min / 2, -1.0, np.nan, r_max * 2, np.sqrt(r_min * r_max)], table)
+
+    assert list(in_range) == [False, False, False, False, True]
+    assert np.all(T[~in_range] == 0)
+
+
+def test_vectorized_bandpass_integration_matches_scalar(bandpasses):
+    """
+    Array temperatures give the same results as the scalar calls, independent of chunking
+    """
+    F_MW, F_LW = bandpasses
+    Ts = np.linspace(200, 2000, 37)
+    scalar_ratios = np.array([gbu.GB_ratio_BP(T, F_MW, F_LW) for T in Ts])
+    lams = F_LW[:, 0] * 10 ** (-6)
+    scalar_W = np.array([np.sum(gbu.GB_lambda(lams, T) * F_LW[:, 1]) * (lams[1] - lams[0]) for T in Ts])
+
+    assert np.ndim(gbu.GB_ratio_BP(800, F_MW, F_LW)) == 0
+    assert np.allclose(gbu.GB_ratio_BP(Ts, F_MW, F_LW, chunk_size=5), scalar_ratios, rtol=1e-12)
+    assert np.allclose(gbu.GB_bandpass_integral(Ts, F_LW), scalar_W, rtol=1e-12)
+    assert np.allclose(gbu.GB_lambda_window(2e-6, 5e-6, Ts[:3]),
+                       [gbu.GB_lambda_window(2e-6, 5e-6, T) for T in Ts[:3]], rtol=1e-12)
+
+
+def test_ratio_solver_matches_brentq(bandpasses):
+    """
+    The batched Newton/bisection solver reaches the same temperatures as brentq at full precision
+    """
+    F_MW, F_LW = bandpasses
+    ts = np.random.default_rng(0).uniform(200, 2000, 25)
+    ratios = gbu.GB_ratio_BP(ts, F_MW, F_LW)
+    t_brentq = np.array([so.brentq(lambda Ts: gbu.GB_ratio_BP(Ts, F_MW, F_LW) - r, 200, 2000) for r in ratios])
+
+    T, converged, iterations = gbu.solve_ratio_temperature(ratios, F_MW, F_LW)
+    assert converged.all()
+    assert np.all(iterations <= 5)
+    assert np.allclose(T, t_brentq, rtol=0, atol=1e-10)
+    assert np.allclose(T, ts, rtol=0, atol=1e-10)
+
+
+def test_ratio_solver_flags_out_of_range(bandpasses):
+    """
+    Ratios without a solution between t_min and t_max are returned as 0K and not converged
+    """
+    F_MW, F_LW = bandpasses
+    ratios = np.array([gbu.GB_ratio_BP(2500, F_MW, F_LW), gbu.GB_ratio_BP(900, F_MW, F_LW), np.nan, -1.0,
+                       0.5 * gbu.GB_ratio_BP(200, F_MW, F_LW)])
+    T, converged, iterations = gbu.solve_ratio_temperature(ratios, F_MW, F_LW, t_min=200, t_max=2000)
+    assert np.array_equal(converged, [False, True, False, False, False])
+    assert np.array_equal(T == 0, [True, False, True, True, True])
+    assert np.array_equal(iterations == 0, [True, False, True, True, True])
+    assert T[1] == pytest.approx(900, abs=1e-10)
+
+
+def test_analytic_window_matches_quadrature():
+    """
+    The series band integral agrees with adaptive quadrature to near machine precision, and with the 1nm reference sum
+    to within its discretization error
+    """
+    Ts = np.array([250., 600., 1200., 2500.])
+    for lam1, lam2 in [(3e-6, 5e-6), (8e-6, 14e-6), (1e-6, 30e-6)]:
+        W = gbu.GB_lambda_window(lam1, lam2, Ts)
+        W_quad = np.array([quad(lambda lam: gbu.GB_lambda(lam, T), lam1, lam2, epsrel=1e-13, epsabs=0, limit=200)[0]
+                           for T in Ts])
+        assert np.allclose(W, W_quad, rtol=1e-12, atol=0)
+        assert np.allclose(W, gbu.GB_lambda_window(lam1, lam2, Ts, method="riemann"), rtol=1e-3, atol=0)
+        assert np.allclose([gbu.GB_lambda_window(lam1, lam2, T) for T in Ts], W, rtol=1e-14, atol=0)
+
+    assert gbu.GB_lambda_cumulative(1e-2, 1000.) == pytest.approx(gbu.stefan_boltzmann(1000.), rel=1e-9)
+    with pytest.raises(ValueError):
+        gbu.GB_ratio(800, 3e-6, 5e-6, 8e-6, 14e-6, method="simpson")
+
+
+def test_planck_model_fit_matches_curve_fit(bandpasses):
+    """
+    The batched fit reaches at least the least squares optimum of curve_fit for every bandpass, and the log space fit
+    recovers an exact power law
+    """
+    ts = np.linspace(373., 1173., 9)
+    A, N, wd = gbu.fit_received_bandpass_energies(bandpasses, ts)
+    assert A.shape == N.shape == (2,) and wd.shape == (2, 9)
+    for i, F in enumerate(bandpasses):
+        (A_ref, N_ref), _ = so.curve_fit(gbu.planck_model, ts, wd[i])
+        assert N[i] == pytest.approx(N_ref, rel=1e-5)
+        ssr = np.sum((wd[i] - gbu.planck_model(ts, A[i], N[i]))**2)
+        assert ssr <= np.sum((wd[i] - gbu.planck_model(ts, A_ref, N_ref))**2) * (1 + 1e-9)
+        assert gbu.fit_received_bandpass_energy(F, ts)[:2] == (A[i], N[i])
+
+    A_log, N_log = gbu.fit_planck_model(ts, gbu.planck_model(ts, 3e-12, 5.4), space="log")
+    assert A_log == pytest.approx(3e-12, rel=1e-10) and N_log == pytest.approx(5.4, rel=1e-12)
@@ -0,0 +1,69 @@
+"""
+test_utils_index - Test suite for kremboxer.utils.index_utils
+
+Checks the sidecar dataset indexes of raw files and the reads of single datasets through them.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+import kremboxer.dualband.dualband_clean as dc
+import kremboxer.ufm.ufm_clean as uc
+import kremboxer.utils.index_utils as iu
+from test_dualband_clean import write_datlog
+from test_ufm_clean import write_ufm_datlog
+
+
+def test_dualband_index(tmp_path):
+    """
+    Indexed datasets match the full file parser, the sidecar index is reused until the file changes, and datasets are
+    selected by date and duration from the index alone
+    """
+    path = tmp_path.joinpath("DATLOG_07.CSV")
+    write_datlog(path, (50, 0, 120), "\r\n")
+    header_dicts, data_dfs = dc.extract_dualband_datasets_from_raw_file(path)
+
+    index = iu.load_dataset_index(path, "Dualband")
+    assert iu.index_path(path).is_file()
+    assert [entry["n_samples"] for entry in index["datasets"]] == [50, 0, 120]
+    for entry, header_dict, data_df in zip(index["datasets"], header_dicts, data_dfs):
+        assert iu.dataset_start(entry) == header_dict["DATETIME_START"]
+        indexed_header_dict, indexed_data_df = iu.read_indexed_dataset(path, "Dualband", entry)
+        assert indexed_header_dict == header_dict
+        pd.testing.assert_frame_equal(indexed_data_df, data_df)
+
+    assert [e["n_samples"] for e in iu.select_datasets(index)] == [50, 120]
+    assert [e["n_samples"] for e in iu.select_datasets(index, duration_cutoff=60)] == [120]
+    assert [e["n_samples"] for e in iu.select_datasets(index, burn_dates=["2024-02-27"])] == [50]
+
+    # A stale index is rebuilt, a current one is loaded from the sidecar
+    write_datlog(path, (20,))
+    os.utime(path, ns=(0, 0))
+    assert [entry["n_samples"] for entry in iu.load_dataset_index(path, "Dualband")["datasets"]] == [20]
+    with open(iu.index_path(path)) as fp:
+        assert json.load(fp)["mtime_ns"] == 0
+
+
+def test_ufm_index(tmp_path):
+    """
+    UFM datasets are indexed with their frame counts and read into memory mapped cubes, the index can be kept out of
+    the data directory
+    """
+    path = tmp_path.joinpath("DATLOG6.CSV")
+    write_ufm_datlog(path, n_frames=(30, 0, 45), rate=3, final_blank=False)
+    _, data_dfs, ir_image_cubes = uc.extract_ufm_datasets_from_raw_file(path)
+
+    index_dir = tmp_path.joinpath("index")
+    index = iu.load_dataset_index(path, "UFM", index_dir)
+    assert iu.index_path(path, index_dir).is_file() and not iu.index_path(path).exists()
+    assert [entry["n_samples"] for entry in index["datasets"]] == [30, 0, 45]
+    assert index["datasets"][2]["duration"] == 15
+
+    entries = iu.select_datasets(index, duration_cutoff=10)
+    assert len(entries) == 1
+    header_dict, data_df, ir_image_cube = iu.read_indexed_dataset(path, "UFM", entries[0], cube_dir=tmp_path)
+    assert isinstance(ir_image_cube, np.memmap)
+    assert np.array_equal(ir_image_cube, ir_image_cubes[1])
+    pd.testing.assert_frame_equal(data_df, data_dfs[1])
@@ -0,0 +1,53 @@
+"""
+test_utils_quadrature - Test suite for kremboxer.utils.quadrature_utils
+
+Checks the quadrature weights on non-uniform grids and their use in the bandpass integrals.
+"""
+
+from pathlib import Path
+import pytest
+import numpy as np
+
+import kremboxer.utils.greybody_utils as gbu
+import kremboxer.utils.quadrature_utils as qu
+
+cal_dir = Path(__file__).parents[2].joinpath("calibration_data", "calibration_output", "FortStewart2024")
+
+
+@pytest.mark.parametrize("n", [2, 3, 8, 41])
+def test_quadrature_weights_exact_for_polynomials(n):
+    """
+    Trapezoid weights integrate lines and Simpson weights integrate quadratics exactly on non-uniform grids
+    """
+    x = np.sort(np.random.default_rng(n).uniform(0, 3, n))
+    trapezoid = qu.quadrature_weights(x, "trapezoid")
+    assert np.sum(trapezoid * (2 * x - 1)) == pytest.approx((x[-1]**2 - x[-1]) - (x[0]**2 - x[0]))
+    if n >= 3:
+        simpson = qu.quadrature_weights(x, "simpson")
+        assert np.sum(simpson * (3 * x**2 - 2 * x)) == pytest.approx((x[-1]**3 - x[-1]**2) - (x[0]**3 - x[0]**2))
+
+    with pytest.raises(ValueError):
+        qu.quadrature_weights(x[::-1], "trapezoid")
+    with pytest.raises(ValueError):
+        qu.quadrature_weights(x, "gauss")
+
+
+def test_weighted_bandpass_integral():
+    """
+    Bandpasses without a weight column keep the legacy rectangle rule, weighted bandpasses use their weights, and
+    dropping zero weight wavelengths does not change the integral
+    """
+    F = np.loadtxt(cal_dir.joinpath("DC-6073_W1_8-14Si.csv"), delimiter=',', skiprows=1, usecols=[0, 1])
+    Ts = np.array([300., 900., 1800.])
+    W_rectangle = gbu.GB_bandpass_integral(Ts, F)
+    assert np.allclose(gbu.GB_bandpass_integral(Ts, qu.attach_quadrature_weights(F, "rectangle")), W_rectangle,
+                       rtol=1e-14)
+
+    F_trapezoid = qu.attach_quadrature_weights(F, "trapezoid")
+    F_trimmed = qu.attach_quadrature_weights(F, "trapezoid", drop_zero_weights=True)
+    assert len(F_trimmed) < len(F)
+    assert np.allclose(gbu.GB_bandpass_integral(Ts, F_trimmed), gbu.GB_bandpass_integral(Ts, F_trapezoid), rtol=1e-14)
+
+    # The rules only differ by half the transmission at the ends of the bandpass, which is close to zero
+    assert np.allclose(gbu.GB_bandpass_integral(Ts, F_trapezoid), W_rectangle, rtol=1e-5)
+    assert qu.quadrature_error_estimate(F, "simpson") < qu.quadrature_error_estimate(F, "trapezoid")
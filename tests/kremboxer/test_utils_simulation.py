@@ -0,0 +1,29 @@
+"""
+test_utils_simulation - Test suite for kremboxer.utils.simulation_utils
+
+Checks that simulated dualband traces are inverted back to the simulated fire by the FRP computation.
+"""
+
+from pathlib import Path
+import numpy as np
+
+import kremboxer.dualband.dualband_process as dp
+import kremboxer.utils.simulation_utils as su
+
+cal_dir = Path(__file__).parents[2].joinpath("calibration_data", "calibration_output", "FortStewart2024")
+cal_file = cal_dir.joinpath("FortStewart2024_Dualband_2024-09-18T15-52-17.839307.json")
+
+
+def test_simulated_trace_roundtrip():
+    """
+    compute_FRP recovers the simulated detector temperature and, wherever both sensors see the fire, the simulated
+    target temperature
+    """
+    model_params, detect_temp_cal_data, F_MW, F_LW = dp.load_dualband_calibration_data(cal_file)
+    rad_data = su.simulate_dualband_trace(2000, F_MW, F_LW, model_params, detect_temp_cal_data, noise=0.05)
+    rad_data_proc = dp.compute_FRP(rad_data, F_MW, F_LW, model_params, detect_temp_cal_data)
+
+    assert np.allclose(rad_data_proc["TD"], rad_data["TD_TRUE"], atol=1e-9)
+    detected = rad_data_proc["T"].to_numpy() > 0
+    assert 0 < np.count_nonzero(detected) < len(detected)
+    assert np.allclose(rad_data_proc["T"][detected], rad_data["T_TRUE"][detected], atol=1e-6)
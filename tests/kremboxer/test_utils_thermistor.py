@@ -0,0 +1,67 @@
+"""
+test_utils_thermistor - Test suite for kremboxer.utils.thermistor_utils
+
+Checks the detector temperature sensor model against the legacy lookup and its handling of out of range readings.
+"""
+
+from pathlib import Path
+import pytest
+import numpy as np
+
+import kremboxer.utils.greybody_utils as gbu
+import kremboxer.utils.thermistor_utils as tu
+
+cal_dir = Path(__file__).parents[2].joinpath("calibration_data", "calibration_output", "FortStewart2024")
+lookup_path = cal_dir.joinpath("temperature_sensor_calibration.csv")
+v_top, r_top = 3300, 100000
+
+
+def test_thermistor_matches_lookup():
+    """
+    Inside of the lookup table the model reproduces the legacy divider and lookup computation
+    """
+    lookup = np.flip(np.loadtxt(lookup_path, skiprows=1, delimiter=",", usecols=[0, 1, 2]), 0)
+    R = np.linspace(lookup[0, 2], lookup[-1, 2], 1001)
+    mV = R * v_top / (R + r_top)
+    R_legacy = mV * r_top / (v_top - mV)
+
+    thermistor = tu.ThermistorModel.from_csv(lookup_path, v_top, r_top)
+    T, in_range = thermistor.temperature(mV, return_in_range=True)
+    assert np.allclose(T, gbu.detector_temperature_lookup(R_legacy, lookup), rtol=1e-12, atol=1e-9)
+    assert in_range[1:-1].all()
+
+    steinhart_hart = tu.ThermistorModel.from_csv(lookup_path, v_top, r_top, method="steinhart-hart")
+    assert np.max(np.abs(steinhart_hart.temperature(mV) - T)) < 0.5
+
+    single = tu.ThermistorModel.from_csv(lookup_path, v_top, r_top, dtype=np.float32).temperature(mV)
+    assert single.dtype == np.float32
+    assert np.allclose(single, T, atol=1e-2)
+
+
+def test_thermistor_out_of_range():
+    """
+    Readings beyond the table, including a disconnected sensor at the divider voltage, are clipped, set to nan, or
+    raise depending on the policy
+    """
+    mV = np.array([1.0, 1650.0, v_top, v_top + 10.0])
+    clip = tu.ThermistorModel.from_csv(lookup_path, v_top, r_top)
+    T, in_range = clip.temperature(mV, return_in_range=True)
+    assert np.array_equal(in_range, [False, True, False, False])
+    assert np.all(np.isfinite(T))
+    assert T[2] == T[3] == clip.T[-1] or T[2] == T[3] == clip.T[0]
+
+    T_nan = tu.ThermistorModel.from_csv(lookup_path, v_top, r_top, out_of_range="nan").temperature(mV)
+    assert np.array_equal(np.isnan(T_nan), ~in_range)
+    assert T_nan[1] == T[1]
+
+    with pytest.raises(ValueError):
+        tu.ThermistorModel.from_csv(lookup_path, v_top, r_top, out_of_range="raise").temperature(mV)
+
+
+def test_get_thermistor_is_shared():
+    """
+    Calibrations using the same lookup table and options share one model
+    """
+    a = tu.get_thermistor(lookup_path, v_top, r_top)
+    assert tu.get_thermistor(lookup_path, v_top, r_top) is a
+    assert tu.get_thermistor(lookup_path, v_top, r_top, out_of_range="nan") is not a